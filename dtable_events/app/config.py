@@ -45,6 +45,11 @@ try:
     TRASH_CLEAN_AFTER_DAYS = getattr(seahub_settings, 'TRASH_CLEAN_AFTER_DAYS', 30)
     LICENSE_PATH = getattr(seahub_settings, 'LICENSE_PATH', '/shared/seatable-license.txt')
     IS_PRO_VERSION = getattr(seahub_settings, 'IS_PRO_VERSION', False)
+    DTABLE_DB_QUERY_PREFETCH_DEPTH = getattr(seahub_settings, 'DTABLE_DB_QUERY_PREFETCH_DEPTH', 2)
+    METADATA_REQUEST_FRESH_SECONDS = getattr(seahub_settings, 'METADATA_REQUEST_FRESH_SECONDS', 0)
+    REQUEST_BODY_COMPRESSION = getattr(seahub_settings, 'REQUEST_BODY_COMPRESSION', '')  # '', 'gzip' or 'zstd'
+    REQUEST_BODY_COMPRESSION_MIN_SIZE = getattr(seahub_settings, 'REQUEST_BODY_COMPRESSION_MIN_SIZE', 100 * 1024)
+    IMPORT_GUESS_TYPE_SAMPLE_SIZE = getattr(seahub_settings, 'IMPORT_GUESS_TYPE_SAMPLE_SIZE', 200)
 except Exception as e:
     logger.critical("Can not import dtable_web settings: %s." % e)
     raise RuntimeError("Can not import dtable_web settings: %s" % e)
@@ -31,6 +31,8 @@ from dtable_events.utils.dtable_web_api import DTableWebAPI
 from dtable_events.utils.dtable_db_api import DTableDBAPI, RowsQueryError, Request429Error
 from dtable_events.notification_rules.utils import get_nickname_by_usernames
 from dtable_events.utils.sql_generator import filter2sql, BaseSQLGenerator, ColumnFilterInvalidError
+from dtable_events.utils.token_cache import get_dtable_access_token
+from dtable_events.utils.bulk_writer import AdaptiveBatchWriter
 from dtable_events.utils.universal_app_api import UniversalAppAPI
 
 
@@ -2500,13 +2502,13 @@ class CalculateAction(BaseAction):
         self.init_updates()
 
         table_name = self.auto_rule.table_info.get('name')
-        step = 1000
-        for i in range(0, len(self.update_rows), step):
-            try:
-                self.auto_rule.dtable_server_api.batch_update_rows(table_name, self.update_rows[i: i+step])
-            except Exception as e:
-                logger.error('batch update dtable: %s, error: %s', self.auto_rule.dtable_uuid, e)
-                return
+        writer = AdaptiveBatchWriter(lambda rows: self.auto_rule.dtable_server_api.batch_update_rows(table_name, rows),
+                                     idempotent=True)
+        try:
+            writer.write(self.update_rows)
+        except Exception as e:
+            logger.error('batch update dtable: %s, error: %s', self.auto_rule.dtable_uuid, e)
+            return
         self.auto_rule.set_done_actions()
 
 
@@ -2688,13 +2690,13 @@ class LookupAndCopyAction(BaseAction):
             return
         self.init_updates()
 
-        step = 1000
-        for i in range(0, len(self.update_rows), step):
-            try:
-                self.auto_rule.dtable_server_api.batch_update_rows(self.copy_to_table_name, self.update_rows[i: i + step])
-            except Exception as e:
-                logger.error('batch update dtable: %s, error: %s', self.auto_rule.dtable_uuid, e)
-                return
+        writer = AdaptiveBatchWriter(lambda rows: self.auto_rule.dtable_server_api.batch_update_rows(self.copy_to_table_name, rows),
+                                     idempotent=True)
+        try:
+            writer.write(self.update_rows)
+        except Exception as e:
+            logger.error('batch update dtable: %s, error: %s', self.auto_rule.dtable_uuid, e)
+            return
         self.auto_rule.set_done_actions()
 
 
@@ -2833,13 +2835,13 @@ class ExtractUserNameAction(BaseAction):
         self.init_updates()
 
         table_name = self.auto_rule.table_info.get('name')
-        step = 1000
-        for i in range(0, len(self.update_rows), step):
-            try:
-                self.auto_rule.dtable_server_api.batch_update_rows(table_name, self.update_rows[i: i+step])
-            except Exception as e:
-                logger.error('batch update dtable: %s, error: %s', self.auto_rule.dtable_uuid, e)
-                return
+        writer = AdaptiveBatchWriter(lambda rows: self.auto_rule.dtable_server_api.batch_update_rows(table_name, rows),
+                                     idempotent=True)
+        try:
+            writer.write(self.update_rows)
+        except Exception as e:
+            logger.error('batch update dtable: %s, error: %s', self.auto_rule.dtable_uuid, e)
+            return
         self.auto_rule.set_done_actions()
 
 
@@ -2931,7 +2933,6 @@ class AutomationRule:
         self._table_info = None
         self._view_info = None
         self._dtable_metadata = None
-        self._access_token = None
         self._view_columns = None
         self.can_run_python = None
         self.scripts_running_limit = None
@@ -2969,17 +2970,7 @@ class AutomationRule:
     @property
     def access_token(self):
 
-        if not self._access_token:
-            self._access_token = jwt.encode(
-                payload={
-                    'exp': int(time.time()) + 300,
-                    'dtable_uuid': uuid_str_to_36_chars(self.dtable_uuid),
-                    'username': 'Automation Rule',
-                    'permission': 'rw',
-                },
-                key=DTABLE_PRIVATE_KEY
-            )
-        return self._access_token
+        return get_dtable_access_token(uuid_str_to_36_chars(self.dtable_uuid), 'Automation Rule', timeout=300)
 
     @property
     def headers(self):
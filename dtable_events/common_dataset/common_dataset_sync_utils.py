@@ -3,6 +3,7 @@ import logging
 import re
 from copy import deepcopy
 from datetime import datetime
+from itertools import count
 
 from sqlalchemy import text
 from dateutil import parser
@@ -13,7 +14,9 @@ from dtable_events.app.config import INNER_DTABLE_DB_URL
 from dtable_events.utils import get_inner_dtable_server_url, uuid_str_to_36_chars
 from dtable_events.utils.constants import ColumnTypes
 from dtable_events.utils.dtable_server_api import BaseExceedsException, DTableServerAPI
-from dtable_events.utils.dtable_db_api import DTableDBAPI
+from dtable_events.utils.bulk_writer import AdaptiveBatchWriter
+from dtable_events.utils.dtable_db_api import DTableDBAPI, prefetch_pages
+from dtable_events.utils.task_context import check_task_cancelled
 
 logger = logging.getLogger(__name__)
 
@@ -716,52 +719,57 @@ def create_dst_table_or_update_columns(dst_dtable_uuid, dst_table_id, dst_table_
 
 
 def append_dst_rows(dst_dtable_uuid, dst_table_name, to_be_appended_rows, dst_dtable_server_api):
-    step = INSERT_UPDATE_ROWS_LIMIT
-    for i in range(0, len(to_be_appended_rows), step):
-        try:
-            dst_dtable_server_api.batch_append_rows(dst_table_name, to_be_appended_rows[i: i+step], need_convert_back=False)
-        except BaseExceedsException as e:
-            return {
-                'dst_table_id': None,
-                'error_msg': e.error_msg,
-                'error_type': e.error_type,
-                'task_status_code': 400
-            }
-        except Exception as e:
-            logger.error('sync dataset append rows dst dtable: %s dst table: %s error: %s', dst_dtable_uuid, dst_table_name, e)
-            return {
-                'dst_table_id': None,
-                'error_msg': 'append rows error',
-                'task_status_code': 500
-            }
+    writer = AdaptiveBatchWriter(
+        lambda rows: dst_dtable_server_api.batch_append_rows(dst_table_name, rows, need_convert_back=False),
+        max_batch_size=INSERT_UPDATE_ROWS_LIMIT
+    )
+    try:
+        writer.write(to_be_appended_rows)
+    except BaseExceedsException as e:
+        return {
+            'dst_table_id': None,
+            'error_msg': e.error_msg,
+            'error_type': e.error_type,
+            'task_status_code': 400
+        }
+    except Exception as e:
+        logger.error('sync dataset append rows dst dtable: %s dst table: %s error: %s', dst_dtable_uuid, dst_table_name, e)
+        return {
+            'dst_table_id': None,
+            'error_msg': 'append rows error',
+            'task_status_code': 500
+        }
 
 
 def update_dst_rows(dst_dtable_uuid, dst_table_name, to_be_updated_rows, dst_dtable_server_api):
-    step = INSERT_UPDATE_ROWS_LIMIT
-    for i in range(0, len(to_be_updated_rows), step):
-        updates = []
-        for row in to_be_updated_rows[i: i+step]:
-            row_id = row.pop('_id', None)
-            updates.append({
-                'row_id': row_id,
-                'row': row
-            })
-        try:
-            dst_dtable_server_api.batch_update_rows(dst_table_name, updates, need_convert_back=False)
-        except BaseExceedsException as e:
-            return {
-                'dst_table_id': None,
-                'error_msg': e.error_msg,
-                'error_type': e.error_type,
-                'task_status_code': 400
-            }
-        except Exception as e:
-            logger.error('sync dataset update rows dst dtable: %s dst table: %s error: %s', dst_dtable_uuid, dst_table_name, e)
-            return {
-                'dst_table_id': None,
-                'error_msg': 'update rows error',
-                'task_status_code': 500
-            }
+    updates = []
+    for row in to_be_updated_rows:
+        row_id = row.pop('_id', None)
+        updates.append({
+            'row_id': row_id,
+            'row': row
+        })
+    writer = AdaptiveBatchWriter(
+        lambda rows: dst_dtable_server_api.batch_update_rows(dst_table_name, rows, need_convert_back=False),
+        max_batch_size=INSERT_UPDATE_ROWS_LIMIT,
+        idempotent=True
+    )
+    try:
+        writer.write(updates)
+    except BaseExceedsException as e:
+        return {
+            'dst_table_id': None,
+            'error_msg': e.error_msg,
+            'error_type': e.error_type,
+            'task_status_code': 400
+        }
+    except Exception as e:
+        logger.error('sync dataset update rows dst dtable: %s dst table: %s error: %s', dst_dtable_uuid, dst_table_name, e)
+        return {
+            'dst_table_id': None,
+            'error_msg': 'update rows error',
+            'task_status_code': 500
+        }
 
 
 def delete_dst_rows(dst_dtable_uuid, dst_table_name, to_be_deleted_row_ids, dst_dtable_server_api):
@@ -826,29 +834,36 @@ def get_dataset_data(src_dtable_uuid, src_table, src_view_id, server_only=True):
     rows_id_list, rows_dict = list(), dict()
     src_columns_str = ', '.join(map(lambda col: f"`{col['name']}`", src_columns))
     sql_template = f"SELECT `_id`, {src_columns_str} FROM `{src_table['name']}` {filter_clause or ''} {sort_clause or ''}"
-    start, step = 0, 10000
-    while True:
+    step = 10000
+
+    def query_page(start):
         sql = f"{sql_template} LIMIT {start}, {step}"
         logger.debug('fetch src dtable: %s table: %s view: %s sql: %s', src_dtable_uuid, src_table['name'], src_view['_id'], sql[:200])
         try:
             rows, _ = src_dtable_db_api.query(sql, convert=False, server_only=server_only)
         except Exception as e:
             logger.error('fetch src dtable: %s table: %s view: %s sql: %s error: %s', src_dtable_uuid, src_table['name'], src_view['_id'], sql[:200], e)
-            return None, {
-                'dst_table_id': None,
-                'error_msg': 'fetch src rows id error: %s' % e,
-                'task_status_code': 500
-            }
-        for row in rows:
-            if row['_id'] in rows_dict:
-                continue
-            rows_dict[row['_id']] = row
-            rows_id_list.append(row['_id'])
-            if len(rows_id_list) >= SRC_ROWS_LIMIT:
+            raise
+        return rows
+
+    # fetch next pages from dtable-db while handling current page
+    try:
+        for _, rows in prefetch_pages(query_page, count(0, step)):
+            for row in rows:
+                if row['_id'] in rows_dict:
+                    continue
+                rows_dict[row['_id']] = row
+                rows_id_list.append(row['_id'])
+                if len(rows_id_list) >= SRC_ROWS_LIMIT:
+                    break
+            if len(rows) < step or len(rows_id_list) >= SRC_ROWS_LIMIT:
                 break
-        if len(rows) < step or len(rows_id_list) >= SRC_ROWS_LIMIT:
-            break
-        start += step
+    except Exception as e:
+        return None, {
+            'dst_table_id': None,
+            'error_msg': 'fetch src rows id error: %s' % e,
+            'task_status_code': 500
+        }
     dataset_data = {'rows_id_list': rows_id_list, 'rows_dict': rows_dict}
     return dataset_data, None
 
@@ -909,6 +924,7 @@ def import_sync_CDS(context):
     dst_rows_id_set = set()
     start, step = 0, 10000
     while is_sync and True:
+        check_task_cancelled()
         sql = f"SELECT `_id` FROM `{dst_table_name}` LIMIT {start}, {step}"
         logger.debug('fetch dst rows-id sql: %s', sql[:200])
         try:
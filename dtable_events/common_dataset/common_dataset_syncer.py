@@ -1,17 +1,15 @@
 import logging
-import time
 from collections import defaultdict
 from datetime import datetime, timedelta
 from threading import Thread
 
-import jwt
 from apscheduler.schedulers.blocking import BlockingScheduler
 from sqlalchemy import text
 
 from dtable_events import init_db_session_class
-from dtable_events.app.config import DTABLE_PRIVATE_KEY
 from dtable_events.common_dataset.common_dataset_sync_utils import batch_sync_common_dataset
 from dtable_events.utils import get_opt_from_conf_or_env, parse_bool
+from dtable_events.utils.token_cache import get_dtable_access_token
 
 class CommonDatasetSyncer(object):
 
@@ -43,15 +41,7 @@ class CommonDatasetSyncer(object):
 
 def get_dtable_server_header(dtable_uuid):
     try:
-        access_token = jwt.encode({
-            'dtable_uuid': dtable_uuid,
-            'username': 'dtable-events',
-            'permission': 'rw',
-            'exp': int(time.time()) + 60
-        },
-            DTABLE_PRIVATE_KEY,
-            algorithm='HS256'
-        )
+        access_token = get_dtable_access_token(dtable_uuid, 'dtable-events', timeout=60)
     except Exception as e:
         logging.error(e)
         return
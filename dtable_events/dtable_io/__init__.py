@@ -12,13 +12,14 @@ from email.mime.text import MIMEText
 from email.utils import formataddr, parseaddr
 from urllib import parse
 from datetime import datetime
+from zipfile import ZipFile, ZIP_DEFLATED
 
 from seaserv import seafile_api
 
 from dtable_events.app.config import DTABLE_WEB_SERVICE_URL
 from dtable_events.dtable_io.big_data import import_excel_to_db, update_excel_to_db, export_big_data_to_excel
 from dtable_events.dtable_io.utils import setup_logger, \
-    prepare_asset_file_folder, post_dtable_json, post_asset_files, \
+    download_asset_zip, post_dtable_json, post_asset_files, \
     download_files_to_path, create_forms_from_src_dtable, copy_src_forms_to_json, \
     prepare_dtable_json_from_memory, update_page_design_static_image, \
     copy_src_auto_rules_to_json, create_auto_rules_from_src_dtable, sync_app_users_to_table, \
@@ -39,6 +40,7 @@ from dtable_events.utils import get_inner_dtable_server_url, is_valid_email, uui
 from dtable_events.utils.dtable_server_api import DTableServerAPI
 from dtable_events.utils.exception import BaseSizeExceedsLimitError, ExcelFormatError
 from dtable_events.dtable_io.utils import clear_tmp_dir, clear_tmp_file, clear_tmp_files_and_dirs
+from dtable_events.utils.task_context import TaskCancelledError, report_task_progress, register_task_tmp_path
 
 dtable_io_logger = setup_logger('dtable_events_io.log')
 dtable_message_logger = setup_logger('dtable_events_message.log')
@@ -48,14 +50,16 @@ dtable_plugin_email_logger = setup_logger('dtable_events_plugin_email.log')
 
 def get_dtable_export_content(username, repo_id, workspace_id, dtable_uuid, asset_dir_id, config):
     """
-    1. prepare file content at /tmp/dtable-io/<dtable_id>/dtable_asset/...
-    2. make zip file
+    1. download asset zip from file server to /tmp/dtable-io/<dtable_id>/zip_file.zip
+    2. append content.json, forms, automation rules... to the zip
     3. return zip file's content
+
+    assets are never extracted, they stay in the zip downloaded from file server
     """
     dtable_io_logger.info('Start prepare /tmp/dtable-io/{}/zip_file.zip for export DTable.'.format(dtable_uuid))
 
     tmp_file_path = os.path.join('/tmp/dtable-io', dtable_uuid,
-                                 'dtable_asset/')  # used to store asset files and json from file_server
+                                 'dtable_asset/')  # used by the previous exports, cleared only
     tmp_zip_path = os.path.join('/tmp/dtable-io', dtable_uuid, 'zip_file') + '.zip'  # zip path of zipped xxx.dtable
 
     try:
@@ -67,79 +71,78 @@ def get_dtable_export_content(username, repo_id, workspace_id, dtable_uuid, asse
 
     dtable_io_logger.info('Clear tmp dirs and files before prepare.')
     clear_tmp_files_and_dirs(tmp_file_path, tmp_zip_path)
-    os.makedirs(tmp_file_path, exist_ok=True)
-    # import here to avoid circular dependency
-
-    # 1. create 'content.json' from 'xxx.dtable'
-    dtable_io_logger.info('Create content.json file.')
-    try:
-        prepare_dtable_json_from_memory(workspace_id, dtable_uuid, username)
-    except Exception as e:
-        dtable_io_logger.error('prepare dtable json failed. ERROR: {}'.format(e))
-        raise Exception('prepare dtable json failed. ERROR: {}'.format(e))
+    register_task_tmp_path(tmp_zip_path)
+    os.makedirs(os.path.dirname(tmp_zip_path), exist_ok=True)
 
-    # 2. get asset file folder, asset could be empty
+    # 1. get asset zip as the base of export zip, asset could be empty
+    zip_mode = 'w'
     if asset_dir_id:
-        dtable_io_logger.info('Create asset dir.')
+        dtable_io_logger.info('Download asset zip.')
+        report_task_progress({'step': 'asset'})
         try:
-            prepare_asset_file_folder(username, repo_id, dtable_uuid, asset_dir_id)
+            if download_asset_zip(username, repo_id, asset_dir_id, tmp_zip_path):
+                zip_mode = 'a'
+        except TaskCancelledError:
+            raise
         except Exception as e:
-            dtable_io_logger.warning('create asset folder failed. ERROR: {}'.format(e))
-
-    # 3. copy forms
-    try:
-        copy_src_forms_to_json(dtable_uuid, tmp_file_path, db_session)
-    except Exception as e:
-        dtable_io_logger.error('copy forms failed. ERROR: {}'.format(e))
-        raise Exception('copy forms failed. ERROR: {}'.format(e))
-    finally:
-        if db_session:
-            db_session.close()
-
-    # 4. copy automation rules
-    try:
-        copy_src_auto_rules_to_json(dtable_uuid, tmp_file_path, db_session)
-    except Exception as e:
-        dtable_io_logger.error('copy automation rules failed. ERROR: {}'.format(e))
-        raise Exception('copy automation rules failed. ERROR: {}'.format(e))
-    finally:
-        if db_session:
-            db_session.close()
-
-    # 5. copy workflows
-    try:
-        copy_src_workflows_to_json(dtable_uuid, tmp_file_path, db_session)
-    except Exception as e:
-        dtable_io_logger.error('copy workflows failed. ERROR: {}'.format(e))
-        raise Exception('copy workflows failed. ERROR: {}'.format(e))
-    finally:
-        if db_session:
-            db_session.close()
-
-    # 5. copy external app
-    try:
-        copy_src_external_app_to_json(dtable_uuid, tmp_file_path, db_session)
-    except Exception as e:
-        dtable_io_logger.error('copy external apps failed. ERROR: {}'.format(e))
-        raise Exception('copy external apps failed. ERROR: {}'.format(e))
-    finally:
-        if db_session:
-            db_session.close()
+            dtable_io_logger.warning('download asset zip failed. ERROR: {}'.format(e))
 
     """
-    /tmp/dtable-io/<dtable_uuid>/dtable_asset/
+    /tmp/dtable-io/<dtable_uuid>/zip_file.zip
                                     |- asset/
                                     |- content.json
-
-    we zip /tmp/dtable-io/<dtable_uuid>/dtable_asset/ to /tmp/dtable-io/<dtable_id>/zip_file.zip and download it
-    notice than make_archive will auto add .zip suffix to /tmp/dtable-io/<dtable_id>/zip_file
+                                    |- forms.json ...
     """
-    dtable_io_logger.info('Make zip file for download...')
-    try:
-        shutil.make_archive('/tmp/dtable-io/' + dtable_uuid + '/zip_file', "zip", root_dir=tmp_file_path)
-    except Exception as e:
-        dtable_io_logger.error('make zip failed. ERROR: {}'.format(e))
-        raise Exception('make zip failed. ERROR: {}'.format(e))
+    with ZipFile(tmp_zip_path, zip_mode, compression=ZIP_DEFLATED, allowZip64=True) as zip_file:
+        # 2. create 'content.json' from 'xxx.dtable'
+        dtable_io_logger.info('Create content.json file.')
+        report_task_progress({'step': 'content'})
+        try:
+            prepare_dtable_json_from_memory(workspace_id, dtable_uuid, username, zip_file)
+        except Exception as e:
+            dtable_io_logger.error('prepare dtable json failed. ERROR: {}'.format(e))
+            raise Exception('prepare dtable json failed. ERROR: {}'.format(e))
+
+        report_task_progress({'step': 'zip'})
+        # 3. copy forms
+        try:
+            copy_src_forms_to_json(dtable_uuid, zip_file, db_session)
+        except Exception as e:
+            dtable_io_logger.error('copy forms failed. ERROR: {}'.format(e))
+            raise Exception('copy forms failed. ERROR: {}'.format(e))
+        finally:
+            if db_session:
+                db_session.close()
+
+        # 4. copy automation rules
+        try:
+            copy_src_auto_rules_to_json(dtable_uuid, zip_file, db_session)
+        except Exception as e:
+            dtable_io_logger.error('copy automation rules failed. ERROR: {}'.format(e))
+            raise Exception('copy automation rules failed. ERROR: {}'.format(e))
+        finally:
+            if db_session:
+                db_session.close()
+
+        # 5. copy workflows
+        try:
+            copy_src_workflows_to_json(dtable_uuid, zip_file, db_session)
+        except Exception as e:
+            dtable_io_logger.error('copy workflows failed. ERROR: {}'.format(e))
+            raise Exception('copy workflows failed. ERROR: {}'.format(e))
+        finally:
+            if db_session:
+                db_session.close()
+
+        # 5. copy external app
+        try:
+            copy_src_external_app_to_json(dtable_uuid, zip_file, db_session)
+        except Exception as e:
+            dtable_io_logger.error('copy external apps failed. ERROR: {}'.format(e))
+            raise Exception('copy external apps failed. ERROR: {}'.format(e))
+        finally:
+            if db_session:
+                db_session.close()
 
     dtable_io_logger.info('Create /tmp/dtable-io/{}/zip_file.zip success!'.format(dtable_uuid))
     # we remove '/tmp/dtable-io/<dtable_uuid>' in dtable web api
@@ -837,11 +840,16 @@ def convert_page_to_pdf(dtable_uuid, page_id, row_id):
         driver.quit()
 
 
-def convert_view_to_execl(dtable_uuid, table_id, view_id, username, id_in_org, user_department_ids_map, permission, name, repo_id, is_support_image=False):
+def convert_view_to_execl(dtable_uuid, table_id, view_id, username, id_in_org, user_department_ids_map, permission, name, repo_id, is_support_image=False,
+                          file_type='xlsx'):
+    """
+    :param file_type: xlsx, csv or parquet, rows of grouped views are not grouped in csv and parquet files
+    """
     from dtable_events.dtable_io.utils import get_metadata_from_dtable_server, get_view_rows_from_dtable_server
-    from dtable_events.dtable_io.excel import write_xls_with_type, TEMP_EXPORT_VIEW_DIR, IMAGE_TMP_DIR
+    from dtable_events.dtable_io.excel import write_xls_with_type, add_images_to_excel, iter_grouped_view_rows, \
+        TEMP_EXPORT_VIEW_DIR, IMAGE_TMP_DIR
+    from dtable_events.dtable_io.export_writers import open_export_workbook
     from dtable_events.dtable_io.utils import get_related_nicknames_from_dtable, escape_sheet_name
-    import openpyxl
 
     target_dir = TEMP_EXPORT_VIEW_DIR + dtable_uuid
     if not os.path.isdir(target_dir):
@@ -899,20 +907,25 @@ def convert_view_to_execl(dtable_uuid, table_id, view_id, username, id_in_org, u
             summary_col_info.update({col.get('name'): summary_configs.get(col.get('key'))})
 
     images_target_dir = os.path.join(IMAGE_TMP_DIR, dtable_uuid, str(uuid.uuid4()))
-    image_param = {'num': 0, 'is_support': is_support_image, 'images_target_dir': images_target_dir}
+    image_param = {'num': 0, 'is_support': is_support_image and file_type == 'xlsx', 'images_target_dir': images_target_dir}
+    register_task_tmp_path(images_target_dir)
 
     sheet_name = table_name + ('_' + view_name if view_name else '')
     sheet_name = escape_sheet_name(sheet_name)
-    excel_name = name + '_' + table_name + ('_' + view_name if view_name else '') + '.xlsx'
-
-    wb = openpyxl.Workbook(write_only=True)
-    ws = wb.create_sheet(sheet_name)
+    excel_name = name + '_' + table_name + ('_' + view_name if view_name else '') + '.' + file_type
+    target_path = os.path.join(target_dir, excel_name)
 
     res_json = get_view_rows_from_dtable_server(dtable_uuid, table_id, view_id, username, id_in_org, user_department_ids_map, permission, table_name, view_name)
     dtable_rows = res_json.get('rows', [])
 
     column_name_to_column = {col.get('name'): col for col in cols}
     is_group_view = bool(target_view.get('groupbys'))
+    if is_group_view and file_type != 'xlsx':
+        dtable_rows = list(iter_grouped_view_rows(dtable_rows))
+        is_group_view = False
+
+    wb = open_export_workbook(file_type, target_path, cols_without_hidden)
+    ws = wb.create_sheet(sheet_name)
 
     params = (dtable_rows, email2nickname, ws, 0, dtable_uuid, repo_id, image_param, cols_without_hidden, column_name_to_column, is_group_view, summary_col_info, row_height, header_height)
 
@@ -921,9 +934,10 @@ def convert_view_to_execl(dtable_uuid, table_id, view_id, username, id_in_org, u
     except Exception as e:
         dtable_io_logger.exception(e)
         dtable_io_logger.error('head_list = {}\n{}'.format(cols_without_hidden, e))
+        wb.discard()
         return
-    target_path = os.path.join(target_dir, excel_name)
-    wb.save(target_path)
+    add_images_to_excel(ws, dtable_uuid, repo_id, image_param)
+    wb.close()
     # remove tmp images
     try:
         shutil.rmtree(images_target_dir)
@@ -931,11 +945,14 @@ def convert_view_to_execl(dtable_uuid, table_id, view_id, username, id_in_org, u
         pass
 
 
-def convert_table_to_execl(dtable_uuid, table_id, username, permission, name, repo_id, is_support_image=False):
+def convert_table_to_execl(dtable_uuid, table_id, username, permission, name, repo_id, is_support_image=False, file_type='xlsx'):
+    """
+    :param file_type: xlsx, csv or parquet
+    """
     from dtable_events.dtable_io.utils import get_metadata_from_dtable_server, get_rows_from_dtable_server
-    from dtable_events.dtable_io.excel import write_xls_with_type, IMAGE_TMP_DIR
+    from dtable_events.dtable_io.excel import write_xls_with_type, add_images_to_excel, IMAGE_TMP_DIR
+    from dtable_events.dtable_io.export_writers import open_export_workbook
     from dtable_events.dtable_io.utils import get_related_nicknames_from_dtable, escape_sheet_name
-    import openpyxl
 
     target_dir = '/tmp/dtable-io/export-table-to-excel/' + dtable_uuid
     if not os.path.isdir(target_dir):
@@ -975,19 +992,22 @@ def convert_table_to_execl(dtable_uuid, table_id, username, permission, name, re
     column_name_to_column = {col.get('name'): col for col in cols}
 
     images_target_dir = os.path.join(IMAGE_TMP_DIR, dtable_uuid, str(uuid.uuid4()))
-    image_param = {'num': 0, 'is_support': is_support_image, 'images_target_dir': images_target_dir}
+    image_param = {'num': 0, 'is_support': is_support_image and file_type == 'xlsx', 'images_target_dir': images_target_dir}
+    register_task_tmp_path(images_target_dir)
 
     sheet_name = escape_sheet_name(table_name)
-    excel_name = name + '_' + table_name + '.xlsx'
+    excel_name = name + '_' + table_name + '.' + file_type
     target_path = os.path.join(target_dir, excel_name)
-    wb = openpyxl.Workbook(write_only=True)
+    wb = open_export_workbook(file_type, target_path, cols)
     ws = wb.create_sheet(sheet_name)
     try:
         write_xls_with_type(result_rows, email2nickname, ws, 0, dtable_uuid, repo_id, image_param, cols, column_name_to_column, header_height=header_height)
     except Exception as e:
         dtable_io_logger.error('head_list = {}\n{}'.format(cols, e))
+        wb.discard()
         return
-    wb.save(target_path)
+    add_images_to_excel(ws, dtable_uuid, repo_id, image_param)
+    wb.close()
     # remove tmp images
     try:
         shutil.rmtree(images_target_dir)
@@ -1130,10 +1150,12 @@ def update_big_excel(username, dtable_uuid, table_name, file_path, ref_columns,
         dtable_io_logger.info('update big excel %s.xlsx success!' % table_name)
 
 
-def convert_big_data_view_to_execl(dtable_uuid, table_id, view_id, username, name, task_id, tasks_status_map, repo_id, is_support_image):
+def convert_big_data_view_to_execl(dtable_uuid, table_id, view_id, username, name, task_id, tasks_status_map, repo_id, is_support_image,
+                                   excel_writer='openpyxl', file_type='xlsx'):
     dtable_io_logger.info('Start export big data view to excel: {}.'.format(dtable_uuid))
     try:
-        export_big_data_to_excel(dtable_uuid, table_id, view_id, username, name, task_id, tasks_status_map, repo_id, is_support_image)
+        export_big_data_to_excel(dtable_uuid, table_id, view_id, username, name, task_id, tasks_status_map, repo_id, is_support_image,
+                                 excel_writer, file_type)
     except Exception as e:
         dtable_io_logger.error('export big data view failed. ERROR: {}'.format(e))
     else:
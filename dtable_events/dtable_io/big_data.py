@@ -3,15 +3,18 @@ import os
 import shutil
 import uuid
 
-from dtable_events.dtable_io.excel import parse_row, write_xls_with_type, TEMP_EXPORT_VIEW_DIR, IMAGE_TMP_DIR
+from dtable_events.dtable_io.excel import parse_row, write_xls_with_type, add_images_to_excel, TEMP_EXPORT_VIEW_DIR, \
+    IMAGE_TMP_DIR
 from dtable_events.dtable_io.utils import get_related_nicknames_from_dtable, get_metadata_from_dtable_server, \
-    escape_sheet_name
+    escape_sheet_name, iter_rows_by_keys_from_dtable_db
+from dtable_events.dtable_io.export_writers import open_export_workbook
 from dtable_events.utils import get_inner_dtable_server_url, get_location_tree_json
 from dtable_events.utils.constants import ColumnTypes
 from dtable_events.app.config import INNER_DTABLE_DB_URL, BIG_DATA_ROW_IMPORT_LIMIT, BIG_DATA_ROW_UPDATE_LIMIT, \
     ARCHIVE_VIEW_EXPORT_ROW_LIMIT
-from dtable_events.utils.dtable_db_api import DTableDBAPI, convert_db_rows
+from dtable_events.utils.dtable_db_api import DTableDBAPI, prefetch_pages
 from dtable_events.utils.dtable_server_api import DTableServerAPI
+from dtable_events.utils.bulk_writer import AdaptiveBatchWriter
 from dtable_events.utils.sql_generator import filter2sql
 
 AUTO_GENERATED_COLUMNS = [
@@ -31,6 +34,9 @@ COLUMN_MATCH_ERROR_CODE = 3
 ROW_INSERT_ERROR_CODE = 4
 INTERNAL_ERROR_CODE = 5
 
+# excel rows matched with rows of the table at a time
+UPDATE_EXCEL_BATCH_SIZE = 5000
+
 
 def match_columns(authed_base, table_name, target_columns):
     table_columns = authed_base.list_columns(table_name)
@@ -55,54 +61,65 @@ def _parse_excel_row(excel_row_data, column_name_type_map, name_to_email, locati
     return parsed_row_data
 
 
+def _to_hashable(value):
+    if isinstance(value, list):
+        return tuple(_to_hashable(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _to_hashable(item)) for key, item in value.items()))
+    return value
+
+
+def get_ref_key(row_data, ref_cols):
+    """ normalized key of the ref columns of a row, empty values are None
+
+    :return: tuple, or None if all ref columns are empty
+    """
+    key = tuple(_to_hashable(row_data.get(col)) if row_data.get(col) else None for col in ref_cols)
+    if all(value is None for value in key):
+        return None
+    return key
+
+
 def handle_excel_row_datas(db_api, table_name, excel_row_datas, ref_cols, column_name_type_map, name_to_email, location_tree, insert_new_row=False):
-    where_clauses = []
-    for ref_col in ref_cols:
-        value_list = []
-        none_in_list = False
-        for row_data in excel_row_datas:
-            value = row_data.get(ref_col)
-            if not value:
-                none_in_list = True
-            if value and value not in value_list:
-                value_list.append(value)
-        if none_in_list:
-            where_clauses.append(
-                "(`%s` in (%s) or `%s` is null)" % (
-                    ref_col,
-                    str(value_list).replace('[', '').replace(']', ''),
-                    ref_col)
-            )
-        else:
-            where_clauses.append(
-                "`%s` in (%s)" % (
-                    ref_col,
-                    str(value_list).replace('[', '').replace(']', ''),
-                )
-            )
-
-    sql = "Select * from `%s` where %s" % (
-        table_name,
-        ' And '.join(where_clauses)
-    )
+    """ match excel rows with rows of the table by the ref columns
+
+    Keys of excel rows are queried in batches, and rows of the table are indexed by
+    their keys, so every excel row is matched by a dict lookup. An excel row updates
+    all rows of the same key.
+    """
+    excel_keys = {}
+    for excel_row in excel_row_datas:
+        key = get_ref_key(excel_row, ref_cols)
+        if key is not None:
+            excel_keys.setdefault(key)
+
+    base_row_ids = {}  # key -> [row id]
+    queried_row_ids = set()
+    base_rows = iter_rows_by_keys_from_dtable_db(
+        db_api, table_name, ref_cols, excel_keys, convert=True, server_only=False)
+    for base_row in base_rows:
+        key = get_ref_key(base_row, ref_cols)
+        row_id = base_row.get('_id')
+        # a row may be queried by more than one batch of keys
+        if key in excel_keys and row_id not in queried_row_ids:
+            queried_row_ids.add(row_id)
+            base_row_ids.setdefault(key, []).append(row_id)
 
     rows_for_import = []
     rows_for_update = []
-
-    query_rows_from_base, db_metadata = db_api.query(sql, convert=True, server_only=False)
-    query_rows_from_base = convert_db_rows(db_metadata, query_rows_from_base)
     for excel_row in excel_row_datas:
-        excel_ref_data = {col: excel_row.get(col) for col in ref_cols if  excel_row.get(col)}
-        find_tag = False
-        for base_row in query_rows_from_base:
-            base_ref_data = {col: base_row.get(col) for col in ref_cols if base_row.get(col)}
-            if base_ref_data and excel_ref_data and base_ref_data == excel_ref_data:
+        key = get_ref_key(excel_row, ref_cols)
+        if key is None:
+            continue
+        row_ids = base_row_ids.get(key)
+        if row_ids:
+            parsed_row = _parse_excel_row(excel_row, column_name_type_map, name_to_email, location_tree)
+            for row_id in row_ids:
                 rows_for_update.append({
-                    "row_id": base_row.get('_id'),
-                    "row": _parse_excel_row(excel_row, column_name_type_map, name_to_email, location_tree) # parse
+                    "row_id": row_id,
+                    "row": parsed_row
                 })
-                find_tag = True
-        if insert_new_row and excel_ref_data and not find_tag:
+        elif insert_new_row:
             rows_for_import.append(_parse_excel_row(excel_row, column_name_type_map, name_to_email, location_tree)) # parse
     return rows_for_import, rows_for_update
 
@@ -158,9 +175,7 @@ def import_excel_to_db(
         return
 
     total_count = 0
-    insert_count = 0
-    slice_data = []
-
+    writer = AdaptiveBatchWriter(lambda rows: db_handler.insert_rows(table_name, rows), batch_size=100)
 
     status = 'success'
     tasks_status_map[task_id]['status'] = 'running'
@@ -185,12 +200,8 @@ def import_excel_to_db(
                 for col_name, value in row_data.items():
                     col_type = column_name_type_map.get(col_name)
                     parsed_row_data[col_name] = value and parse_row(col_type, value, name_to_email, location_tree=location_tree) or ''
-                slice_data.append(parsed_row_data)
-                if len(slice_data) == 100:
-                    tasks_status_map[task_id]['rows_imported'] = insert_count
-                    db_handler.insert_rows(table_name, slice_data)
-                    insert_count += len(slice_data)
-                    slice_data = []
+                tasks_status_map[task_id]['rows_imported'] = writer.written_count
+                writer.add(parsed_row_data)
                 total_count += 1
             index += 1
         except Exception as err:
@@ -201,9 +212,8 @@ def import_excel_to_db(
             os.remove(file_path)
             return
 
-    if slice_data:
-        db_handler.insert_rows(table_name, slice_data)
-        insert_count += len(slice_data)
+    writer.flush()
+    insert_count = writer.written_count
 
     if exceed_flag:
         tasks_status_map[task_id]['err_msg'] = 'Number of rows exceeds %s limit' % BIG_DATA_ROW_IMPORT_LIMIT
@@ -281,6 +291,9 @@ def update_excel_to_db(
     tasks_status_map[task_id]['status'] = 'running'
 
     excel_row_datas = []
+    insert_writer = AdaptiveBatchWriter(lambda rows: db_handler.insert_rows(table_name, rows), batch_size=100)
+    update_writer = AdaptiveBatchWriter(lambda rows: db_handler.batch_update_rows(table_name, rows), batch_size=100,
+                                        idempotent=True)
     exceed_flag = False
     for row in ws.rows:
         if index > BIG_DATA_ROW_UPDATE_LIMIT:
@@ -292,7 +305,7 @@ def update_excel_to_db(
                 row_list = [r.value for r in row]
                 row_data = dict(zip(excel_columns, row_list))
                 excel_row_datas.append(row_data)
-                if len(excel_row_datas) >= 100:
+                if len(excel_row_datas) >= UPDATE_EXCEL_BATCH_SIZE:
                     rows_for_import, rows_for_update = handle_excel_row_datas(
                         db_handler, table_name,
                         excel_row_datas, ref_columns,
@@ -300,9 +313,9 @@ def update_excel_to_db(
                         is_insert_new_data
                     )
                     if is_insert_new_data and rows_for_import:
-                        db_handler.insert_rows(table_name, rows_for_import)
+                        insert_writer.write(rows_for_import)
                     if rows_for_update:
-                        db_handler.batch_update_rows(table_name, rows_for_update)
+                        update_writer.write(rows_for_update)
                     excel_row_datas = []
                 tasks_status_map[task_id]['rows_handled'] = total_count
                 total_count += 1
@@ -323,9 +336,9 @@ def update_excel_to_db(
             is_insert_new_data
         )
         if is_insert_new_data and rows_for_import:
-            db_handler.insert_rows(table_name, rows_for_import)
+            insert_writer.write(rows_for_import)
         if rows_for_update:
-            db_handler.batch_update_rows(table_name, rows_for_update)
+            update_writer.write(rows_for_update)
         total_count += len(excel_row_datas)
 
     if exceed_flag:
@@ -342,7 +355,13 @@ def update_excel_to_db(
     return
 
 
-def export_big_data_to_excel(dtable_uuid, table_id, view_id, username, name, task_id, tasks_status_map, repo_id, is_support_image=False):
+def export_big_data_to_excel(dtable_uuid, table_id, view_id, username, name, task_id, tasks_status_map, repo_id, is_support_image=False,
+                             excel_writer='openpyxl', file_type='xlsx'):
+    """
+    :param excel_writer: 'openpyxl', or 'stream' to write rows straight into the xlsx file by XlsxStreamWorkbook,
+    which can not add images
+    :param file_type: xlsx, or csv and parquet which are written page by page without images
+    """
     from dtable_events.dtable_io import dtable_io_logger
 
     # init task_status_map for exporting big data process
@@ -409,15 +428,13 @@ def export_big_data_to_excel(dtable_uuid, table_id, view_id, username, name, tas
 
     sheet_name = table_name + ('_' + view_name if view_name else '')
     sheet_name = escape_sheet_name(sheet_name)
-    excel_name = name + '_' + table_name + ('_' + view_name if view_name else '') + '.xlsx'
+    excel_name = name + '_' + table_name + ('_' + view_name if view_name else '') + '.' + file_type
     target_path = os.path.join(target_dir, excel_name)
 
+    is_support_image = is_support_image and file_type == 'xlsx'
     images_target_dir = os.path.join(IMAGE_TMP_DIR, dtable_uuid, str(uuid.uuid4()))
     image_param = {'num': 0, 'is_support': is_support_image, 'images_target_dir': images_target_dir}
 
-    wb = openpyxl.Workbook(write_only=True)
-    ws = wb.create_sheet(sheet_name)
-
     dtable_db_api = DTableDBAPI(username, dtable_uuid, INNER_DTABLE_DB_URL)
     try:
         row_count_sql = 'select count(*) as total_count from `%s`' % table_name
@@ -443,36 +460,48 @@ def export_big_data_to_excel(dtable_uuid, table_id, view_id, username, name, tas
     filter_conditions['filter_conjunction'] = target_view.get('filter_conjunction')
 
     offset = 10000
-    start = 0
-    while True:
-        # exported row number should less than ARCHIVE_VIEW_EXPORT_ROW_LIMIT
-        if (start + offset) > total_row_count:
-            offset = total_row_count - start
 
-        filter_conditions['start'] = start
-        filter_conditions['limit'] = offset
-        sql = filter2sql(table_name, cols, filter_conditions, by_group=False)
-        response_rows, db_metadata = dtable_db_api.query(sql, convert=True, server_only=False)
+    def query_page(start):
+        page_conditions = dict(filter_conditions)
+        page_conditions['start'] = start
+        # exported row number should less than ARCHIVE_VIEW_EXPORT_ROW_LIMIT
+        page_conditions['limit'] = min(offset, total_row_count - start)
+        sql = filter2sql(table_name, cols, page_conditions, by_group=False)
+        response_rows, _ = dtable_db_api.query(sql, convert=True, server_only=False)
+        return response_rows
+
+    if excel_writer == 'stream' and is_support_image:
+        dtable_io_logger.info('export big data view %s with images, use openpyxl instead of stream excel writer', view_id)
+        excel_writer = 'openpyxl'
+    wb = open_export_workbook(file_type, target_path, cols_without_hidden, excel_writer)
+    ws = wb.create_sheet(sheet_name)
 
-        row_num = start
-        try:
-            write_xls_with_type(response_rows, email2nickname, ws, row_num, dtable_uuid, repo_id, image_param, cols_without_hidden, column_name_to_column, row_height=row_height, header_height=header_height, is_big_data_view=True)
-        except Exception as e:
-            dtable_io_logger.exception(e)
-            dtable_io_logger.error('head_list = {}\n{}'.format(cols_without_hidden, e))
-            tasks_status_map[task_id]['status'] = 'terminated'
-            tasks_status_map[task_id]['err_msg'] = 'write xls error'
-            return
+    try:
+        # fetch next pages from dtable-db while writing current page to excel
+        for start, response_rows in prefetch_pages(query_page, range(0, max(total_row_count, 1), offset)):
+            row_num = start
+            try:
+                write_xls_with_type(response_rows, email2nickname, ws, row_num, dtable_uuid, repo_id, image_param, cols_without_hidden, column_name_to_column, row_height=row_height, header_height=header_height, is_big_data_view=True)
+            except Exception as e:
+                dtable_io_logger.exception(e)
+                dtable_io_logger.error('head_list = {}\n{}'.format(cols_without_hidden, e))
+                tasks_status_map[task_id]['status'] = 'terminated'
+                tasks_status_map[task_id]['err_msg'] = 'write xls error'
+                wb.discard()
+                return
 
-        start += offset
-        tasks_status_map[task_id]['handled_row_count'] = start
-        tasks_status_map[task_id]['status'] = 'running'
+            tasks_status_map[task_id]['handled_row_count'] = min(start + offset, total_row_count)
+            tasks_status_map[task_id]['status'] = 'running'
 
-        if start >= total_row_count or len(response_rows) < offset:
-            break
+            if len(response_rows) < offset:
+                break
+    except BaseException:
+        wb.discard()
+        raise
 
+    add_images_to_excel(ws, dtable_uuid, repo_id, image_param)
     tasks_status_map[task_id]['status'] = 'success'
-    wb.save(target_path)
+    wb.close()
     # remove tmp images
     try:
         shutil.rmtree(images_target_dir)
@@ -0,0 +1,120 @@
+import logging
+from datetime import datetime, time
+
+logger = logging.getLogger(__name__)
+
+CHECKBOX_TUPLE = (
+    ('√', 'x'),
+    ('checked', 'unchecked'),
+    ('y', 'n'),
+    ('yes', 'no'),
+    ('enabled', 'disabled'),
+    ('on', 'off'),
+    ('是', '否'),
+    ('完成', '未完成'),
+    ('True', 'False'),
+    ('true', 'false'),
+)
+CHECKBOX_STRING_LIST = [string for item in CHECKBOX_TUPLE for string in item]
+CHECKBOX_TRUE_LIST = [item[0] for item in CHECKBOX_TUPLE]
+CHECKBOX_STRING_SET = set(CHECKBOX_STRING_LIST)
+
+MULTIPLE_SELECT_OPTION_MAX_LENGTH = 20
+
+
+def split_multiple_select(cell_value):
+    return cell_value.split('，') if '，' in cell_value else cell_value.split(',')
+
+
+def guess_cell_type(cell_value):
+    """
+    type of a not empty excel/csv cell value, raise TypeError for unsupported values
+    """
+    if isinstance(cell_value, str):
+        return guess_str_cell_type(cell_value)
+    if isinstance(cell_value, (int, float)):
+        return 'number'
+    if isinstance(cell_value, datetime):
+        return 'date'
+    if isinstance(cell_value, time):
+        return 'text'
+    raise TypeError('unsupported cell value %r' % cell_value)
+
+
+def guess_str_cell_type(cell_value):
+    if '\n' in cell_value:
+        return 'long-text'
+    if cell_value in CHECKBOX_STRING_SET:
+        return 'checkbox'
+    if (',' in cell_value or '，' in cell_value) and ('{' not in cell_value):
+        for value in split_multiple_select(cell_value):
+            if len(value.strip(' ')) > MULTIPLE_SELECT_OPTION_MAX_LENGTH:
+                return 'text'
+        return 'multiple-select'
+    return 'text'
+
+
+def get_multiple_select_options(value_rows, index):
+    options = {}  # dict keeps the order options first appear
+    for row in value_rows:
+        cell_value = row[index] if index < len(row) else None
+        if cell_value is None:
+            continue
+        for value in split_multiple_select(str(cell_value)):
+            options.setdefault(value.strip(' '), None)
+    return [{'name': value} for value in options]
+
+
+def guess_column_types(value_rows, column_count):
+    """
+    guess types of all columns in one row-major pass over the sample rows
+
+    Every column counts the types of its cells, the most common type wins, ties go to
+    the type seen first. A number column with cells of other types is a text column,
+    a column with unsupported cell values too. Options of multiple-select columns are
+    collected in a second pass over those columns only.
+
+    :param value_rows: list of rows, every row is a sequence of cell values
+    :param column_count: number of columns to guess
+    :return: [(column_type, column_data)], column_type is None for empty columns
+    """
+    type_counts = [{} for _ in range(column_count)]
+    failed_indexes = set()
+    for row in value_rows:
+        for index, cell_value in zip(range(column_count), row):
+            # cell_value may be zero
+            if cell_value is None or cell_value == '':
+                continue
+            # most cells are str or numbers, check them without more calls
+            value_type = type(cell_value)
+            try:
+                if value_type is str:
+                    column_type = guess_str_cell_type(cell_value)
+                elif value_type is int or value_type is float:
+                    column_type = 'number'
+                else:
+                    column_type = guess_cell_type(cell_value)
+            except TypeError as e:
+                if index not in failed_indexes:
+                    logger.warning('guess type of column %s error: %s', index, e)
+                failed_indexes.add(index)
+                continue
+            counts = type_counts[index]
+            counts[column_type] = counts.get(column_type, 0) + 1
+
+    column_types = []
+    for index, counts in enumerate(type_counts):
+        if index in failed_indexes:
+            column_types.append(('text', None))
+            continue
+        if not counts:
+            column_types.append((None, None))
+            continue
+        column_type = max(counts, key=counts.get)
+        if column_type == 'number' and len(counts) != 1:
+            column_type = 'text'
+        column_data = None
+        if column_type == 'multiple-select':
+            column_data = {'options': get_multiple_select_options(value_rows, index)}
+        column_types.append((column_type, column_data))
+    return column_types
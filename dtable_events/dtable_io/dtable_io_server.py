@@ -8,6 +8,7 @@ from dtable_events.dtable_io.task_manager import task_manager
 from dtable_events.dtable_io.task_message_manager import message_task_manager
 from dtable_events.dtable_io.task_data_sync_manager import data_sync_task_manager
 from dtable_events.dtable_io.task_plugin_email_manager import plugin_email_task_manager
+from dtable_events.dtable_io.task_scheduler import task_scheduler
 
 
 class DTableIOServer(Thread):
@@ -15,6 +16,7 @@ class DTableIOServer(Thread):
     def __init__(self, config):
         Thread.__init__(self)
         self._parse_config(config)
+        task_scheduler.init(self._workers, config)
         task_manager.init(self._workers, self._file_server_port, self._io_task_timeout, config)
         message_task_manager.init(self._workers, self._file_server_port, self._io_task_timeout, config)
         data_sync_task_manager.init(self._workers, self._file_server_port, self._io_task_timeout, config)
@@ -26,6 +28,7 @@ class DTableIOServer(Thread):
         data_sync_task_manager.run()
         plugin_email_task_manager.run()
         big_data_task_manager.run()
+        task_scheduler.run()
 
         self._server = WSGIServer((self._host, int(self._port)), application)
 
@@ -6,19 +6,25 @@ from io import StringIO
 from dateutil import parser
 from openpyxl.styles import PatternFill
 from openpyxl import load_workbook
-from copy import deepcopy
+from itertools import chain, islice, product
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, time
-from dtable_events.app.config import EXPORT2EXCEL_DEFAULT_STRING, TIME_ZONE, INNER_DTABLE_DB_URL
+from dtable_events.app.config import EXPORT2EXCEL_DEFAULT_STRING, TIME_ZONE, INNER_DTABLE_DB_URL, \
+    IMPORT_GUESS_TYPE_SAMPLE_SIZE
+from dtable_events.dtable_io.column_type_guesser import CHECKBOX_TRUE_LIST, guess_column_types
+from dtable_events.dtable_io.xlsx_writer import XlsxCell, StreamSheet
 from dtable_events.utils import utc_to_tz, get_inner_dtable_server_url, gen_random_option
 from dtable_events.utils.constants import ColumnTypes
 from dtable_events.utils.geo_location_parser import parse_geolocation_from_tree
 from dtable_events.utils.dtable_db_api import DTableDBAPI
 from dtable_events.utils.dtable_server_api import DTableServerAPI
-from dtable_events.dtable_io.utils import clear_tmp_file, save_file_by_path, get_csv_file, \
+from dtable_events.dtable_io.utils import clear_tmp_file, save_file_by_path, \
     upload_excel_json_add_table_to_dtable_server, append_rows_by_dtable_server, get_related_nicknames_from_dtable, \
     extract_select_options, upload_excel_json_to_dtable_server, get_rows_from_dtable_db, update_rows_by_dtable_db, \
-    get_nicknames_from_dtable, get_table_names_by_dtable_server, get_non_duplicated_name, filter_imported_tables
+    iter_rows_by_keys_from_dtable_db, get_nicknames_from_dtable, get_table_names_by_dtable_server, get_non_duplicated_name, filter_imported_tables
 from dtable_events.utils.exception import ExcelFormatError
+from dtable_events.utils.task_context import TaskCancelledError, check_task_cancelled, get_task_token, \
+    report_task_progress
 
 timezone = TIME_ZONE
 VIRTUAL_ID_EMAIL_DOMAIN = '@auth.local'
@@ -29,21 +35,6 @@ third_grouped_row_fill = PatternFill(fill_type='solid', fgColor='a5f89b')
 grouped_row_fills = [first_grouped_row_fill, second_grouped_row_fill, third_grouped_row_fill]
 
 
-CHECKBOX_TUPLE = (
-    ('√', 'x'),
-    ('checked', 'unchecked'),
-    ('y', 'n'),
-    ('yes', 'no'),
-    ('enabled', 'disabled'),
-    ('on', 'off'),
-    ('是', '否'),
-    ('完成', '未完成'),
-    ('True', 'False'),
-    ('true', 'false'),
-)
-CHECKBOX_STRING_LIST = [string for item in CHECKBOX_TUPLE for string in item]
-CHECKBOX_TRUE_LIST = [item[0] for item in CHECKBOX_TUPLE]
-
 # copy from dtable-web/frontend/src/components-form/utils/markdown-utils.js
 HREF_REG = r'\[.+\]\(\S+\)|<img src=\S+.+\/>|!\[\]\(\S+\)|<\S+>'
 LINK_REG_1 = r'^\[.+\]\((\S+)\)'
@@ -53,6 +44,9 @@ IMAGE_REG_2 = r'^!\[\]\((\S+)\)'
 
 UPDATE_TYPE_LIST = ['number', 'single-select', 'url', 'email', 'text', 'date', 'duration', 'rate', 'checkbox',
                     'multiple-select', 'collaborator']
+# types of key columns which rows of the table can be queried by, their empty cells may be null or ''
+STRING_KEY_TYPE_LIST = ['text', 'url', 'email', 'single-select']
+NUMBER_KEY_TYPE_LIST = ['number', 'duration', 'rate']
 
 TEMP_EXPORT_VIEW_DIR = '/tmp/dtable-io/export-view-to-excel/'
 
@@ -65,9 +59,10 @@ EXPORT_IMAGE_LIMIT = 1000
 
 EXCEL_IMPORT_DIR = '/tmp/dtable-io/'
 
-
-class EmptyCell(object):
-    value = None
+IMPORT_MAX_ROW = 50000
+IMPORT_MAX_COLUMN = 500
+GUESS_TYPE_SAMPLE_SIZE = IMPORT_GUESS_TYPE_SAMPLE_SIZE  # rows checked to determine column types
+CSV_APPEND_BATCH_SIZE = 1000  # csv rows parsed and appended at a time
 
 
 def parse_checkbox(cell_value):
@@ -143,24 +138,21 @@ def parse_long_text(cell_value):
     }
 
 
-def parse_excel_rows(sheet_rows, columns, head_index, max_column):
+def parse_excel_rows(value_rows, columns, max_column):
     """
-    parse excel according to excel
+    parse excel according to excel, rows are tuples of cell values and parsed lazily
     """
     from dtable_events.dtable_io import dtable_io_logger
 
-    if head_index < 0:
-        value_rows = sheet_rows
-    else:
-        value_rows = sheet_rows[head_index + 1:]
-    rows = []
-    for row in value_rows:
+    for row_num, row in enumerate(value_rows):
+        if row_num % 1000 == 0:
+            check_task_cancelled()
         row_data = {}
         for index in range(max_column):
             if not columns[index]:
                 continue
             try:
-                cell_value = get_excel_cell_value(row, index)
+                cell_value = get_excel_row_value(row, index)
                 column_name = columns[index]['name']
                 column_type = columns[index]['type']
                 if cell_value is None:
@@ -183,87 +175,37 @@ def parse_excel_rows(sheet_rows, columns, head_index, max_column):
             except Exception as e:
                 dtable_io_logger.exception(e)
         if row_data:
-            rows.append(row_data)
-
-    return rows
+            yield row_data
 
 
-def guess_column_type(value_list):
-    from dtable_events.dtable_io import dtable_io_logger
-
+def get_excel_cell_value(row, index):
     try:
-        type_list = []
-        for cell_value in value_list:
-            # cell_value may be zero
-            if cell_value is None or cell_value == '':
-                continue
-            elif isinstance(cell_value, int) or isinstance(cell_value, float):
-                column_type = 'number'
-            elif isinstance(cell_value, datetime):
-                column_type = 'date'
-            elif isinstance(cell_value, time):
-                column_type = 'text'
-            elif '\n' in cell_value:
-                column_type = 'long-text'
-            elif cell_value in CHECKBOX_STRING_LIST:
-                column_type = 'checkbox'
-            elif (',' in cell_value or '，' in cell_value) \
-                    and ('{' not in cell_value):
-                column_type = 'multiple-select'
-                multiple_value = cell_value.split('，') if '，' in cell_value else cell_value.split(',')
-                for value in multiple_value:
-                    if len(value.strip(' ')) > 20:
-                        # more than 20 characters.
-                        column_type = 'text'
-            else:
-                column_type = 'text'
-            type_list.append(column_type)
-
-        max_column_type = max(type_list, key=type_list.count) if type_list else None
-
-        if max_column_type == 'number' and len(set(type_list)) != 1:
-            max_column_type = 'text'
-
-        column_data = None
-        if max_column_type == 'multiple-select':
-            multiple_list = []
-            for cell_value in value_list:
-                if cell_value is None:
-                    continue
-                cell_value = str(cell_value)
-                multiple_value = cell_value.split('，') if '，' in cell_value else cell_value.split(',')
-                for value in multiple_value:
-                    value = value.strip(' ')
-                    if value not in multiple_list:
-                        multiple_list.append(value)
-            column_data = {'options': [{'name': value} for value in multiple_list]}
-
-        return max_column_type, column_data
-    except Exception as e:
-        dtable_io_logger.exception(e)
-        return 'text', None
+        return row[index].value
+    except:
+        return None
 
 
-def get_excel_cell_value(row, index):
+def get_excel_row_value(row, index):
     try:
-        return row[index].value
+        return row[index]
     except:
         return None
 
 
-def parse_excel_columns(sheet_rows, head_index, max_column):
-    if head_index == -1:
-        empty_cell = EmptyCell()
-        head_row = [empty_cell] * max_column
-        value_rows = sheet_rows
-    else:
-        head_row = sheet_rows[head_index]
-        value_rows = sheet_rows[head_index + 1:]
+def parse_excel_columns(head_row, sample_rows, max_column):
+    """
+    :param head_row: tuple of head cell values, None if the sheet has no head row
+    :param sample_rows: first rows after head, to determine column types
+    """
+    if head_row is None:
+        head_row = (None,) * max_column
     columns = []
     column_name_set = set()
+    # Check the sample rows of data to determine column types
+    column_types = guess_column_types(sample_rows, max_column)
 
     for index in range(max_column):
-        name = get_excel_cell_value(head_row, index)
+        name = get_excel_row_value(head_row, index)
         # remove whitespace from both ends of name and BOM char(\ufeff)
         column_name = str(name).replace('\ufeff', '').strip() if name else 'Field' + str(index + 1)
 
@@ -271,9 +213,7 @@ def parse_excel_columns(sheet_rows, head_index, max_column):
         column_name = get_non_duplicated_name(column_name, column_name_set)
         column_name_set.add(column_name)
 
-        value_list = [get_excel_cell_value(row, index) for row in value_rows[:200]]
-        # Check the first 200 rows of data to determine column type
-        column_type, column_data = guess_column_type(value_list)
+        column_type, column_data = column_types[index]
 
         if name and not column_type:
             column_type = 'text'
@@ -291,19 +231,49 @@ def parse_excel_columns(sheet_rows, head_index, max_column):
     return columns
 
 
-def parse_excel(file_path, exist_tables=None):
+def iter_sheet_values(sheet):
+    try:
+        for row in sheet.iter_rows(values_only=True):
+            yield row
+    except Exception as e:
+        raise ExcelFormatError
+
+
+def write_json_table(json_file, table, rows):
+    """
+    write table as json to json_file, rows are written one by one
+    """
+    json_file.write('{"rows": [')
+    rows_count = 0
+    for row in rows:
+        if rows_count:
+            json_file.write(', ')
+        json_file.write(json.dumps(row))
+        rows_count += 1
+    json_file.write('], ')
+    json_file.write(json.dumps(table)[1:])
+    return rows_count
+
+
+def parse_excel_to_json_file(file_path, json_file, exist_tables=None):
+    """
+    parse sheets of excel to json tables and write them to json_file
+
+    Sheets are read in read-only mode without materializing them, only the head row
+    and a sample window for column types are kept in memory, then rows are parsed
+    and written to json_file one by one.
+    """
     from dtable_events.dtable_io import dtable_io_logger
     if exist_tables is None:
         exist_tables = []
 
-    tables = []
+    tables_count = 0
+    json_file.write('[')
     wb = load_workbook(file_path, read_only=True, data_only=True)
     for sheet in wb:
-        try:
-            sheet_rows = list(sheet.rows)
-        except Exception as e:
-            raise ExcelFormatError
-        if not sheet_rows:
+        sheet_values = iter_sheet_values(sheet)
+        sample_rows = list(islice(sheet_values, GUESS_TYPE_SAMPLE_SIZE + 1))
+        if not sample_rows:
             continue
 
         table_name = sheet.title
@@ -311,39 +281,44 @@ def parse_excel(file_path, exist_tables=None):
         table_name = get_non_duplicated_name(table_name, exist_tables)
 
         # the sheet has some rows, but sheet.max_row maybe get None
-        max_row = sheet.max_row if isinstance(sheet.max_row, int) else len(sheet_rows)
-        max_column = sheet.max_column if isinstance(sheet.max_column, int) else len(sheet_rows[0])
-        if not max_row or not max_column:
+        max_row = sheet.max_row if isinstance(sheet.max_row, int) else None
+        max_column = sheet.max_column if isinstance(sheet.max_column, int) else len(sample_rows[0])
+        if max_row == 0 or not max_column:
             continue
 
         dtable_io_logger.info(
-            'parse sheet: %s, rows: %d, columns: %d' % (table_name, max_row, max_row))
+            'parse sheet: %s, rows: %s, columns: %d' % (table_name, max_row, max_column))
 
-        if max_row > 50000:
-            max_row = 50000  # rows limit
-        if max_column > 500:
-            max_column = 500  # columns limit
+        if max_row is None or max_row > IMPORT_MAX_ROW:
+            max_row = IMPORT_MAX_ROW  # rows limit
+        if max_column > IMPORT_MAX_COLUMN:
+            max_column = IMPORT_MAX_COLUMN  # columns limit
 
-        sheet_rows = sheet_rows[:max_row]
         head_index = 0
-        columns = parse_excel_columns(sheet_rows, head_index, max_column)
-        rows = parse_excel_rows(sheet_rows, columns, head_index, max_column)
+        head_row, sample_rows = sample_rows[0], sample_rows[1:]
+        columns = parse_excel_columns(head_row, sample_rows, max_column)
         new_columns = [column for column in columns if column]
 
-        dtable_io_logger.info(
-            'got table: %s, rows: %d, columns: %d' % (table_name, len(rows), len(new_columns)))
+        # head row is counted in max_row
+        value_rows = islice(chain(sample_rows, sheet_values), max_row - 1)
+        rows = parse_excel_rows(value_rows, columns, max_column)
 
         table = {
             'name': table_name,
-            'rows': rows,
             'columns': new_columns,
             'head_index': head_index,
             'max_row': max_row,
             'max_column': len(new_columns),
         }
-        tables.append(table)
+        if tables_count:
+            json_file.write(', ')
+        rows_count = write_json_table(json_file, table, rows)
+        tables_count += 1
+
+        dtable_io_logger.info(
+            'got table: %s, rows: %d, columns: %d' % (table_name, rows_count, len(new_columns)))
     wb.close()
-    if not tables:
+    if not tables_count:
         table = {
             'name': list(wb) and list(wb)[0].title or 'sheet1',
             'rows': [],
@@ -351,17 +326,22 @@ def parse_excel(file_path, exist_tables=None):
             'max_row': 0,
             'max_column': 0,
         }
-        tables.append(table)
+        json_file.write(json.dumps(table))
+    json_file.write(']')
 
-    return json.dumps(tables)
 
+def parse_excel(file_path, exist_tables=None):
+    json_file = StringIO()
+    parse_excel_to_json_file(file_path, json_file, exist_tables=exist_tables)
+    return json_file.getvalue()
 
-def parse_dtable_csv_columns(sheet_rows, max_column):
-    head_row = sheet_rows[0]
-    value_rows = sheet_rows[1:]
 
+def parse_dtable_csv_columns(head_row, sample_rows, max_column):
     columns = []
     column_name_set = set()
+    # Check the first rows of data to determine column types
+    sample_rows = [[value.strip() for value in row] for row in sample_rows]
+    column_types = guess_column_types(sample_rows, max_column)
     for index in range(max_column):
         name = get_csv_cell_value(head_row, index)
         column_name = str(name).replace('\ufeff', '').strip() if name else 'Field' + str(index + 1)
@@ -370,9 +350,7 @@ def parse_dtable_csv_columns(sheet_rows, max_column):
         column_name = get_non_duplicated_name(column_name, column_name_set)
         column_name_set.add(column_name)
 
-        value_list = [get_csv_cell_value(row, index) for row in value_rows[:200]]
-        # Check the first 200 rows of data to determine column type
-        column_type, column_data = guess_column_type(value_list)
+        column_type, column_data = column_types[index]
 
         if name and not column_type:
             column_type = 'text'
@@ -397,12 +375,15 @@ def get_csv_cell_value(row, index):
         return None
 
 
-def parse_dtable_csv_rows(sheet_rows, columns, max_column):
+def parse_dtable_csv_rows(value_rows, columns, max_column):
+    """
+    parse csv rows according to csv lazily
+    """
     from dtable_events.dtable_io import dtable_io_logger
 
-    value_rows = sheet_rows[1:]
-    rows = []
-    for row in value_rows:
+    for row_num, row in enumerate(value_rows):
+        if row_num % 1000 == 0:
+            check_task_cancelled()
         row_data = {}
         for index in range(max_column):
             if not columns[index]:
@@ -424,12 +405,38 @@ def parse_dtable_csv_rows(sheet_rows, columns, max_column):
             except Exception as e:
                 dtable_io_logger.exception(e)
         if row_data:
-            rows.append(row_data)
+            yield row_data
 
-    return rows
 
+def iter_csv_file(file_path):
+    """
+    yield rows of csv file lazily, the delimiter is guessed from the first line
+    """
+    from dtable_events.dtable_io import dtable_io_logger
+
+    dtable_io_logger.info('csv file size: %d KB' % (os.path.getsize(file_path) >> 10))
+    # The specified character set is utf-8-sig to automatically process BOM characters
+    # and eliminate the occurrence of \ufeff
+    with open(file_path, 'r', encoding='utf-8-sig') as f:
+        first_line = f.readline()
+        if not first_line:
+            return
+        delimiter = guess_delimiter(first_line)
+        for row in csv.reader(chain([first_line], f), delimiter=delimiter):
+            yield row
 
-def parse_dtable_csv(file_path, dtable_name, exist_tables=None):
+
+def count_table_rows(rows, table):
+    # max_row of the table is counted while its rows are written
+    for row in rows:
+        table['max_row'] += 1
+        yield row
+
+
+def parse_dtable_csv_to_json_file(file_path, dtable_name, json_file, exist_tables=None):
+    """
+    parse csv to a json table and write it to json_file, rows are parsed and written one by one
+    """
     from dtable_events.dtable_io import dtable_io_logger
     if exist_tables is None:
         exist_tables = []
@@ -437,14 +444,10 @@ def parse_dtable_csv(file_path, dtable_name, exist_tables=None):
     dtable_name = dtable_name.replace('`', '_').replace('\\', '_').replace('/', '_')
     dtable_name = get_non_duplicated_name(dtable_name, exist_tables)
 
-    csv_file = get_csv_file(file_path)
-    csv_file = StringIO(csv_file)
+    csv_rows = iter_csv_file(file_path)
+    sample_rows = list(islice(csv_rows, GUESS_TYPE_SAMPLE_SIZE + 1))
 
-    tables = []
-    delimiter = guess_delimiter(deepcopy(csv_file))
-    csv_rows = [row for row in csv.reader(csv_file, delimiter=delimiter)]
-
-    if not csv_rows:
+    if not sample_rows:
         table = {
             'name': dtable_name,
             'rows': [],
@@ -452,36 +455,39 @@ def parse_dtable_csv(file_path, dtable_name, exist_tables=None):
             'max_row': 0,
             'max_column': 0,
         }
-        tables.append(table)
-        return json.dumps(tables)
+        json_file.write(json.dumps([table]))
+        return
 
-    csv_head = csv_rows[0]
-    max_row = len(csv_rows)
+    csv_head, sample_rows = sample_rows[0], sample_rows[1:]
     max_column = len(csv_head)
+    if max_column > IMPORT_MAX_COLUMN:
+        max_column = IMPORT_MAX_COLUMN
 
-    if max_row > 50000:
-        max_row = 50000
-    if max_column > 500:
-        max_column = 500
-
-    csv_rows = csv_rows[:max_row]
-    columns = parse_dtable_csv_columns(csv_rows, max_column)
-    rows = parse_dtable_csv_rows(csv_rows, columns, max_column)
-
+    columns = parse_dtable_csv_columns(csv_head, sample_rows, max_column)
     new_columns = [column for column in columns if column]
 
-    dtable_io_logger.info(
-        'got table: %s, rows: %d, columns: %d' % (dtable_name, len(rows), len(new_columns)))
-
     table = {
         'name': dtable_name,
-        'rows': rows,
         'columns': new_columns,
-        'max_row': max_row,
+        'max_row': 1,  # head row
         'max_column': len(new_columns),
     }
-    tables.append(table)
-    return json.dumps(tables)
+    # head row is counted in max_row
+    value_rows = count_table_rows(islice(chain(sample_rows, csv_rows), IMPORT_MAX_ROW - 1), table)
+    rows = parse_dtable_csv_rows(value_rows, columns, max_column)
+
+    json_file.write('[')
+    rows_count = write_json_table(json_file, table, rows)
+    json_file.write(']')
+
+    dtable_io_logger.info(
+        'got table: %s, rows: %d, columns: %d' % (dtable_name, rows_count, len(new_columns)))
+
+
+def parse_dtable_csv(file_path, dtable_name, exist_tables=None):
+    json_file = StringIO()
+    parse_dtable_csv_to_json_file(file_path, dtable_name, json_file, exist_tables=exist_tables)
+    return json_file.getvalue()
 
 
 def parse_and_import_excel_csv_to_dtable(repo_id, dtable_name, dtable_uuid, username, file_type, lang):
@@ -542,9 +548,8 @@ def parse_and_update_file_to_table(file_name, username, dtable_uuid, table_name,
     key_columns = selected_columns.split(',')
 
     dtable_db_api = DTableDBAPI(username, dtable_uuid, INNER_DTABLE_DB_URL)
-    dtable_rows = get_rows_from_dtable_db(dtable_db_api, table_name)
-
     dtable_col_name_to_column = {col['name']: col for col in columns}
+    dtable_rows = get_dtable_rows_by_keys(dtable_db_api, table_name, dtable_col_name_to_column, file_rows, key_columns)
 
     insert_rows, update_rows, excel_select_column_options = \
         get_insert_update_rows(dtable_col_name_to_column, file_rows, dtable_rows, key_columns, need_select_option=True)
@@ -562,6 +567,32 @@ def parse_and_update_file_to_table(file_name, username, dtable_uuid, table_name,
     append_rows_by_dtable_server(dtable_server_api, insert_rows, table_name)
 
 
+def iter_batches(rows, batch_size):
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def add_select_column_options(dtable_server_api, table_name, rows, dtable_col_name_to_column):
+    """
+    add the single-select and multiple-select options of rows missing in the table
+    """
+    excel_select_column_options = extract_select_options(rows, dtable_col_name_to_column)
+    for col_name, excel_options in excel_select_column_options.items():
+        column = dtable_col_name_to_column.get(col_name)
+        if not column.get('data'):
+            column['data'] = {}
+        dtable_options = column['data'].get('options') or []
+        to_be_added_options = excel_options - set([op.get('name') for op in dtable_options])
+        if to_be_added_options:
+            options = [gen_random_option(option) for option in to_be_added_options]
+            dtable_server_api.add_column_options(table_name, col_name, options)
+            # rows of next batches check against added options too
+            column['data']['options'] = dtable_options + options
+
+
 def parse_and_append_excel_csv_to_table(username, file_name, dtable_uuid, table_name, file_type):
     related_users = get_related_nicknames_from_dtable(dtable_uuid, username, 'r')
     name_to_email = {user.get('name'): user.get('email') for user in related_users}
@@ -569,34 +600,27 @@ def parse_and_append_excel_csv_to_table(username, file_name, dtable_uuid, table_
     dtable_server_url = get_inner_dtable_server_url()
     dtable_server_api = DTableServerAPI(username, dtable_uuid, dtable_server_url)
     columns = dtable_server_api.list_columns(table_name)
+    dtable_col_name_to_column = {col['name']: col for col in columns}
 
     try:
         # file_type is xlsx or csv
         if file_type == 'xlsx':
             tmp_file_path = os.path.join(EXCEL_IMPORT_DIR, dtable_uuid, file_name + '.xlsx')
             content = parse_dtable_excel_file(tmp_file_path, table_name, columns, name_to_email)
+            row_batches = [content[0]['rows']]
         else:
+            # csv rows are parsed and appended in batches
             tmp_file_path = os.path.join(EXCEL_IMPORT_DIR, dtable_uuid, file_name + '.csv')
-            content = parse_csv_file(tmp_file_path, file_name, table_name, columns, name_to_email)
+            row_batches = iter_batches(parse_csv_file_rows(tmp_file_path, columns, name_to_email), CSV_APPEND_BATCH_SIZE)
+
+        for rows in row_batches:
+            # add single-select or multiple-select column options
+            add_select_column_options(dtable_server_api, table_name, rows, dtable_col_name_to_column)
+            append_rows_by_dtable_server(dtable_server_api, rows, table_name)
     finally:
         # delete excel or csv
         clear_tmp_file(tmp_file_path)
 
-    rows = content[0]['rows']
-    dtable_col_name_to_column = {col['name']: col for col in columns}
-    excel_select_column_options = extract_select_options(rows, dtable_col_name_to_column)
-
-    # add single-select or multiple-select column options
-    for col_name, excel_options in excel_select_column_options.items():
-        column = dtable_col_name_to_column.get(col_name)
-        dtable_options = column.get('data').get('options')
-        to_be_added_options = excel_options - set([op.get('name') for op in dtable_options])
-        if to_be_added_options:
-            options = [gen_random_option(option) for option in to_be_added_options]
-            dtable_server_api.add_column_options(table_name, col_name, options)
-
-    append_rows_by_dtable_server(dtable_server_api, rows, table_name)
-
 
 def parse_excel_csv_to_json(username, repo_id, file_name, file_type, parse_type, dtable_uuid):
     exist_table_names = []
@@ -607,20 +631,19 @@ def parse_excel_csv_to_json(username, repo_id, file_name, file_type, parse_type,
         exist_table_names = get_table_names_by_dtable_server(username, dtable_uuid)
 
     try:
-        # file_type is xlsx or csv
+        # file_type is xlsx or csv, write tmp json file while parsing
+        temp_json_path = os.path.join(base_path, file_name + '.json')
         if file_type == 'xlsx':
             tmp_file_path = os.path.join(base_path, file_name + '.xlsx')
-            content = parse_excel(tmp_file_path, exist_tables=exist_table_names)
+            with open(temp_json_path, 'w') as json_file:
+                parse_excel_to_json_file(tmp_file_path, json_file, exist_tables=exist_table_names)
         else:
             tmp_file_path = os.path.join(base_path, file_name + '.csv')
-            content = parse_dtable_csv(tmp_file_path, file_name, exist_tables=exist_table_names)
+            with open(temp_json_path, 'w') as json_file:
+                parse_dtable_csv_to_json_file(tmp_file_path, file_name, json_file, exist_tables=exist_table_names)
     finally:
         clear_tmp_file(tmp_file_path)
 
-    # save tmp json file
-    temp_json_path = os.path.join(base_path, file_name + '.json')
-    save_file_by_path(temp_json_path, content)
-
 
 def import_excel_csv_by_dtable_server(username, repo_id, dtable_uuid, dtable_name, included_tables, lang):
     # get json file
@@ -769,9 +792,6 @@ def update_parsed_file_by_dtable_server(username, dtable_uuid, file_name, table_
     excel_rows = excel_rows[0].get('rows', [])
     key_columns = selected_columns.split(',')
 
-    dtable_db_api = DTableDBAPI(username, dtable_uuid, INNER_DTABLE_DB_URL)
-    dtable_rows = get_rows_from_dtable_db(dtable_db_api, table_name)
-
     dtable_server_url = get_inner_dtable_server_url()
     dtable_server_api = DTableServerAPI(username, dtable_uuid, dtable_server_url)
 
@@ -779,6 +799,9 @@ def update_parsed_file_by_dtable_server(username, dtable_uuid, file_name, table_
 
     dtable_col_name_to_column = {col['name']: col for col in columns}
 
+    dtable_db_api = DTableDBAPI(username, dtable_uuid, INNER_DTABLE_DB_URL)
+    dtable_rows = get_dtable_rows_by_keys(dtable_db_api, table_name, dtable_col_name_to_column, excel_rows, key_columns)
+
     insert_rows, update_rows, excel_select_column_options = \
         get_insert_update_rows(dtable_col_name_to_column, excel_rows, dtable_rows, key_columns, need_select_option=True)
 
@@ -808,14 +831,65 @@ def get_cell_value(row, col, excel_col_name_to_type):
     return cell_value
 
 
+def get_excel_col_name_to_type(dtable_col_name_to_column, excel_rows):
+    """ types of columns of excel rows to update
+    """
+    return {col_name: dtable_col_name_to_column.get(col_name).get('type') for col_name in excel_rows[0].keys()
+            if dtable_col_name_to_column.get(col_name, {}).get('type') in UPDATE_TYPE_LIST}
+
+
+def get_key_query_values(cell_value, col_type):
+    """ values to query rows whose key cell may equal to cell_value of excel,
+    None for empty cells, [] if no row can match
+    """
+    if cell_value == '':
+        return [None, ''] if col_type in STRING_KEY_TYPE_LIST else [None]
+    if col_type in STRING_KEY_TYPE_LIST:
+        return [str(cell_value)]
+    if isinstance(cell_value, bool):
+        return []
+    if isinstance(cell_value, (int, float)):
+        return [cell_value]
+    try:
+        return [float(cell_value)]
+    except (TypeError, ValueError):
+        return []
+
+
+def get_dtable_rows_by_keys(dtable_db_api, table_name, dtable_col_name_to_column, excel_rows, key_columns):
+    """ rows of the table to match excel rows by key_columns
+
+    Only the rows of the keys of excel rows are queried, with the key columns and the
+    columns to update. The whole table is queried if a key column can not be queried
+    by values, like multiple-select or date columns.
+    """
+    if not excel_rows:
+        return []
+    key_column_types = [dtable_col_name_to_column.get(col, {}).get('type') for col in key_columns]
+    for col_type in key_column_types:
+        if col_type not in STRING_KEY_TYPE_LIST and col_type not in NUMBER_KEY_TYPE_LIST:
+            return get_rows_from_dtable_db(dtable_db_api, table_name)
+
+    excel_col_name_to_type = get_excel_col_name_to_type(dtable_col_name_to_column, excel_rows)
+    keys = {}
+    for excel_row in excel_rows:
+        excel_row = {col_name: excel_row.get(col_name) for col_name in excel_row if excel_col_name_to_type.get(col_name)}
+        key_values = [get_key_query_values(get_cell_value(excel_row, col, excel_col_name_to_type), col_type)
+                      for col, col_type in zip(key_columns, key_column_types)]
+        for key in product(*key_values):
+            keys.setdefault(key)
+
+    select_columns = key_columns + [col_name for col_name in excel_col_name_to_type if col_name not in key_columns]
+    return list(iter_rows_by_keys_from_dtable_db(dtable_db_api, table_name, key_columns, keys, select_columns=select_columns))
+
+
 def get_insert_update_rows(dtable_col_name_to_column, excel_rows, dtable_rows, key_columns, need_select_option=False):
     if not excel_rows:
         return [], [], {}
     update_rows = []
     insert_rows = []
     excel_select_column_options = {}
-    excel_col_name_to_type = {col_name: dtable_col_name_to_column.get(col_name).get('type') for col_name in excel_rows[0].keys()
-                              if dtable_col_name_to_column.get(col_name, {}).get('type') in UPDATE_TYPE_LIST}
+    excel_col_name_to_type = get_excel_col_name_to_type(dtable_col_name_to_column, excel_rows)
 
     dtable_row_data = get_dtable_row_data(dtable_rows, key_columns, excel_col_name_to_type)
     keys_of_excel_rows = {}
@@ -962,21 +1036,43 @@ def parse_dtable_excel_rows(sheet_rows, columns, column_length, name_to_email):
     return rows
 
 
+def get_csv_max_column(csv_head, columns, max_column=IMPORT_MAX_COLUMN):
+    csv_column_num = len(csv_head)
+    table_column_num = len(columns)
+    if csv_column_num < max_column:
+        max_column = csv_column_num
+    if table_column_num > csv_column_num:
+        max_column = table_column_num
+    return max_column
+
+
+def parse_csv_file_rows(file_path, columns, name_to_email):
+    """
+    yield rows of csv file parsed according to dtable columns lazily, at most IMPORT_MAX_ROW rows
+    """
+    csv_rows = iter_csv_file(file_path)
+    csv_head = next(csv_rows, None)
+    if csv_head is None:
+        return
+    yield from parse_csv_rows(csv_head, islice(csv_rows, IMPORT_MAX_ROW), columns, name_to_email)
+
+
 def parse_csv_file(file_path, file_name, table_name, columns, name_to_email):
     from dtable_events.dtable_io import dtable_io_logger
 
-    csv_file = get_csv_file(file_path)
-
     tables = []
-    max_column = 500  # columns limit
-    rows, max_column, csv_row_num, csv_column_num = parse_csv_rows(StringIO(csv_file), columns, max_column, name_to_email)
+    csv_rows = iter_csv_file(file_path)
+    csv_head = next(csv_rows, None)
+    if csv_head is None:
+        rows, max_column, csv_column_num = [], 0, 0
+    else:
+        csv_column_num = len(csv_head)
+        max_column = get_csv_max_column(csv_head, columns)
+        # rows limit
+        rows = list(parse_csv_rows(csv_head, islice(csv_rows, IMPORT_MAX_ROW), columns, name_to_email))
+    max_row = len(rows)
     dtable_io_logger.info(
-        'parse csv: %s, rows: %d, columns: %d' % (file_name, csv_row_num, csv_column_num))
-
-    max_row = csv_row_num
-    if csv_row_num > 50000:
-        max_row = 50000  # rows limit
-    rows = rows[:max_row]
+        'parse csv: %s, rows: %d, columns: %d' % (file_name, max_row, csv_column_num))
 
     dtable_io_logger.info(
         'got table: %s, rows: %d, columns: %d' % (file_name, len(rows), max_column))
@@ -1009,11 +1105,7 @@ def parse_update_csv_upload_csv_to_json(file_name, username, dtable_uuid, table_
     save_file_by_path(tmp_file_path, json.dumps(content))
 
 
-def guess_delimiter(csv_file):
-    line = csv_file.readline()
-
-    if not line:
-        return ','
+def guess_delimiter(line):
     comma_count = line.count(',')
     semicolon_count = line.count(';')
     delimiter = comma_count >= semicolon_count and ',' or ';'
@@ -1021,31 +1113,20 @@ def guess_delimiter(csv_file):
     return delimiter
 
 
-def parse_csv_rows(csv_file, columns, max_column, name_to_email):
+def parse_csv_rows(csv_head, csv_rows, columns, name_to_email):
+    """
+    parse csv rows according to dtable columns lazily
+    """
     from dtable_events.dtable_io import dtable_io_logger
     from dtable_events.utils import get_location_tree_json
 
-    rows = []
-    delimiter = guess_delimiter(deepcopy(csv_file))
-    csv_rows = [row for row in csv.reader(csv_file, delimiter=delimiter)]
-
-    if not csv_rows:
-        return rows, 0, 0, 0
-
     location_tree = get_location_tree_json()
 
-    csv_head = csv_rows[0]
-    csv_column_num = len(csv_head)
     table_column_num = len(columns)
-    if csv_column_num < max_column:
-        max_column = csv_column_num
-    if table_column_num > csv_column_num:
-        max_column = table_column_num
-
-    csv_head_dict = {csv_head[index].strip(): index for index in range(csv_column_num)}
-    csv_row_num = 0
-    for csv_row in csv_rows[1:]:
-        csv_row_num += 1
+    csv_head_dict = {csv_head[index].strip(): index for index in range(len(csv_head))}
+    for row_num, csv_row in enumerate(csv_rows):
+        if row_num % 1000 == 0:
+            check_task_cancelled()
         row_data = {}
         for index in range(table_column_num):
             column_name = columns[index]['name']
@@ -1064,8 +1145,7 @@ def parse_csv_rows(csv_file, columns, max_column, name_to_email):
                 dtable_io_logger.exception(e)
                 row_data[column_name] = None
         if row_data:
-            rows.append(row_data)
-    return rows, max_column, csv_row_num, csv_column_num
+            yield row_data
 
 
 def parse_row(column_type, cell_value, name_to_email, location_tree=None):
@@ -1326,6 +1406,90 @@ def parse_formula_number(cell_data, column_data, is_big_data_view=False):
     return value, number_format
 
 
+DECIMAL_FORMATS = ['0.' + '0' * decimal_cnt for decimal_cnt in range(9)]
+NUMBER_FORMAT_AFFIXES = {
+    'number': ('', ''),
+    'percent': ('', '%'),
+    'euro': ('"€"#,##', '_-'),
+    'dollar': ('"$"#,##', '_-'),
+    'yuan': ('"¥"#,##', '_-'),
+}
+
+
+def compile_formula_number(column_data, is_big_data_view=False):
+    """
+    parse_formula_number of one column, the format options of the column are looked up
+    and its number formats are built only once
+    :return: function(cell_data) -> (value, number_format)
+    """
+    try:
+        src_format = column_data.get('format')
+        decimal = column_data.get('decimal')
+        thousands = column_data.get('thousands')
+        precision = column_data.get('precision', 0)
+        symbol_slice = None
+        if src_format == 'custom_currency':
+            currency_symbol = column_data.get('currency_symbol')
+            if column_data.get('currency_symbol_position', 'before') == 'before':
+                symbol_slice = slice(len(currency_symbol), None)
+                affixes = ('"%s"#,##' % currency_symbol, '_-')
+            else:
+                symbol_slice = slice(None, -len(currency_symbol))
+                affixes = ('', currency_symbol)
+        else:
+            if src_format in ['euro', 'dollar', 'yuan']:
+                symbol_slice = slice(1, None)
+            elif src_format == 'percent':
+                symbol_slice = slice(None, -1)
+            affixes = NUMBER_FORMAT_AFFIXES.get(src_format or 'number')
+        if is_big_data_view:
+            symbol_slice = None
+        insert_dot = thousands == 'dot' and (precision > 0 or decimal == 'dot')
+        if affixes:
+            prefix, suffix = affixes
+            int_format = prefix + '0' + suffix
+            decimal_formats = [prefix + decimal_format + suffix for decimal_format in DECIMAL_FORMATS]
+    except Exception:
+        return lambda cell_data: parse_formula_number(cell_data, column_data, is_big_data_view)
+    is_percent = src_format == 'percent'
+
+    def parse(cell_data):
+        value = str(cell_data)
+        if symbol_slice:
+            value = value[symbol_slice]
+        if decimal == 'comma':
+            value = value.replace(',', '.')
+        if thousands == 'space':
+            value = value.replace(' ', '')
+        elif thousands == 'dot':
+            value = value.replace('.', '')
+            if insert_dot:
+                value = value[:-precision] + '.' + value[-precision:]
+        elif thousands == 'comma':
+            value = value.replace(',', '')
+
+        if not affixes:
+            number_format = '0'
+        elif '.' not in value:
+            number_format = int_format
+        else:
+            number_format = decimal_formats[min(len(value.split('.')[1]), 8)]
+        if is_percent:
+            try:
+                value = float(value) / 100
+            except Exception:
+                pass
+        try:
+            if is_int_str(value):
+                value = int(value)
+            else:
+                value = float(value)
+        except Exception:
+            pass
+        return value, number_format
+    return parse
+
+
 def convert_time_to_utc_str(time_str):
     if 'Z' in time_str:
         utc_time = datetime.strptime(time_str, '%Y-%m-%dT%H:%M:%S.%fZ')
@@ -1432,63 +1596,86 @@ def get_file_download_url(file_url, dtable_uuid, repo_id):
     url = gen_file_get_url(token, asset_name)
     return url
 
-def add_image_to_excel(ws, cell_value, col_num, row_num, dtable_uuid, repo_id, image_num, images_target_dir, column, row_height):
-    import requests
-    from openpyxl.drawing.image import Image
-    from PIL import Image as PILImage
-    from urllib.parse import unquote, urljoin, urlparse
-    from openpyxl.drawing.spreadsheet_drawing import AnchorMarker, TwoCellAnchor
-    from dtable_events.dtable_io.utils import image_column_offset_transfer, image_row_offset_transfer
+def collect_excel_images(cell_value, col_num, row_num, image_param, column, row_height):
+    """ record the images of an image cell while writing rows, add_images_to_excel
+    downloads them concurrently and adds them to the sheet
+    """
+    from urllib.parse import urljoin, urlparse
 
-    images = cell_value
-    col_width = column.get('width', 200)
+    image_urls = []
+    for image_url in cell_value:
+        if image_param['num'] >= EXPORT_IMAGE_LIMIT:
+            break
+        image_urls.append(urljoin(image_url, urlparse(image_url).path))
+        image_param['num'] += 1
+    if image_urls:
+        image_param.setdefault('image_cells', []).append(
+            (row_num, col_num, image_urls, column.get('width', 200), row_height))
 
-    row_offset = image_row_offset_transfer(row_height)
-    from_row_offset = row_offset
-    to_row_offset = -row_offset
 
-    from_col_offset = row_offset
-    to_col_offset = -col_width * 7700
-    for image_url in images:
-        if image_num >= EXPORT_IMAGE_LIMIT:
-            return image_num
-        real_image_url = urljoin(image_url, urlparse(image_url).path)
+def download_excel_image(real_image_url, dtable_uuid, repo_id, images_target_dir, token=None):
+    """ download an image to images_target_dir, webp images are converted to png
 
-        image_name = unquote(real_image_url.split('/')[-1].strip())
-        image_dir = os.path.join(images_target_dir, '/'.join(real_image_url.split('/')[7:-1]))
-        os.makedirs(image_dir, exist_ok=True)
+    :return: path of the image, None if it can not be added to excel
+    """
+    import requests
+    from openpyxl.drawing.image import Image
+    from PIL import Image as PILImage
+    from urllib.parse import unquote
+    from dtable_events.dtable_io import dtable_io_logger
 
+    image_name = unquote(real_image_url.split('/')[-1].strip())
+    image_dir = os.path.join(images_target_dir, '/'.join(real_image_url.split('/')[7:-1]))
+    os.makedirs(image_dir, exist_ok=True)
+    tmp_image_path = os.path.join(image_dir, image_name)
+    try:
         image_download_url = get_file_download_url(real_image_url, dtable_uuid, repo_id)
         if not image_download_url:
-            continue
+            return None
+        with requests.get(image_download_url, stream=True, timeout=180) as response:
+            with open(tmp_image_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    if token:
+                        token.check()
+                    f.write(chunk)
+    except TaskCancelledError:
+        raise
+    except Exception as e:
+        dtable_io_logger.warning('download image %s error: %s', real_image_url, e)
+        return None
 
-        response = requests.get(image_download_url)
-        image_content = response.content
+    try:
+        image_format = Image(tmp_image_path).format
+    except:
+        return None
+    if image_format == 'mpo':
+        return None
 
-        tmp_image_path = os.path.join(image_dir, image_name)
-        with open(tmp_image_path, 'wb') as f:
-            f.write(image_content)
+    # convert webp to png
+    if image_format in ('webp', ):
+        img = PILImage.open(tmp_image_path)
+        img.load()
+        new_tmp_image_path = os.path.join(image_dir, image_name.split('.')[0] + '.png')
+        img.save(new_tmp_image_path, format='png')
+        # remove webp image
+        os.remove(tmp_image_path)
+        return new_tmp_image_path
+    return tmp_image_path
 
-        try:
-            img = Image(tmp_image_path)
-        except:
-            continue
-        image_format = img.format
 
-        if image_format == 'mpo':
-            continue
+def add_cell_images_to_excel(ws, image_paths, col_num, row_num, col_width, row_height):
+    from openpyxl.drawing.image import Image
+    from openpyxl.drawing.spreadsheet_drawing import AnchorMarker, TwoCellAnchor
+    from dtable_events.dtable_io.utils import image_column_offset_transfer, image_row_offset_transfer
 
-        # convert webp to png
-        if image_format in ('webp', ):
-            img = PILImage.open(tmp_image_path)
-            img.load()
-            image_name = image_name.split('.')[0] + '.png'
-            new_tmp_image_path = os.path.join(image_dir, image_name)
-            img.save(new_tmp_image_path, format='png')
-            # remove webp image
-            os.remove(tmp_image_path)
-            img = Image(new_tmp_image_path)
+    row_offset = image_row_offset_transfer(row_height)
+    from_row_offset = row_offset
+    to_row_offset = -row_offset
 
+    from_col_offset = row_offset
+    to_col_offset = -col_width * 7700
+    for image_path in image_paths:
+        img = Image(image_path)
         img_width, image_height = img.width, img.height
         # to prevent the image from extending beyond the cell
         if to_col_offset < 0:
@@ -1501,8 +1688,41 @@ def add_image_to_excel(ws, cell_value, col_num, row_num, dtable_uuid, repo_id, i
         ws.add_image(img)
         if to_col_offset < 0:
             from_col_offset += image_column_offset_transfer(row_height, img_width, image_height)
-        image_num += 1
-    return image_num
+
+
+def add_images_to_excel(ws, dtable_uuid, repo_id, image_param):
+    """ download the images collected by collect_excel_images with a bounded pool of threads,
+    every image url only once, then anchor them to their cells, call it before saving the workbook
+    """
+    from dtable_events.dtable_io.task_manager import task_manager
+
+    image_cells = image_param.pop('image_cells', None)
+    if not image_cells:
+        return
+    image_urls = list(dict.fromkeys(url for cell in image_cells for url in cell[2]))
+    total = len(image_urls)
+
+    # worker threads have no task context, so pass the token to them
+    token = get_task_token()
+    image_paths = {}
+    workers = max(min(task_manager.conf.get('image_download_workers', 8), total), 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        future_to_url = {executor.submit(download_excel_image, url, dtable_uuid, repo_id,
+                                         image_param['images_target_dir'], token): url
+                         for url in image_urls}
+        try:
+            for future in as_completed(future_to_url):
+                image_paths[future_to_url[future]] = future.result()
+                report_task_progress({'step': 'image', 'downloaded': len(image_paths), 'total': total})
+        except Exception:
+            for future in future_to_url:
+                future.cancel()
+            raise
+
+    for row_num, col_num, urls, col_width, row_height in image_cells:
+        cell_image_paths = [image_paths[url] for url in urls if image_paths.get(url)]
+        if cell_image_paths:
+            add_cell_images_to_excel(ws, cell_image_paths, col_num, row_num, col_width, row_height)
 
 
 def format_time(cell_data):
@@ -1534,7 +1754,7 @@ def format_duration(cell_data, column_data):
 
 
 def handle_grouped_row(row, ws, cols_without_hidden, column_name_to_column, sub_level, summary_col_info, head_name_to_head, summaries):
-    from openpyxl.cell import WriteOnlyCell
+    new_cell = get_cell_factory(ws)
     cell_list = []
     is_first_column = True
     first_col_name = row.get('column_name')
@@ -1545,25 +1765,25 @@ def handle_grouped_row(row, ws, cols_without_hidden, column_name_to_column, sub_
 
         # parse group first column
         if is_first_column and not first_cell_value:
-            c = WriteOnlyCell(ws, value=None)
+            c = new_cell(None)
         elif is_first_column:
             if group_column.get('type') == ColumnTypes.FORMULA and isinstance(group_column.get('data'), dict) \
                     and group_column.get('data').get('result_type') == 'number':
 
                 first_cell_value = parse_summary_value(first_cell_value, group_column.get('data'))
                 formula_value, number_format = parse_formula_number(first_cell_value, group_column.get('data'))
-                c = WriteOnlyCell(ws, value=formula_value)
+                c = new_cell(formula_value)
                 c.number_format = number_format
             else:
                 cell_value = cell_data2str(first_cell_value)
-                c = WriteOnlyCell(ws, value=ILLEGAL_CHARACTERS_RE.sub('', cell_value))
+                c = new_cell(ILLEGAL_CHARACTERS_RE.sub('', cell_value))
         else:
             cell_value = summaries.get(col_name)
             if cell_value:
                 # not empty means summary value
                 # like {'price': {'sum': 89, 'average': 49.5, 'median': 49.5, 'max': 66, 'min': 233}, ...}
                 cell_value = get_summary(cell_value, summary_col_info, col_name, head_name_to_head)
-            c = WriteOnlyCell(ws, value=cell_value)
+            c = new_cell(cell_value)
 
         try:
             c.fill = grouped_row_fills[sub_level]
@@ -1574,99 +1794,151 @@ def handle_grouped_row(row, ws, cols_without_hidden, column_name_to_column, sub_
     return cell_list
 
 
-def handle_row(row, row_num, ws, email2nickname, unknown_user_set, unknown_cell_list, dtable_uuid, repo_id, image_param, cols_without_hidden, row_height, is_big_data_view=False):
+def get_cell_factory(ws):
+    """
+    :return: function(value=None) -> new cell of ws, ws is an openpyxl write only sheet or a StreamSheet
+    """
     from openpyxl.cell import WriteOnlyCell
-    cell_list = []
-    col_num = 0
-    for column in cols_without_hidden:
-        col_name = column.get('name')
-        col_type = column.get('type')
-        cell_value = row.get(col_name)
 
-        if not cell_value and not isinstance(cell_value, int) and not isinstance(cell_value, float):
-            c = WriteOnlyCell(ws, value=None)
+    if isinstance(ws, StreamSheet):
+        return XlsxCell
+    return lambda value=None: WriteOnlyCell(ws, value=value)
 
-        # excel format see
-        # https://support.office.com/en-us/article/Number-format-codes-5026bbd6-04bc-48cd-bf33-80f18b4eae68
-        elif col_type == ColumnTypes.NUMBER:
+
+def compile_column_writer(ws, column, email2nickname, unknown_user_set, unknown_cell_list, image_param, row_height, is_big_data_view=False):
+    """
+    writer of the not empty cells of a column, everything which only depends on the
+    column is decided here instead of for every cell
+    :return: function(cell_value, row_num, col_num) -> excel cell
+    """
+    new_cell = get_cell_factory(ws)
+
+    col_type = column.get('type')
+    column_data = column.get('data')
+
+    def write_text(parse_value):
+        def write(cell_value, row_num, col_num):
+            return new_cell(ILLEGAL_CHARACTERS_RE.sub('', parse_value(cell_value)))
+        return write
+
+    # excel format see
+    # https://support.office.com/en-us/article/Number-format-codes-5026bbd6-04bc-48cd-bf33-80f18b4eae68
+    if col_type == ColumnTypes.NUMBER:
+        if column_data:
+            parse_number = compile_formula_number(column_data, is_big_data_view)
+            get_number_format = lambda cell_value: parse_number(cell_value)[1]
+        else:
+            get_number_format = gen_decimal_format
+
+        def write(cell_value, row_num, col_num):
             # if value cannot convert to float or int, just pass, e.g. empty srt ''
             try:
                 if is_int_str(cell_value):
-                    c = WriteOnlyCell(ws, value=int(cell_value))
-                else:
-                    c = WriteOnlyCell(ws, value=float(cell_value))
-            except Exception as e:
-                c = WriteOnlyCell(ws, value=None)
-            else:
-                column_data = column.get('data')
-                if column_data:
-                    formula_value, number_format = parse_formula_number(cell_value, column.get('data'), is_big_data_view)
-                    c.number_format = number_format
+                    c = new_cell(int(cell_value))
                 else:
-                    c.number_format = gen_decimal_format(cell_value)
-
-        elif col_type == ColumnTypes.DATE:
-            c = WriteOnlyCell(ws, value=format_time(cell_value))
-            if column.get('data'):
-                c.number_format = column.get('data').get('format', '')
-            else:
-                c.number_format = 'YYYY-MM-DD'
-        elif col_type in (ColumnTypes.CTIME, ColumnTypes.MTIME):
-            c = WriteOnlyCell(ws, value=format_time(cell_value))
-        elif col_type == ColumnTypes.DURATION:
-            c = WriteOnlyCell(ws, value=format_duration(cell_value, column.get('data')))
-        elif col_type == ColumnTypes.COLLABORATOR:
+                    c = new_cell(float(cell_value))
+            except Exception:
+                return new_cell(None)
+            c.number_format = get_number_format(cell_value)
+            return c
+        return write
+
+    if col_type == ColumnTypes.DATE:
+        date_format = column_data.get('format', '') if column_data else 'YYYY-MM-DD'
+
+        def write(cell_value, row_num, col_num):
+            c = new_cell(format_time(cell_value))
+            c.number_format = date_format
+            return c
+        return write
+
+    if col_type in (ColumnTypes.CTIME, ColumnTypes.MTIME):
+        return lambda cell_value, row_num, col_num: new_cell(format_time(cell_value))
+
+    if col_type == ColumnTypes.DURATION:
+        return lambda cell_value, row_num, col_num: new_cell(format_duration(cell_value, column_data))
+
+    get_nickname = email2nickname.get
+    add_unknown_user = unknown_user_set.add
+    add_unknown_cell = unknown_cell_list.append
+
+    if col_type == ColumnTypes.COLLABORATOR:
+        def write(cell_value, row_num, col_num):
             nickname_list = []
             collaborator_email_list = []
             for user in cell_value:
-                if not email2nickname.get(user, ''):
-                    unknown_user_set.add(user)
+                nickname = get_nickname(user, '')
+                if not nickname:
+                    add_unknown_user(user)
                     collaborator_email_list.append(user)
                 else:
-                    nickname_list.append(email2nickname.get(user, ''))
-            nicknames = ', '.join(nickname_list)
-            c = WriteOnlyCell(ws, value=nicknames)
+                    nickname_list.append(nickname)
+            c = new_cell(', '.join(nickname_list))
             if collaborator_email_list:
-                unknown_cell_list.append((c, (nickname_list, collaborator_email_list), col_type))
-            c.value = ', '.join(nickname_list)
-        elif col_type == ColumnTypes.CREATOR:
-            c = WriteOnlyCell(ws, value=email2nickname.get(cell_data2str(cell_value), ''))
-            if not email2nickname.get(cell_data2str(cell_value), ''):
-                unknown_user_set.add(cell_data2str(cell_value))
-                unknown_cell_list.append((c, cell_data2str(cell_value), col_type))
-        elif col_type == ColumnTypes.LAST_MODIFIER:
-            c = WriteOnlyCell(ws, value=email2nickname.get(cell_data2str(cell_value), ''))
-            if not email2nickname.get(cell_data2str(cell_value), ''):
-                unknown_user_set.add(cell_data2str(cell_value))
-                unknown_cell_list.append((c, cell_data2str(cell_value), col_type))
-        elif col_type == ColumnTypes.FORMULA \
-                and isinstance(column.get('data'), dict) and column.get('data').get('result_type') == 'number':
-            formula_value, number_format = parse_formula_number(cell_value, column.get('data'), is_big_data_view)
-            c = WriteOnlyCell(ws, value=formula_value)
+                add_unknown_cell((c, (nickname_list, collaborator_email_list), col_type))
+            return c
+        return write
+
+    if col_type in (ColumnTypes.CREATOR, ColumnTypes.LAST_MODIFIER):
+        def write(cell_value, row_num, col_num):
+            email = cell_data2str(cell_value)
+            nickname = get_nickname(email, '')
+            c = new_cell(nickname)
+            if not nickname:
+                add_unknown_user(email)
+                add_unknown_cell((c, email, col_type))
+            return c
+        return write
+
+    if col_type == ColumnTypes.FORMULA and isinstance(column_data, dict) and column_data.get('result_type') == 'number':
+        parse_number = compile_formula_number(column_data, is_big_data_view)
+
+        def write(cell_value, row_num, col_num):
+            formula_value, number_format = parse_number(cell_value)
+            c = new_cell(formula_value)
             c.number_format = number_format
-        elif col_type == ColumnTypes.IMAGE and cell_value and image_param['is_support']:
-            c = WriteOnlyCell(ws)
-            image_num = image_param.get('num')
-            images_target_dir = image_param.get('images_target_dir')
-            if image_num < EXPORT_IMAGE_LIMIT:
-                num = add_image_to_excel(ws, cell_value, col_num, row_num, dtable_uuid, repo_id, image_num, images_target_dir, column, row_height)
-                image_param['num'] = num
-        else:
-            if col_type == ColumnTypes.GEOLOCATION:
-                cell_value = parse_geolocation(cell_value)
-            elif col_type == ColumnTypes.LINK_FORMULA:
-                cell_value = parse_link_formula(cell_value, email2nickname)
-            elif col_type == ColumnTypes.MULTIPLE_SELECT:
-                cell_value = parse_multiple_select_formula(cell_value)
-            elif col_type == ColumnTypes.LINK:
-                cell_value = parse_link(column, cell_value, email2nickname)
-            elif col_type == ColumnTypes.LONG_TEXT:
-                cell_value = parse_dtable_long_text(cell_value)
-            else:
-                cell_value = cell_data2str(cell_value)
-            c = WriteOnlyCell(ws, value=ILLEGAL_CHARACTERS_RE.sub('', cell_value))
+            return c
+        return write
+
+    if col_type == ColumnTypes.IMAGE and image_param['is_support']:
+        def write(cell_value, row_num, col_num):
+            if image_param.get('num') < EXPORT_IMAGE_LIMIT:
+                collect_excel_images(cell_value, col_num, row_num, image_param, column, row_height)
+            return new_cell()
+        return write
+
+    if col_type == ColumnTypes.GEOLOCATION:
+        return write_text(parse_geolocation)
+    if col_type == ColumnTypes.LINK_FORMULA:
+        return write_text(lambda cell_value: parse_link_formula(cell_value, email2nickname))
+    if col_type == ColumnTypes.MULTIPLE_SELECT:
+        return write_text(parse_multiple_select_formula)
+    if col_type == ColumnTypes.LINK:
+        return write_text(lambda cell_value: parse_link(column, cell_value, email2nickname))
+    if col_type == ColumnTypes.LONG_TEXT:
+        return write_text(parse_dtable_long_text)
+    return write_text(cell_data2str)
+
+
+def compile_column_writers(ws, cols_without_hidden, email2nickname, unknown_user_set, unknown_cell_list, image_param, row_height, is_big_data_view=False):
+    """
+    :return: [(column name, cell writer)] of the exported columns, see compile_column_writer
+    """
+    return [(column.get('name'), compile_column_writer(ws, column, email2nickname, unknown_user_set, unknown_cell_list,
+                                                       image_param, row_height, is_big_data_view))
+            for column in cols_without_hidden]
 
-        cell_list.append(c)
+
+def handle_row(row, row_num, column_writers):
+    cell_list = []
+    col_num = 0
+    for col_name, write_cell in column_writers:
+        cell_value = row.get(col_name)
+        if not cell_value and not isinstance(cell_value, (int, float)):
+            # empty cell
+            cell_list.append(None)
+        else:
+            cell_list.append(write_cell(cell_value, row_num, col_num))
         col_num += 1
     return cell_list
 
@@ -1675,19 +1947,24 @@ def write_xls_with_type(data_list, email2nickname, ws, row_num, dtable_uuid, rep
     """ write listed data into excel
     """
     from dtable_events.dtable_io import dtable_io_logger
-    from openpyxl.cell import WriteOnlyCell
     from openpyxl.utils import get_column_letter
     from dtable_events.dtable_io.utils import width_transfer, height_transfer
 
+    new_cell = get_cell_factory(ws)
+
     ws.row_dimensions[1].height = height_transfer(header_height) # set header height
     if row_num == 0:
+        if not is_group_view:
+            # one default height for all data rows instead of a row dimension per row
+            ws.sheet_format.defaultRowHeight = height_transfer(row_height)
+            ws.sheet_format.customHeight = True
         # write table head
         column_error_log_exists = False
         head_cell_list = []
         col_num = 0
         for col in cols_without_hidden:
             try:
-                c = WriteOnlyCell(ws, value=col.get('name'))
+                c = new_cell(col.get('name'))
                 col_pos = get_column_letter(col_num + 1)
                 col_width = col.get('width', 200)
                 col_width_xls = width_transfer(col_width)
@@ -1697,7 +1974,7 @@ def write_xls_with_type(data_list, email2nickname, ws, row_num, dtable_uuid, rep
                 if not column_error_log_exists:
                     dtable_io_logger.error('Error column in exporting excel: {}'.format(e))
                     column_error_log_exists = True
-                c = WriteOnlyCell(ws, value=EXPORT2EXCEL_DEFAULT_STRING)
+                c = new_cell(EXPORT2EXCEL_DEFAULT_STRING)
             head_cell_list.append(c)
             col_num += 1
         ws.append(head_cell_list)
@@ -1706,23 +1983,24 @@ def write_xls_with_type(data_list, email2nickname, ws, row_num, dtable_uuid, rep
     row_error_log_exists = False
     unknown_user_set = set()
     unknown_cell_list = []
+    column_writers = compile_column_writers(ws, cols_without_hidden, email2nickname, unknown_user_set, unknown_cell_list,
+                                            image_param, row_height, is_big_data_view)
 
     if is_group_view:
         row_list = []
         # for insert image
         row_num_info = {'row_num': row_num + 1}
         sub_level = 0
-        handle_grouped_view_rows(data_list, row_num_info, ws, email2nickname, unknown_user_set, unknown_cell_list, dtable_uuid,
-                         repo_id, image_param, cols_without_hidden, column_name_to_column, summary_col_info, row_list, sub_level, row_height)
+        handle_grouped_view_rows(data_list, row_num_info, ws, column_writers, cols_without_hidden, column_name_to_column,
+                                 summary_col_info, row_list, sub_level)
     else:
         row_list = []
         for row in data_list:
+            if row_num % 1000 == 0:
+                check_task_cancelled()
             row_num += 1  # for big data view
             try:
-                params = (row, row_num, ws, email2nickname, unknown_user_set, unknown_cell_list, dtable_uuid, repo_id,
-                          image_param, cols_without_hidden, row_height, is_big_data_view)
-                row_cells = handle_row(*params)
-                ws.row_dimensions[row_num + 1].height = height_transfer(row_height)
+                row_cells = handle_row(row, row_num, column_writers)
             except Exception as e:
                 if not row_error_log_exists:
                     dtable_io_logger.exception(e)
@@ -1740,8 +2018,8 @@ def write_xls_with_type(data_list, email2nickname, ws, row_num, dtable_uuid, rep
         ws.append(row)
 
 
-def handle_grouped_view_rows(view_rows, row_num_info, ws, email2nickname, unknown_user_set, unknown_cell_list, dtable_uuid,
-                    repo_id, image_param, cols_without_hidden, column_name_to_column, summary_col_info, row_list, sub_level, row_height):
+def handle_grouped_view_rows(view_rows, row_num_info, ws, column_writers, cols_without_hidden, column_name_to_column,
+                             summary_col_info, row_list, sub_level):
     head_name_to_head = {head.get('name'): head for head in cols_without_hidden}
     for row in view_rows:
         group_subgroups = row.get('subgroups')
@@ -1754,12 +2032,22 @@ def handle_grouped_view_rows(view_rows, row_num_info, ws, email2nickname, unknow
         row_list.append(row_cells)
 
         if group_rows is None and group_subgroups:
-            handle_grouped_view_rows(group_subgroups, row_num_info, ws, email2nickname, unknown_user_set, unknown_cell_list,
-                            dtable_uuid, repo_id, image_param, cols_without_hidden, column_name_to_column, summary_col_info, row_list, sub_level + 1, row_height)
+            handle_grouped_view_rows(group_subgroups, row_num_info, ws, column_writers, cols_without_hidden,
+                                     column_name_to_column, summary_col_info, row_list, sub_level + 1)
         else:
             for group_row in group_rows:
                 # write normal row to ws
-                row_cells = handle_row(group_row, row_num_info.get('row_num'), ws, email2nickname, unknown_user_set, unknown_cell_list,
-                                       dtable_uuid, repo_id, image_param, cols_without_hidden, row_height)
+                row_cells = handle_row(group_row, row_num_info.get('row_num'), column_writers)
                 row_list.append(row_cells)
                 row_num_info['row_num'] += 1
+
+
+def iter_grouped_view_rows(view_rows):
+    """ rows of a grouped view without the group rows, for files without grouping like csv
+    """
+    for row in view_rows:
+        group_rows = row.get('rows')
+        if group_rows is None and row.get('subgroups'):
+            yield from iter_grouped_view_rows(row.get('subgroups'))
+        else:
+            yield from group_rows or []
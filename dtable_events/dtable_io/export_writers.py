@@ -0,0 +1,212 @@
+import csv
+import os
+from datetime import datetime
+
+from openpyxl import Workbook
+
+from dtable_events.dtable_io.xlsx_writer import StreamSheet, XlsxCell, XlsxStreamWorkbook
+from dtable_events.utils.constants import ColumnTypes
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_FILE_TYPES = ('xlsx', 'csv', 'parquet')
+PARQUET_ROW_GROUP_SIZE = 10000
+
+
+def is_export_file_type_supported(file_type):
+    if file_type == 'parquet':
+        return pyarrow is not None
+    return file_type in EXPORT_FILE_TYPES
+
+
+def open_export_workbook(file_type, filename, columns, excel_writer='openpyxl'):
+    """ workbook to export rows of columns to filename
+
+    All workbooks create sheets by `create_sheet(title)`, which are openpyxl write only
+    sheets or StreamSheet, `close()` finishes the file and `discard()` removes an unfinished one.
+
+    :param file_type: one of EXPORT_FILE_TYPES, csv and parquet files have only one sheet
+    :param excel_writer: writer of xlsx files, 'openpyxl' or 'stream'
+    """
+    if file_type == 'csv':
+        return CsvStreamWorkbook(filename)
+    if file_type == 'parquet':
+        if pyarrow is None:
+            raise ValueError('pyarrow is not installed, can not export parquet file')
+        return ParquetStreamWorkbook(filename, columns)
+    if excel_writer == 'stream':
+        return XlsxStreamWorkbook(filename)
+    return OpenpyxlWorkbook(filename)
+
+
+def get_cell_value(cell):
+    if isinstance(cell, XlsxCell):
+        return cell.value
+    return cell
+
+
+class OpenpyxlWorkbook(object):
+    """ openpyxl write only workbook with the interface of the stream workbooks
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.workbook = Workbook(write_only=True)
+
+    def create_sheet(self, title):
+        return self.workbook.create_sheet(title)
+
+    def close(self):
+        self.workbook.save(self.filename)
+
+    def discard(self):
+        pass
+
+
+class CsvStreamSheet(StreamSheet):
+
+    def __init__(self, title, csv_writer):
+        super(CsvStreamSheet, self).__init__(title)
+        self.csv_writer = csv_writer
+
+    def append(self, row):
+        self.max_row += 1
+        values = []
+        for cell in row:
+            value = get_cell_value(cell)
+            if value is None:
+                value = ''
+            elif isinstance(value, datetime):
+                value = str(value)
+            values.append(value)
+        self.csv_writer.writerow(values)
+
+
+class CsvStreamWorkbook(object):
+    """ utf-8 csv file of one sheet, rows are written into the file when they are appended,
+    number formats of cells are ignored
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'w', newline='', encoding='utf-8')
+        self.sheet = None
+
+    def create_sheet(self, title):
+        if self.sheet is not None:
+            raise ValueError('csv file has only one sheet')
+        self.sheet = CsvStreamSheet(title, csv.writer(self.file))
+        return self.sheet
+
+    def close(self):
+        self.file.close()
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+def to_parquet_float(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+def to_parquet_timestamp(value):
+    if isinstance(value, datetime):
+        return value
+    return None
+
+
+def to_parquet_string(value):
+    if value is None or value == '':
+        return None
+    return str(value)
+
+
+def get_parquet_field(column):
+    """ :return: (pyarrow field, function to convert cell values of the column)
+    """
+    column_type = column.get('type')
+    column_data = column.get('data')
+    if column_type == ColumnTypes.NUMBER or (column_type == ColumnTypes.FORMULA and isinstance(column_data, dict)
+                                              and column_data.get('result_type') == 'number'):
+        return pyarrow.field(column.get('name'), pyarrow.float64()), to_parquet_float
+    if column_type in (ColumnTypes.DATE, ColumnTypes.CTIME, ColumnTypes.MTIME):
+        return pyarrow.field(column.get('name'), pyarrow.timestamp('us')), to_parquet_timestamp
+    return pyarrow.field(column.get('name'), pyarrow.string()), to_parquet_string
+
+
+class ParquetStreamSheet(StreamSheet):
+    """ sheet of ParquetStreamWorkbook, the first row is the head row and skipped, the
+    names and types of the columns are in the schema of the file
+    """
+
+    def __init__(self, title, writer, schema, converters):
+        super(ParquetStreamSheet, self).__init__(title)
+        self.writer = writer
+        self.schema = schema
+        self.converters = converters
+        self.rows = []
+
+    def append(self, row):
+        self.max_row += 1
+        if self.max_row == 1:
+            return
+        self.rows.append([get_cell_value(cell) for cell in row])
+        if len(self.rows) >= PARQUET_ROW_GROUP_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        arrays = []
+        for index, (field, convert) in enumerate(zip(self.schema, self.converters)):
+            values = [convert(row[index]) if index < len(row) else None for row in self.rows]
+            arrays.append(pyarrow.array(values, type=field.type))
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+        self.rows = []
+
+
+class ParquetStreamWorkbook(object):
+    """ parquet file of one sheet, every PARQUET_ROW_GROUP_SIZE appended rows are written as
+    a row group
+
+    Number and number formula columns are float64, date, ctime and mtime columns are
+    timestamps, others are strings of the cell values written to excel.
+    """
+
+    def __init__(self, filename, columns):
+        self.filename = filename
+        self.columns = columns
+        self.sheet = None
+
+    def create_sheet(self, title):
+        if self.sheet is not None:
+            raise ValueError('parquet file has only one sheet')
+        fields, converters = [], []
+        for column in self.columns:
+            field, convert = get_parquet_field(column)
+            fields.append(field)
+            converters.append(convert)
+        schema = pyarrow.schema(fields)
+        writer = pyarrow.parquet.ParquetWriter(self.filename, schema)
+        self.sheet = ParquetStreamSheet(title, writer, schema, converters)
+        return self.sheet
+
+    def close(self):
+        if self.sheet is None:
+            self.create_sheet('Sheet')
+        self.sheet.flush()
+        self.sheet.writer.close()
+
+    def discard(self):
+        if self.sheet is not None:
+            self.sheet.writer.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
@@ -31,13 +31,14 @@ def force_sync_common_dataset(context: dict, config):
         WHERE dcd.id=:dataset_id AND dcd.is_valid=1 AND dcds.is_valid=1 AND dcds.dst_dtable_uuid IN :dst_dtable_uuids
     '''
     results = []
+    lock_tokens = {}
     with session_class() as db_session:
         for sync_item in db_session.execute(text(sql), {'dataset_id': dataset_id, 'dst_dtable_uuids': dst_dtable_uuids}):
-            with task_manager.dataset_sync_ids_lock:
-                if task_manager.is_syncing(sync_item.sync_id):
-                    continue
-                results.append(sync_item)
-                task_manager.add_dataset_sync(sync_item.sync_id)
+            lock_token = task_manager.acquire_dataset_sync(sync_item.sync_id)
+            if not lock_token:
+                continue
+            lock_tokens[sync_item.sync_id] = lock_token
+            results.append(sync_item)
         # sync one by one
         try:
             batch_sync_common_dataset(dataset_id, results, db_session, is_force_sync=True, operator=context.get('username'))
@@ -45,7 +46,7 @@ def force_sync_common_dataset(context: dict, config):
             dtable_io_logger.exception('force sync dataset: %s error: %s', dataset_id, e)
         else:
             for sync_item in results:
-                task_manager.finish_dataset_sync(sync_item.sync_id)
+                task_manager.finish_dataset_sync(sync_item.sync_id, lock_tokens.get(sync_item.sync_id))
 
 
 def sync_common_dataset(context, config):
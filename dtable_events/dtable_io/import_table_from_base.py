@@ -3,6 +3,8 @@ import os
 import re
 import time
 import json
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import unquote
 
 import jwt
@@ -15,11 +17,16 @@ from dtable_events.dtable_io import dtable_io_logger
 from dtable_events.utils import get_inner_dtable_server_url
 from dtable_events.utils.constants import ColumnTypes, DATE_FORMATS, DURATION_FORMATS, NUMBER_FORMATS, NUMBER_DECIMALS,\
     NUMBER_THOUSANDS, GEO_FORMATS
+from dtable_events.utils.bulk_writer import AdaptiveBatchWriter
 from dtable_events.utils.dtable_column_utils import AutoNumberUtils
+from dtable_events.utils.http_compression import compress_json_body
 
 service_url = DTABLE_WEB_SERVICE_URL.strip()
 dtable_server_url = get_inner_dtable_server_url().rstrip('/')
 
+COPY_ASSET_BATCH_SIZE = 100  # files per copy_file call
+COPY_ASSET_DIR_WORKERS = 4  # dirs copied concurrently
+
 
 def _trans_url(url, workspace_id, dtable_uuid):
     if url.startswith(service_url):
@@ -50,10 +57,18 @@ def _trans_long_text(long_text, workspace_id, dtable_uuid):
 
 
 def _parse_asset_path(url):
-    asset_path = ''
-    if url.startswith(service_url):
-        url = unquote(url)
-        asset_path = url[url.find('/asset/')+44:]
+    """ return the asset path relative to the asset dir of the base, '' if url is not an asset in it
+    """
+    if not url.startswith(service_url):
+        return ''
+    url = unquote(url)
+    index = url.find('/asset/')
+    if index == -1:
+        return ''
+    # skip '/asset/<dtable_uuid>/'
+    asset_path = os.path.normpath(url[index+44:].lstrip('/'))
+    if asset_path in ('.', '..') or asset_path.startswith('../'):
+        return ''
     return asset_path
 
 
@@ -86,22 +101,48 @@ def _get_asset_path_list(row, img_cols, file_cols, long_text_cols):
     return asset_path_list
 
 
+def _copy_asset_dir_files(src_repo_id, src_dir, dst_repo_id, dst_dir, file_names, username):
+    for i in range(0, len(file_names), COPY_ASSET_BATCH_SIZE):
+        batch_file_names = json.dumps(file_names[i: i + COPY_ASSET_BATCH_SIZE])
+        seafile_api.copy_file(src_repo_id, src_dir, batch_file_names,
+                              dst_repo_id, dst_dir, batch_file_names,
+                              username, need_progress=1)
+
+
 def _copy_table_assets(asset_path_list, src_repo_id, src_dtable_uuid, dst_repo_id, dst_dtable_uuid, username):
     src_asset_dir = os.path.join('/asset', src_dtable_uuid)
     src_asset_dir_id = seafile_api.get_dir_id_by_path(src_repo_id, src_asset_dir)
-    if src_asset_dir_id:
-        dst_asset_dir = os.path.join('/asset', dst_dtable_uuid)
-        if not seafile_api.get_dir_id_by_path(dst_repo_id, dst_asset_dir):
-            seafile_api.mkdir_with_parents(dst_repo_id, '/', dst_asset_dir[1:], username)
-        for asset_path in list(asset_path_list):
-            src_full_path = os.path.dirname(os.path.join('/asset', src_dtable_uuid, asset_path))
-            dst_full_path = os.path.dirname(os.path.join('/asset', dst_dtable_uuid, asset_path))
-            if not seafile_api.get_dir_id_by_path(dst_repo_id, dst_full_path):
-                seafile_api.mkdir_with_parents(dst_repo_id, '/', dst_full_path[1:], username)
-            file_name = os.path.basename(asset_path)
-            seafile_api.copy_file(src_repo_id, src_full_path, json.dumps([file_name]),
-                                  dst_repo_id, dst_full_path, json.dumps([file_name]),
-                                  username, need_progress=1)
+    if not src_asset_dir_id:
+        return
+    # group assets by parent dir, files of one dir are copied by one call
+    dir_file_names = defaultdict(list)
+    for asset_path in asset_path_list:
+        if not asset_path:
+            continue
+        dir_file_names[os.path.dirname(asset_path)].append(os.path.basename(asset_path))
+
+    dst_asset_dir = os.path.join('/asset', dst_dtable_uuid)
+    checked_dst_dirs = set()
+    for asset_dir in dir_file_names:
+        dst_full_path = os.path.join(dst_asset_dir, asset_dir).rstrip('/')
+        if dst_full_path in checked_dst_dirs:
+            continue
+        if not seafile_api.get_dir_id_by_path(dst_repo_id, dst_full_path):
+            seafile_api.mkdir_with_parents(dst_repo_id, '/', dst_full_path[1:], username)
+        # parents are created by mkdir_with_parents too
+        while dst_full_path.startswith(dst_asset_dir) and dst_full_path not in checked_dst_dirs:
+            checked_dst_dirs.add(dst_full_path)
+            dst_full_path = os.path.dirname(dst_full_path)
+
+    workers = max(min(COPY_ASSET_DIR_WORKERS, len(dir_file_names)), 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_copy_asset_dir_files,
+                                   src_repo_id, os.path.join('/asset', src_dtable_uuid, asset_dir).rstrip('/'),
+                                   dst_repo_id, os.path.join('/asset', dst_dtable_uuid, asset_dir).rstrip('/'),
+                                   file_names, username)
+                   for asset_dir, file_names in dir_file_names.items()]
+        for future in futures:
+            future.result()
 
 
 def trans_and_copy_asset(table, src_repo_id, src_dtable_uuid, dst_workspace_id, dst_repo_id, dst_dtable_uuid, username):
@@ -113,9 +154,9 @@ def trans_and_copy_asset(table, src_repo_id, src_dtable_uuid, dst_workspace_id,
         asset_path_list = set()
         for row in table['rows']:
             _trans_rows_content(dst_workspace_id, dst_dtable_uuid, row, img_cols, file_cols, long_text_cols)
-            asset_path_list = asset_path_list | _get_asset_path_list(row, img_cols, file_cols, long_text_cols)
+            asset_path_list.update(_get_asset_path_list(row, img_cols, file_cols, long_text_cols))
 
-        _copy_table_assets(list(asset_path_list), src_repo_id, src_dtable_uuid,
+        _copy_table_assets(asset_path_list, src_repo_id, src_dtable_uuid,
                            dst_repo_id, dst_dtable_uuid, username)
     except Exception as e:
         dtable_io_logger.error('trans_and_copy_asset: %s' % e)
@@ -299,26 +340,29 @@ def import_table_from_base(context):
 
         # import src_rows step by step
         src_rows = new_table.get('rows', [])
-        step = 1000
         url = '%s/api/v1/dtables/%s/batch-append-rows/?from=dtable_events' % (dtable_server_url, dst_dtable_uuid)
-        for i in range(0, len(src_rows), step):
+
+        def batch_append_rows(rows):
             data = {
                 'table_name': dst_table_name,
-                'rows': src_rows[i: i + step],
+                'rows': rows,
                 'need_convert_back': False
             }
-            try:
-                resp = requests.post(url, headers=dst_headers, json=data, timeout=180)
-                if resp.status_code != 200:
-                    error_msg = 'batch append rows to dst dtable: %s dst table: %s error: %s status_code: %s' % \
-                                (dst_dtable_uuid, dst_table_name, resp.text, resp.status_code)
-                    dtable_io_logger.error(error_msg)
-                    raise Exception(error_msg)
-            except Exception as e:
-                error_msg = 'batch append rows to dst dtable: %s dst table: %s error: %s' % \
-                            (dst_dtable_uuid, dst_table_name, e)
+            body, headers = compress_json_body(data, dst_headers)
+            resp = requests.post(url, headers=headers, data=body, timeout=180)
+            if resp.status_code != 200:
+                error_msg = 'batch append rows to dst dtable: %s dst table: %s error: %s status_code: %s' % \
+                            (dst_dtable_uuid, dst_table_name, resp.text, resp.status_code)
                 dtable_io_logger.error(error_msg)
-                raise Exception(error_msg)
+                raise ConnectionError(resp.status_code, error_msg)
+
+        try:
+            AdaptiveBatchWriter(batch_append_rows).write(src_rows)
+        except Exception as e:
+            error_msg = 'batch append rows to dst dtable: %s dst table: %s error: %s' % \
+                        (dst_dtable_uuid, dst_table_name, e)
+            dtable_io_logger.error(error_msg)
+            raise Exception(error_msg)
     except Exception as e:
         error_msg = 'import_table_from_base: %s' % e
         try:
@@ -1,8 +1,10 @@
 import json
 import jwt
 import logging
+import queue
+import time
 
-from flask import Flask, request, make_response
+from flask import Flask, Response, request, make_response
 
 from dtable_events.app.config import DTABLE_PRIVATE_KEY
 from dtable_events.dtable_io.task_manager import task_manager
@@ -10,11 +12,18 @@ from dtable_events.dtable_io.task_message_manager import message_task_manager
 from dtable_events.dtable_io.task_data_sync_manager import data_sync_task_manager
 from dtable_events.dtable_io.task_plugin_email_manager import plugin_email_task_manager
 from dtable_events.dtable_io.task_big_data_manager import big_data_task_manager
+from dtable_events.dtable_io.task_scheduler import task_scheduler
+from dtable_events.dtable_io.export_writers import is_export_file_type_supported
 from dtable_events.dtable_io.utils import to_python_boolean
+from dtable_events.utils.token_cache import verified_token_cache
 
 app = Flask(__name__)
 logger = logging.getLogger(__name__)
 
+# max seconds a long-poll status query waits for task finished or progress
+MAX_STATUS_WAIT = 30
+MAX_BATCH_STATUS_TASKS = 100
+
 
 def check_auth_token(req):
     auth = req.headers.get('Authorization', '').split()
@@ -27,13 +36,37 @@ def check_auth_token(req):
 
     private_key = DTABLE_PRIVATE_KEY
     try:
-        jwt.decode(token, private_key, algorithms=['HS256'])
+        verified_token_cache.verify(token, private_key)
     except (jwt.ExpiredSignatureError, jwt.InvalidSignatureError) as e:
         return False, e
 
     return True, None
 
 
+def get_status_wait_seconds(req):
+    try:
+        wait = int(req.args.get('wait', 0))
+    except ValueError:
+        return 0
+    return min(max(wait, 0), MAX_STATUS_WAIT)
+
+
+def get_task_status(task_id):
+    """ status of a task_manager task, finished task result is consumed like /query-status
+    """
+    if not task_manager.is_valid_task_id(task_id):
+        return {'error': 'task_id not found.'}
+    is_finished, error = task_manager.query_status(task_id)
+    status = {'is_finished': is_finished}
+    if error:
+        status['error'] = error
+    elif not is_finished:
+        progress = task_manager.query_progress(task_id)
+        if progress:
+            status['progress'] = progress
+    return status
+
+
 @app.route('/add-export-task', methods=['GET'])
 def add_export_task():
     from dtable_events.utils import parse_bool
@@ -41,10 +74,10 @@ def add_export_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.long_tasks_queue.full():
         from dtable_events.dtable_io import dtable_io_logger
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.long_tasks_queue.qsize(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -58,6 +91,8 @@ def add_export_task():
     try:
         task_id = task_manager.add_export_task(
             username, repo_id, workspace_id, dtable_uuid, table_name, ignore_asset)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -95,6 +130,8 @@ def add_import_task():
         task_id = task_manager.add_import_task(
             username, repo_id, workspace_id, dtable_uuid, dtable_file_name, in_storage, can_use_automation_rules,
             can_use_workflows, can_use_external_apps, owner, org_id)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -107,10 +144,10 @@ def add_big_data_screen_export_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.long_tasks_queue.full():
         from dtable_events.dtable_io import dtable_io_logger
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.long_tasks_queue.qsize(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -122,6 +159,8 @@ def add_big_data_screen_export_task():
     try:
         task_id = task_manager.add_export_dtable_big_data_screen_task(
             username, repo_id, dtable_uuid, page_id)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -149,6 +188,8 @@ def add_big_data_screen_import_task():
     try:
         task_id = task_manager.add_import_dtable_big_data_screen_task(
             username, repo_id, dtable_uuid, page_id)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -179,6 +220,8 @@ def add_parse_excel_csv_task():
     try:
         task_id = task_manager.add_parse_excel_csv_task(
             username, repo_id, file_name, file_type, parse_type, dtable_uuid)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -215,6 +258,8 @@ def add_import_excel_csv_task():
     try:
         task_id = task_manager.add_import_excel_csv_task(
             username, repo_id, dtable_uuid, dtable_name, included_tables, lang)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -250,6 +295,8 @@ def add_import_excel_csv_add_table_task():
     try:
         task_id = task_manager.add_import_excel_csv_add_table_task(
             username, dtable_uuid, dtable_name, included_tables, lang)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -278,6 +325,8 @@ def add_append_excel_csv_append_parsed_file_task():
     try:
         task_id = task_manager.add_append_excel_csv_append_parsed_file_task(
             username, dtable_uuid, file_name, table_name)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -308,6 +357,8 @@ def add_append_excel_csv_upload_file_task():
     try:
         task_id = task_manager.add_append_excel_csv_upload_file_task(
             username, file_name, dtable_uuid, table_name, file_type)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -325,6 +376,11 @@ def query_status():
     if not task_manager.is_valid_task_id(task_id):
         return make_response(('task_id not found.', 404))
 
+    # long-poll, answer when the task finished or its progress changed
+    wait = get_status_wait_seconds(request)
+    if wait:
+        task_manager.wait_for_status([task_id], wait)
+
     try:
         is_finished, error = task_manager.query_status(task_id)
     except Exception as e:
@@ -334,7 +390,67 @@ def query_status():
     if error:
         return make_response((error, 500))
 
-    return make_response(({'is_finished': is_finished}, 200))
+    resp = {'is_finished': is_finished}
+    if not is_finished:
+        progress = task_manager.query_progress(task_id)
+        if progress:
+            resp['progress'] = progress
+    return make_response((resp, 200))
+
+
+@app.route('/query-status-batch', methods=['GET'])
+def query_status_batch():
+    is_valid, error = check_auth_token(request)
+    if not is_valid:
+        return make_response((error, 403))
+
+    task_ids = [task_id for task_id in request.args.get('task_ids', '').split(',') if task_id]
+    if not task_ids or len(task_ids) > MAX_BATCH_STATUS_TASKS:
+        return make_response(('task_ids invalid.', 400))
+
+    # long-poll, answer when any of the tasks finished or its progress changed
+    wait = get_status_wait_seconds(request)
+    if wait:
+        task_manager.wait_for_status(task_ids, wait)
+
+    try:
+        tasks = {task_id: get_task_status(task_id) for task_id in task_ids}
+    except Exception as e:
+        logger.error(e)
+        return make_response((e, 500))
+
+    return make_response(({'tasks': tasks}, 200))
+
+
+@app.route('/task-status-events', methods=['GET'])
+def task_status_events():
+    """ server-sent events of a task's progress, ends with a `finished` event
+    """
+    is_valid, error = check_auth_token(request)
+    if not is_valid:
+        return make_response((error, 403))
+
+    task_id = request.args.get('task_id')
+    if not task_manager.is_valid_task_id(task_id):
+        return make_response(('task_id not found.', 404))
+
+    def gen_events():
+        last_progress = None
+        deadline = time.time() + task_manager.conf.get('io_task_timeout', 3600)
+        while time.time() < deadline:
+            task_manager.wait_for_status([task_id], 15, {task_id: last_progress})
+            status = get_task_status(task_id)
+            if status.get('is_finished') or 'error' in status:
+                yield 'event: finished\ndata: %s\n\n' % json.dumps(status)
+                return
+            progress = status.get('progress')
+            if progress != last_progress:
+                last_progress = progress
+                yield 'event: progress\ndata: %s\n\n' % json.dumps(progress)
+            else:
+                yield ': keep-alive\n\n'
+
+    return Response(gen_events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 
 @app.route('/cancel-task', methods=['GET'])
@@ -416,6 +532,8 @@ def convert_page_to_pdf():
     try:
         task_id = task_manager.convert_page_to_pdf(
             dtable_uuid, page_id, row_id)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -429,10 +547,10 @@ def dtable_asset_files():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.long_tasks_queue.full():
         from dtable_events.dtable_io import dtable_io_logger
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.long_tasks_queue.qsize(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -454,6 +572,8 @@ def dtable_asset_files():
     try:
         task_id = task_manager.add_export_dtable_asset_files_task(
             username, repo_id, dtable_uuid, files, files_map)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -467,10 +587,10 @@ def transfer_dtable_asset_files():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.long_tasks_queue.full():
         from dtable_events.dtable_io import dtable_io_logger
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.long_tasks_queue.qsize(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -498,6 +618,8 @@ def transfer_dtable_asset_files():
         task_id = task_manager.add_transfer_dtable_asset_files_task(
             username, repo_id, dtable_uuid, files, files_map, parent_dir,
             relative_path, replace, repo_api_token, seafile_server_url)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -524,6 +646,8 @@ def add_wechat_sending_task():
 
     try:
         task_id = message_task_manager.add_wechat_sending_task(webhook_url, msg, msg_type)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -549,6 +673,8 @@ def add_dingtalk_sending_task():
 
     try:
         task_id = message_task_manager.add_dingtalk_sending_task(webhook_url, msg)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -610,6 +736,8 @@ def add_email_sending_task():
     try:
         task_id = message_task_manager.add_email_sending_task(
             auth_info, send_info, username)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -642,6 +770,8 @@ def add_notification_sending_task():
         task_id = message_task_manager.add_notification_sending_task(
             email_list, user_col_key, msg, dtable_uuid, username, table_id, row_id
         )
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -673,6 +803,8 @@ def add_run_auto_rule_task():
     try:
         task_id = task_manager.add_run_auto_rule_task(
             automation_rule_id, username, org_id, dtable_uuid, run_condition, trigger, actions)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -701,6 +833,8 @@ def add_update_excel_upload_excel_task():
     try:
         task_id = task_manager.add_update_excel_upload_excel_task(
             username, file_name, dtable_uuid, table_name, )
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -730,6 +864,8 @@ def add_update_excel_csv_update_parsed_file_task():
     try:
         task_id = task_manager.add_update_excel_csv_update_parsed_file_task(
             username, dtable_uuid, file_name, table_name, selected_columns)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -759,6 +895,8 @@ def add_update_csv_upload_csv_task():
     try:
         task_id = task_manager.add_update_csv_upload_csv_task(
             username, file_name, dtable_uuid, table_name)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -788,6 +926,8 @@ def add_import_excel_csv_to_dtable_task():
 
     try:
         task_id = task_manager.add_import_excel_csv_to_dtable_task(username, repo_id, dtable_name, dtable_uuid, file_type, lang)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -816,6 +956,8 @@ def add_import_excel_to_table_task():
 
     try:
         task_id = task_manager.add_import_excel_csv_to_table_task(username, file_name, dtable_uuid, file_type, lang)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -846,6 +988,8 @@ def add_update_table_via_excel_csv_task():
     try:
         task_id = task_manager.add_update_table_via_excel_csv_task(
             username, file_name, dtable_uuid, table_name, selected_columns, file_type)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -875,6 +1019,8 @@ def add_append_excel_csv_to_table_task():
     try:
         task_id = task_manager.add_append_excel_csv_to_table_task(
             username, file_name, dtable_uuid, table_name, file_type)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -902,6 +1048,8 @@ def import_table_from_base():
 
     try:
         task_id = task_manager.add_import_table_from_base_task(context)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -927,6 +1075,8 @@ def import_common_dataset():
 
     try:
         task_id = task_manager.add_import_common_dataset_task(context)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -954,6 +1104,8 @@ def sync_common_data():
         task_id, error_type = task_manager.add_sync_common_dataset_task(context)
         if error_type == 'syncing':
             return make_response({'error_msg': 'Dataset is syncing'}, 429)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -981,6 +1133,8 @@ def force_sync_common_data():
         task_id, error_type = task_manager.add_force_sync_common_dataset_task(context)
         if error_type == 'syncing':
             return make_response({'error_msg': 'Dataset is force syncing'}, 429)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -994,10 +1148,10 @@ def convert_view_to_excel():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.long_tasks_queue.full():
         from dtable_events.dtable_io import dtable_io_logger
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.long_tasks_queue.qsize(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -1016,9 +1170,15 @@ def convert_view_to_excel():
     name = context.get('name')
     repo_id = context.get('repo_id')
     is_support_image = to_python_boolean(context.get('is_support_image', 'false'))
+    file_type = context.get('file_type', 'xlsx')
+    if not is_export_file_type_supported(file_type):
+        return make_response(('file_type invalid.', 400))
 
     try:
-        task_id = task_manager.add_convert_view_to_execl_task(dtable_uuid, table_id, view_id, username, id_in_org, user_department_ids_map, permission, name, repo_id, is_support_image)
+        task_id = task_manager.add_convert_view_to_execl_task(dtable_uuid, table_id, view_id, username, id_in_org, user_department_ids_map, permission, name, repo_id, is_support_image,
+                                                              file_type)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -1032,10 +1192,10 @@ def convert_table_to_excel():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.long_tasks_queue.full():
         from dtable_events.dtable_io import dtable_io_logger
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.long_tasks_queue.qsize(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -1046,9 +1206,14 @@ def convert_table_to_excel():
     name = request.args.get('name')
     repo_id = request.args.get('repo_id')
     is_support_image = to_python_boolean(request.args.get('is_support_image', 'false'))
+    file_type = request.args.get('file_type', 'xlsx')
+    if not is_export_file_type_supported(file_type):
+        return make_response(('file_type invalid.', 400))
 
     try:
-        task_id = task_manager.add_convert_table_to_execl_task(dtable_uuid, table_id, username, permission, name, repo_id, is_support_image)
+        task_id = task_manager.add_convert_table_to_execl_task(dtable_uuid, table_id, username, permission, name, repo_id, is_support_image, file_type)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -1078,6 +1243,8 @@ def add_app_users_sync_task():
 
     try:
         task_id = task_manager.add_app_users_sync_task(dtable_uuid, app_name, app_id, table_name, table_id, username)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -1099,6 +1266,8 @@ def sync_email():
 
     try:
         task_id = data_sync_task_manager.add_sync_email_task(context)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -1127,9 +1296,18 @@ def convert_big_data_view_to_excel():
     name = data.get('name')
     repo_id = data.get('repo_id')
     is_support_image = to_python_boolean(data.get('is_support_image', 'false'))
+    excel_writer = data.get('excel_writer', 'openpyxl')
+    if excel_writer not in ('openpyxl', 'stream'):
+        return make_response(('excel_writer invalid.', 400))
+    file_type = data.get('file_type', 'xlsx')
+    if not is_export_file_type_supported(file_type):
+        return make_response(('file_type invalid.', 400))
 
     try:
-        task_id = big_data_task_manager.add_convert_big_data_view_to_execl_task(dtable_uuid, table_id, view_id, username, name, repo_id, is_support_image)
+        task_id = big_data_task_manager.add_convert_big_data_view_to_execl_task(dtable_uuid, table_id, view_id, username, name, repo_id,
+                                                                                is_support_image, excel_writer, file_type)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -1159,6 +1337,8 @@ def add_import_big_excel_task():
     try:
         task_id = big_data_task_manager.add_import_big_excel_task(
             username, dtable_uuid, table_name, file_path)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -1189,6 +1369,8 @@ def add_update_big_excel_task():
     try:
         task_id = big_data_task_manager.add_update_big_excel_task(
             username, dtable_uuid, table_name, file_path, ref_columns, is_insert_new_data)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -1201,10 +1383,10 @@ def add_export_page_design_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.long_tasks_queue.full():
         from dtable_events.dtable_io import dtable_io_logger
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.long_tasks_queue.qsize(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -1216,6 +1398,8 @@ def add_export_page_design_task():
     try:
         task_id = task_manager.add_export_page_design_task(
             repo_id, dtable_uuid, page_id, username)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -1246,6 +1430,8 @@ def add_import_page_design_task():
     try:
         task_id = task_manager.add_import_page_design_task(
             repo_id, workspace_id, dtable_uuid, page_id, is_dir, username)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -1308,6 +1494,8 @@ def add_email_to_table():
 
     try:
         task_id = plugin_email_task_manager.add_send_email_task(context)
+    except queue.Full:
+        return make_response(('dtable io server busy.', 400))
     except Exception as e:
         logger.error(e)
         return make_response((e, 500))
@@ -1333,3 +1521,12 @@ def query_plugin_email_send_status():
 
     resp = dict(is_finished=is_finished)
     return make_response((resp, 200))
+
+
+@app.route('/task-scheduler-metrics', methods=['GET'])
+def query_task_scheduler_metrics():
+    is_valid, error = check_auth_token(request)
+    if not is_valid:
+        return make_response((error, 403))
+
+    return make_response((task_scheduler.get_metrics(), 200))
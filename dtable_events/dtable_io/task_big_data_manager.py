@@ -1,19 +1,20 @@
 import time
 import uuid
-import queue
-import threading
+
+from dtable_events.dtable_io.task_broker import task_broker
+from dtable_events.dtable_io.task_result_store import TaskResultStore
+from dtable_events.dtable_io.task_scheduler import task_scheduler
+
 
 class BigDataTaskManager(object):
 
     def __init__(self):
         self.tasks_map = {}
-        self.tasks_status_map = {}
-        self.tasks_queue = queue.Queue(10)
+        self.tasks_status_map = TaskResultStore('big_data')
+        self.tasks_queue = task_scheduler.get_queue('big_data')
         self.conf = None
         self.config = None
         self.current_task_info = None
-        self.t = None
-        self.threads = []
         self.conf = {}
 
     def init(self, workers, file_server_port, io_task_timeout, config):
@@ -22,9 +23,10 @@ class BigDataTaskManager(object):
         self.conf['workers'] = workers
 
         self.config = config
+        self.tasks_status_map.init(config)
 
     def is_valid_task_id(self, task_id):
-        return task_id in self.tasks_map.keys()
+        return task_id in self.tasks_map or task_id in self.tasks_status_map or task_broker.has_task(task_id)
 
     def query_status(self, task_id):
         task_status_result = self.tasks_status_map.get(task_id, {})
@@ -36,52 +38,42 @@ class BigDataTaskManager(object):
         return False, task_status_result
 
     def threads_is_alive(self):
-        info = {}
-        for t in self.threads:
-            info[t.name] = t.is_alive()
-        return info
+        return task_scheduler.threads_is_alive()
 
-    def handle_task(self):
+    def handle_task(self, task_id):
         from dtable_events.dtable_io import dtable_io_logger
 
-        while True:
-            try:
-                task_id = self.tasks_queue.get(timeout=2)
-            except queue.Empty:
-                continue
-            except Exception as e:
-                dtable_io_logger.error(e)
-                continue
-
-            try:
-                task = self.tasks_map[task_id]
-                if type(task[0]).__name__ != 'function':
-                    continue
-
-                self.current_task_info = task_id + ' ' + str(task[0])
-                dtable_io_logger.info('Run task: %s' % self.current_task_info)
-                start_time = time.time()
-
-                # run
-                task[0](*task[1])
-                self.tasks_map[task_id] = 'success'
-
-                finish_time = time.time()
-                dtable_io_logger.info(
-                    'Run task success: %s cost %ds \n' % (self.current_task_info, int(finish_time - start_time)))
-                self.current_task_info = None
-            except Exception as e:
-                dtable_io_logger.error('Failed to handle task %s, error: %s \n' % (task_id, e))
-                self.tasks_map.pop(task_id, None)
-                self.current_task_info = None
+        try:
+            task = self.tasks_map[task_id]
+            if type(task[0]).__name__ != 'function':
+                return
+
+            self.current_task_info = task_id + ' ' + str(task[0])
+            dtable_io_logger.info('Run task: %s' % self.current_task_info)
+            start_time = time.time()
+
+            # run
+            task[0](*task[1])
+            self.tasks_status_map.save(task_id)
+            self.tasks_map.pop(task_id, None)
+
+            finish_time = time.time()
+            dtable_io_logger.info(
+                'Run task success: %s cost %ds \n' % (self.current_task_info, int(finish_time - start_time)))
+            self.current_task_info = None
+        except Exception as e:
+            dtable_io_logger.error('Failed to handle task %s, error: %s \n' % (task_id, e))
+            self.tasks_map.pop(task_id, None)
+            self.tasks_status_map.pop(task_id, None)
+            self.current_task_info = None
 
     def add_import_big_excel_task(self, username, dtable_uuid, table_name, file_path):
         from dtable_events.dtable_io import import_big_excel
         task_id = str(uuid.uuid4())
         task = (import_big_excel,
                 (username, dtable_uuid, table_name, file_path, task_id, self.tasks_status_map))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
 
     def add_update_big_excel_task(self, username, dtable_uuid, table_name, file_path, ref_columns, is_insert_new_data=False):
@@ -89,28 +81,26 @@ class BigDataTaskManager(object):
         task_id = str(uuid.uuid4())
         task = (update_big_excel,
                 (username, dtable_uuid, table_name, file_path, ref_columns, is_insert_new_data, task_id, self.tasks_status_map))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
 
-    def add_convert_big_data_view_to_execl_task(self, dtable_uuid, table_id, view_id, username, name, repo_id, is_support_image):
+    def add_convert_big_data_view_to_execl_task(self, dtable_uuid, table_id, view_id, username, name, repo_id, is_support_image,
+                                                excel_writer='openpyxl', file_type='xlsx'):
         from dtable_events.dtable_io import convert_big_data_view_to_execl
 
         task_id = str(uuid.uuid4())
         task = (convert_big_data_view_to_execl,
-                (dtable_uuid, table_id, view_id, username, name, task_id, self.tasks_status_map, repo_id, is_support_image))
-        self.tasks_queue.put(task_id)
+                (dtable_uuid, table_id, view_id, username, name, task_id, self.tasks_status_map, repo_id, is_support_image,
+                 excel_writer, file_type))
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
 
         return task_id
 
     def run(self):
-        thread_num = self.conf['workers']
-        for i in range(thread_num):
-            t_name = 'BigDataTaskManager Thread-' + str(i)
-            t = threading.Thread(target=self.handle_task, name=t_name)
-            self.threads.append(t)
-            t.setDaemon(True)
-            t.start()
+        task_scheduler.register('big_data', self.handle_task, self.conf['workers'],
+                                tasks_map=self.tasks_map, local_args={'tasks_status_map': self.tasks_status_map})
+
 
 big_data_task_manager = BigDataTaskManager()
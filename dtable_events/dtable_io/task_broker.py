@@ -0,0 +1,271 @@
+import importlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'dtable_io:'
+LEASES_KEY = KEY_PREFIX + 'leases'
+NODES_KEY = KEY_PREFIX + 'nodes'
+
+# lease a task moved into the processing list of this node, unless another node
+# took this node as dead and queued the task again
+CLAIM_TASK_SCRIPT = """
+if redis.call('lrem', KEYS[1], 1, ARGV[1]) == 1 then
+    redis.call('zadd', KEYS[2], ARGV[2], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class TaskBroker(object):
+    """ Redis backed dtable io task queue shared by all dtable-events nodes
+
+    Tasks are stored as json under `dtable_io:task:<task_id>` and queued by id in
+    one list per task class. A node moves a task id into its own processing list
+    only when it has a free worker for that class, then holds a lease (score in the
+    `dtable_io:leases` zset) which is extended by its heartbeat while the task runs.
+    Tasks whose lease expires, e.g. because the node died, are queued again up to
+    `task_max_retries` times. Tasks left in the processing list of a node which
+    stopped its heartbeat (score in the `dtable_io:nodes` zset) are queued again too.
+
+    Task function arguments must be json serializable, except the `local_args`
+    registered for a task class (like config), which are replaced on every node.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.connection = None
+        self.node_id = '%s-%s-%s' % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.lease_ttl = 120
+        self.task_ttl = 24 * 3600
+        self.max_retries = 3
+        self.running = {}  # task_id -> class_name, tasks leased by this node
+        self.class_names = set()  # classes fetched by this node, so by other nodes too
+        self.node_touched_at = 0
+        self.cancel_handlers = {}  # class_name -> cancel_handler(task_id)
+        self.lock = threading.Lock()
+
+    def init(self, config, connection=None):
+        section = 'DTABLE-IO'
+        if not config.has_option(section, 'task_queue_backend') or \
+                config.get(section, 'task_queue_backend').strip().lower() != 'redis':
+            return
+        if config.has_option(section, 'task_lease_ttl'):
+            self.lease_ttl = config.getint(section, 'task_lease_ttl')
+        if config.has_option(section, 'task_max_retries'):
+            self.max_retries = config.getint(section, 'task_max_retries')
+        if connection is None:
+            from dtable_events.app.event_redis import RedisClient
+            connection = RedisClient(config, socket_timeout=30).connection
+        self.connection = connection
+        self.claim_task_script = connection.register_script(CLAIM_TASK_SCRIPT)
+        self.release_lock_script = connection.register_script(RELEASE_LOCK_SCRIPT)
+        self.enabled = True
+
+    def _queue_key(self, class_name):
+        return '%squeue:%s' % (KEY_PREFIX, class_name)
+
+    def _processing_key(self, class_name, node_id=None):
+        return '%sprocessing:%s:%s' % (KEY_PREFIX, node_id or self.node_id, class_name)
+
+    def _task_key(self, task_id):
+        return '%stask:%s' % (KEY_PREFIX, task_id)
+
+    def _cancel_key(self, task_id):
+        return '%scancel:%s' % (KEY_PREFIX, task_id)
+
+    def _lock_key(self, name):
+        return '%slock:%s' % (KEY_PREFIX, name)
+
+    def encode_task(self, task, local_args=None):
+        func, args = task
+        local_ids = {id(value): name for name, value in (local_args or {}).items()}
+        encoded_args = []
+        for arg in args:
+            if id(arg) in local_ids:
+                encoded_args.append({'__local_arg__': local_ids[id(arg)]})
+            else:
+                encoded_args.append(arg)
+        return {'func': '%s:%s' % (func.__module__, func.__name__), 'args': encoded_args}
+
+    def decode_task(self, payload, local_args=None):
+        module_name, func_name = payload['func'].split(':')
+        if not module_name.startswith('dtable_events.'):
+            raise ValueError('invalid task function %s' % payload['func'])
+        func = getattr(importlib.import_module(module_name), func_name)
+        args = []
+        for arg in payload['args']:
+            if isinstance(arg, dict) and list(arg.keys()) == ['__local_arg__']:
+                arg = (local_args or {})[arg['__local_arg__']]
+            args.append(arg)
+        return func, tuple(args)
+
+    def submit(self, class_name, task_id, task, owner=None, local_args=None):
+        payload = self.encode_task(task, local_args)
+        payload.update({'class_name': class_name, 'owner': owner, 'retries': 0})
+        pipe = self.connection.pipeline()
+        pipe.set(self._task_key(task_id), json.dumps(payload), ex=self.task_ttl)
+        pipe.lpush(self._queue_key(class_name), task_id)
+        pipe.execute()
+
+    def qsize(self, class_name):
+        return self.connection.llen(self._queue_key(class_name))
+
+    def has_task(self, task_id):
+        if not self.enabled:
+            return False
+        return bool(self.connection.exists(self._task_key(task_id)))
+
+    def fetch(self, class_name, timeout=2):
+        """ pop a task of the class and lease it to this node
+
+        The task id is moved into the processing list of this node atomically, so it
+        is queued again if this node dies before leasing it.
+
+        :return: (task_id, payload) or None
+        """
+        self.class_names.add(class_name)
+        self.touch_node()
+        processing_key = self._processing_key(class_name)
+        task_id = self.connection.brpoplpush(self._queue_key(class_name), processing_key, timeout=timeout)
+        if not task_id:
+            return None
+        with self.lock:
+            self.running[task_id] = class_name
+        deadline = time.time() + self.lease_ttl
+        if not self.claim_task_script(keys=[processing_key, LEASES_KEY], args=[task_id, deadline]):
+            with self.lock:
+                self.running.pop(task_id, None)
+            logger.warning('task %s was queued again by another node, skip it', task_id)
+            return None
+        payload = self.connection.get(self._task_key(task_id))
+        if not payload:
+            # cancelled while queued
+            self.finish(task_id)
+            return None
+        return task_id, json.loads(payload)
+
+    def finish(self, task_id):
+        with self.lock:
+            self.running.pop(task_id, None)
+        pipe = self.connection.pipeline()
+        pipe.zrem(LEASES_KEY, task_id)
+        pipe.delete(self._task_key(task_id), self._cancel_key(task_id))
+        pipe.execute()
+
+    def cancel(self, task_id):
+        payload = self.connection.get(self._task_key(task_id))
+        if not payload:
+            return
+        class_name = json.loads(payload)['class_name']
+        if self.connection.lrem(self._queue_key(class_name), 0, task_id):
+            self.connection.delete(self._task_key(task_id))
+        else:
+            # running, let the node which leased it cancel it
+            self.connection.set(self._cancel_key(task_id), 1, ex=self.lease_ttl * 2)
+
+    def touch_node(self, force=False):
+        now = time.time()
+        if not force and now - self.node_touched_at < max(self.lease_ttl // 3, 1):
+            return
+        self.connection.zadd(NODES_KEY, {self.node_id: now + self.lease_ttl})
+        self.node_touched_at = now
+
+    def heartbeat(self):
+        self.touch_node(force=True)
+        with self.lock:
+            running = dict(self.running)
+        if not running:
+            return
+        deadline = time.time() + self.lease_ttl
+        self.connection.zadd(LEASES_KEY, {task_id: deadline for task_id in running}, xx=True)
+        for task_id, class_name in running.items():
+            if self.connection.exists(self._cancel_key(task_id)) and class_name in self.cancel_handlers:
+                self.cancel_handlers[class_name](task_id)
+
+    def requeue_expired(self):
+        for task_id in self.connection.zrangebyscore(LEASES_KEY, 0, time.time()):
+            # only the node removing the lease requeues the task
+            if not self.connection.zrem(LEASES_KEY, task_id):
+                continue
+            payload = self.connection.get(self._task_key(task_id))
+            if not payload:
+                continue
+            payload = json.loads(payload)
+            payload['retries'] += 1
+            if payload['retries'] > self.max_retries:
+                logger.error('task %s lease expired %s times, drop it', task_id, payload['retries'])
+                self.connection.delete(self._task_key(task_id))
+                continue
+            logger.warning('task %s lease expired, queue it again', task_id)
+            pipe = self.connection.pipeline()
+            pipe.set(self._task_key(task_id), json.dumps(payload), ex=self.task_ttl)
+            pipe.lpush(self._queue_key(payload['class_name']), task_id)
+            pipe.execute()
+
+    def requeue_dead_nodes(self):
+        """ queue the tasks left in processing lists of nodes without heartbeat again
+        """
+        if not self.class_names:
+            # processing lists are unknown before fetching
+            return
+        for node_id in self.connection.zrangebyscore(NODES_KEY, 0, time.time()):
+            for class_name in self.class_names:
+                while True:
+                    task_id = self.connection.rpoplpush(self._processing_key(class_name, node_id),
+                                                        self._queue_key(class_name))
+                    if not task_id:
+                        break
+                    logger.warning('node %s stopped before leasing task %s, queue it again', node_id, task_id)
+            self.connection.zrem(NODES_KEY, node_id)
+
+    def acquire_lock(self, name, timeout):
+        """ :return: token to release the lock, or None if it is locked
+        """
+        token = '%s:%s' % (self.node_id, uuid.uuid4().hex)
+        if self.connection.set(self._lock_key(name), token, nx=True, ex=timeout):
+            return token
+        return None
+
+    def is_locked(self, name):
+        return bool(self.connection.exists(self._lock_key(name)))
+
+    def release_lock(self, name, token):
+        """ release the lock only if it is still the one of token, it may have expired
+        and been acquired by others
+        """
+        self.release_lock_script(keys=[self._lock_key(name)], args=[token])
+
+    def handle_heartbeat(self):
+        while True:
+            time.sleep(max(self.lease_ttl // 3, 1))
+            try:
+                self.heartbeat()
+                self.requeue_expired()
+                self.requeue_dead_nodes()
+            except Exception as e:
+                logger.error('task broker heartbeat error: %s', e)
+
+    def run(self):
+        if not self.enabled:
+            return
+        t = threading.Thread(target=self.handle_heartbeat, name='TaskBroker Heartbeat Thread')
+        t.setDaemon(True)
+        t.start()
+
+
+task_broker = TaskBroker()
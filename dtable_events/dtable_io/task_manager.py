@@ -1,5 +1,4 @@
 import os
-import queue
 import threading
 import time
 import uuid
@@ -8,16 +7,28 @@ from threading import Lock
 
 from seaserv import seafile_api
 
+from dtable_events.dtable_io.task_broker import task_broker
+from dtable_events.dtable_io.task_process_pool import task_process_pool
+from dtable_events.dtable_io.task_result_store import TaskResultStore
+from dtable_events.dtable_io.task_scheduler import task_scheduler
+from dtable_events.utils.task_context import CancellationToken, TaskCancelledError, run_task
+
 
 class TaskManager(object):
 
     def __init__(self):
         self.tasks_map = {}
-        self.task_results_map = {}
-        self.tasks_queue = queue.Queue(10)
+        self.task_results_map = TaskResultStore('io')
+        self.task_progress_map = {}
+        self.task_tokens = {}
+        # notified when a task finishes or reports progress, for long-poll status queries
+        self.status_cond = threading.Condition()
+        self.status_version = 0
+        # long exports have their own task class, so they can not block short tasks
+        self.tasks_queue = task_scheduler.get_queue('io')
+        self.long_tasks_queue = task_scheduler.get_queue('io_long')
         self.config = None
         self.current_task_info = {}
-        self.threads = []
 
         self.dataset_sync_ids = set()
         self.dataset_sync_ids_lock = Lock()
@@ -31,11 +42,22 @@ class TaskManager(object):
         self.conf['file_server_port'] = file_server_port
         self.conf['io_task_timeout'] = io_task_timeout
         self.conf['workers'] = workers
+        # concurrent downloads and retries per file of asset export tasks, concurrent uploads of import tasks,
+        # concurrent image downloads of excel export tasks
+        self.conf['asset_download_workers'] = 8
+        self.conf['asset_download_retries'] = 3
+        self.conf['asset_upload_workers'] = 8
+        self.conf['image_download_workers'] = 8
+        for key in ('asset_download_workers', 'asset_download_retries', 'asset_upload_workers', 'image_download_workers'):
+            if config.has_option('DTABLE-IO', key):
+                self.conf[key] = config.getint('DTABLE-IO', key)
 
         self.config = config
+        self.task_results_map.init(config)
+        task_process_pool.init(config, progress_handler=self.set_task_progress, task_conf=self.conf)
 
     def is_valid_task_id(self, task_id):
-        return task_id in (self.tasks_map.keys() | self.task_results_map.keys())
+        return task_id in self.tasks_map or task_id in self.task_results_map or task_broker.has_task(task_id)
 
     def add_export_task(self, username, repo_id, workspace_id, dtable_uuid, dtable_name, ignore_asset):
         from dtable_events.dtable_io import get_dtable_export_content
@@ -48,8 +70,8 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (get_dtable_export_content,
                 (username, repo_id, workspace_id, dtable_uuid, asset_dir_id, self.config))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.long_tasks_queue.put(task_id, owner=dtable_uuid)
 
         return task_id
 
@@ -61,8 +83,8 @@ class TaskManager(object):
         task = (post_dtable_import_files,
                 (username, repo_id, workspace_id, dtable_uuid, dtable_file_name, in_storage,
                  can_use_automation_rules, can_use_workflows, can_use_external_apps, owner, org_id, self.config))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
 
     def add_export_dtable_asset_files_task(self, username, repo_id, dtable_uuid, files, files_map=None):
@@ -71,8 +93,8 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (get_dtable_export_asset_files,
                 (username, repo_id, dtable_uuid, files, task_id, self.config, files_map))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.long_tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
     
     def add_export_dtable_big_data_screen_task(self, username, repo_id, dtable_uuid, page_id):
@@ -80,8 +102,8 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (get_dtable_export_big_data_screen,
                 (username, repo_id, dtable_uuid, page_id, task_id))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.long_tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
     
     def add_import_dtable_big_data_screen_task(self, username, repo_id, dtable_uuid, page_id):
@@ -89,8 +111,8 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (import_big_data_screen,
                 (username, repo_id, dtable_uuid, page_id))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
 
 
@@ -110,8 +132,8 @@ class TaskManager(object):
                  repo_api_token,
                  seafile_server_url,
                  self.config))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.long_tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
 
     def add_parse_excel_csv_task(self, username, repo_id, file_name, file_type, parse_type, dtable_uuid):
@@ -120,8 +142,8 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (parse_excel_csv,
                 (username, repo_id, file_name, file_type, parse_type, dtable_uuid, self.config))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
 
     def add_import_excel_csv_task(self, username, repo_id, dtable_uuid, dtable_name, included_tables, lang):
@@ -130,8 +152,8 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (import_excel_csv,
                 (username, repo_id, dtable_uuid, dtable_name, included_tables, lang, self.config))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
 
     def add_import_excel_csv_add_table_task(self, username, dtable_uuid, dtable_name, included_tables, lang):
@@ -140,8 +162,8 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (import_excel_csv_add_table,
                 (username, dtable_uuid, dtable_name, included_tables, lang, self.config))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
 
     def add_append_excel_csv_append_parsed_file_task(self, username, dtable_uuid, file_name, table_name):
@@ -150,8 +172,8 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (append_excel_csv_append_parsed_file,
                 (username, dtable_uuid, file_name, table_name))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
 
     def add_append_excel_csv_upload_file_task(self, username, file_name, dtable_uuid, table_name, file_type):
@@ -160,8 +182,8 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (append_excel_csv_upload_file,
                 (username, file_name, dtable_uuid, table_name, file_type))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
 
     def add_run_auto_rule_task(self, automation_rule_id, username, org_id, dtable_uuid, run_condition, trigger, actions):
@@ -176,8 +198,8 @@ class TaskManager(object):
         }
 
         task = (run_auto_rule_task, (trigger, actions, options, self.config))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
 
     def add_update_excel_csv_update_parsed_file_task(self, username, dtable_uuid, file_name, table_name,
@@ -187,8 +209,8 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (update_excel_csv_update_parsed_file,
                 (username, dtable_uuid, file_name, table_name, selected_columns))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
 
     def add_update_excel_upload_excel_task(self, username, file_name, dtable_uuid, table_name):
@@ -197,8 +219,8 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (update_excel_upload_excel,
                 (username, file_name, dtable_uuid, table_name))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
 
     def add_update_csv_upload_csv_task(self, username, file_name, dtable_uuid, table_name):
@@ -207,8 +229,8 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (update_csv_upload_csv,
                 (username, file_name, dtable_uuid, table_name))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
 
     def add_import_excel_csv_to_dtable_task(self, username, repo_id, dtable_name, dtable_uuid, file_type, lang):
@@ -216,8 +238,8 @@ class TaskManager(object):
 
         task_id = str(uuid.uuid4())
         task = (import_excel_csv_to_dtable, (username, repo_id, dtable_name, dtable_uuid, file_type, lang))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
 
     def add_import_excel_csv_to_table_task(self, username, file_name, dtable_uuid, file_type, lang):
@@ -225,8 +247,8 @@ class TaskManager(object):
 
         task_id = str(uuid.uuid4())
         task = (import_excel_csv_to_table, (username, file_name, dtable_uuid, file_type, lang))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
 
     def add_update_table_via_excel_csv_task(self, username, file_name, dtable_uuid, table_name, selected_columns, file_type):
@@ -234,8 +256,8 @@ class TaskManager(object):
 
         task_id = str(uuid.uuid4())
         task = (update_table_via_excel_csv, (username, file_name, dtable_uuid, table_name, selected_columns, file_type))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
 
     def add_append_excel_csv_to_table_task(self, username, file_name, dtable_uuid, table_name, file_type):
@@ -243,10 +265,48 @@ class TaskManager(object):
 
         task_id = str(uuid.uuid4())
         task = (append_excel_csv_to_table, (username, file_name, dtable_uuid, table_name, file_type))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
         return task_id
 
+    def notify_status(self):
+        with self.status_cond:
+            self.status_version += 1
+            self.status_cond.notify_all()
+
+    def set_task_progress(self, task_id, progress):
+        if task_id in self.tasks_map:
+            self.task_progress_map[task_id] = progress
+            self.notify_status()
+
+    def wait_for_status(self, task_ids, timeout, last_progresses=None):
+        """ block until any of the tasks finished or its progress is not in `last_progresses`
+        any more, by default the progresses when called
+        """
+        if last_progresses is None:
+            last_progresses = {task_id: self.query_progress(task_id) for task_id in task_ids}
+        deadline = time.time() + timeout
+        while True:
+            # checks may query redis, so they run without holding status_cond
+            version = self.status_version
+            task_ids = [task_id for task_id in task_ids if self.is_valid_task_id(task_id)]
+            if not task_ids:
+                return
+            if any(task_id in self.task_results_map or self.query_progress(task_id) != last_progresses.get(task_id)
+                   for task_id in task_ids):
+                return
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            with self.status_cond:
+                # skip waiting if notified during the checks
+                if version == self.status_version:
+                    # tasks finished on other nodes are not notified, check again every second
+                    self.status_cond.wait(timeout=min(remaining, 1))
+
+    def query_progress(self, task_id):
+        return self.task_progress_map.get(task_id)
+
     def query_status(self, task_id):
         task_result = self.task_results_map.pop(task_id, None)
         if task_result == 'success':
@@ -261,8 +321,8 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (convert_page_to_pdf,
                 (dtable_uuid, page_id, row_id))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
 
         return task_id
 
@@ -271,8 +331,8 @@ class TaskManager(object):
 
         task_id = str(uuid.uuid4())
         task = (import_table_from_base, (context,))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=context.get('dst_dtable_uuid'))
 
         return task_id
 
@@ -281,8 +341,8 @@ class TaskManager(object):
 
         task_id = str(uuid.uuid4())
         task = (import_common_dataset, (context, self.config))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=context.get('dst_dtable_uuid'))
 
         return task_id
 
@@ -293,15 +353,20 @@ class TaskManager(object):
         from dtable_events.dtable_io.import_sync_common_dataset import sync_common_dataset
 
         dataset_sync_id = context.get('dataset_sync_id')
-        with self.dataset_sync_ids_lock:
-            if self.is_syncing(dataset_sync_id):
-                return None, 'syncing'
-            self.add_dataset_sync(dataset_sync_id)
+        lock_token = self.acquire_dataset_sync(dataset_sync_id)
+        if not lock_token:
+            return None, 'syncing'
+        context['lock_token'] = lock_token
 
         task_id = str(uuid.uuid4())
         task = (sync_common_dataset, (context, self.config))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        try:
+            self.tasks_queue.put(task_id, owner=context.get('dst_dtable_uuid'))
+        except Exception:
+            self.tasks_map.pop(task_id, None)
+            self.finish_dataset_sync(dataset_sync_id, lock_token)
+            raise
 
         return task_id, None
 
@@ -312,35 +377,42 @@ class TaskManager(object):
         from dtable_events.dtable_io.import_sync_common_dataset import force_sync_common_dataset
 
         dataset_id = context.get('dataset_id')
-        with self.force_sync_dataset_ids_lock:
-            if self.is_dataset_force_syncing(dataset_id):
-                return None, 'syncing'
-            self.force_sync_dataset_ids.add(dataset_id)
+        lock_token = self.acquire_dataset_force_sync(dataset_id)
+        if not lock_token:
+            return None, 'syncing'
+        context['lock_token'] = lock_token
 
         task_id = str(uuid.uuid4())
         task = (force_sync_common_dataset, (context, self.config))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        try:
+            self.tasks_queue.put(task_id, owner=dataset_id)
+        except Exception:
+            self.tasks_map.pop(task_id, None)
+            self.finish_dataset_force_sync(dataset_id, lock_token)
+            raise
 
         return task_id, None
 
-    def add_convert_view_to_execl_task(self, dtable_uuid, table_id, view_id, username, id_in_org, user_department_ids_map, permission, name, repo_id, is_support_image):
+    def add_convert_view_to_execl_task(self, dtable_uuid, table_id, view_id, username, id_in_org, user_department_ids_map, permission, name, repo_id, is_support_image,
+                                       file_type='xlsx'):
         from dtable_events.dtable_io import convert_view_to_execl
 
         task_id = str(uuid.uuid4())
-        task = (convert_view_to_execl, (dtable_uuid, table_id, view_id, username, id_in_org, user_department_ids_map, permission, name, repo_id, is_support_image))
-        self.tasks_queue.put(task_id)
+        task = (convert_view_to_execl, (dtable_uuid, table_id, view_id, username, id_in_org, user_department_ids_map, permission, name, repo_id, is_support_image,
+                                        file_type))
         self.tasks_map[task_id] = task
+        self.long_tasks_queue.put(task_id, owner=dtable_uuid)
 
         return task_id
 
-    def add_convert_table_to_execl_task(self, dtable_uuid, table_id, username, permission, name, repo_id, is_support_image):
+    def add_convert_table_to_execl_task(self, dtable_uuid, table_id, username, permission, name, repo_id, is_support_image, file_type='xlsx'):
         from dtable_events.dtable_io import convert_table_to_execl
 
         task_id = str(uuid.uuid4())
-        task = (convert_table_to_execl, (dtable_uuid, table_id, username, permission, name, repo_id, is_support_image))
-        self.tasks_queue.put(task_id)
+        task = (convert_table_to_execl, (dtable_uuid, table_id, username, permission, name, repo_id, is_support_image, file_type))
         self.tasks_map[task_id] = task
+        self.long_tasks_queue.put(task_id, owner=dtable_uuid)
 
         return task_id
 
@@ -348,8 +420,8 @@ class TaskManager(object):
         from dtable_events.dtable_io import app_user_sync
         task_id = str(uuid.uuid4())
         task = (app_user_sync, (dtable_uuid, app_name, app_id, table_name, table_id, username, self.config))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
 
         return task_id
 
@@ -357,8 +429,8 @@ class TaskManager(object):
         from dtable_events.dtable_io import export_page_design
         task_id = str(uuid.uuid4())
         task = (export_page_design, (repo_id, dtable_uuid, page_id, username))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.long_tasks_queue.put(task_id, owner=dtable_uuid)
 
         return task_id
     
@@ -366,91 +438,160 @@ class TaskManager(object):
         from dtable_events.dtable_io import import_page_design
         task_id = str(uuid.uuid4())
         task = (import_page_design, (repo_id, workspace_id, dtable_uuid, page_id, is_dir, username))
-        self.tasks_queue.put(task_id)
         self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id, owner=dtable_uuid)
 
         return task_id
 
     def threads_is_alive(self):
-        info = {}
-        for t in self.threads:
-            info[t.name] = t.is_alive()
-        return info
+        return task_scheduler.threads_is_alive()
 
-    def handle_task(self):
+    def run_task_with_deadline(self, task_id, func, args, on_abandoned=None):
+        """ run task in its own thread, so that the task can be reported stopped when it is
+        cancelled or exceeds io_task_timeout even if it never checks its token
+
+        :param on_abandoned: called with the TaskCancelledError when the task does not stop in
+            time, the worker still waits for the thread to exit before returning
+        """
         from dtable_events.dtable_io import dtable_io_logger
 
-        while True:
+        token = CancellationToken(timeout=self.conf['io_task_timeout'])
+        self.task_tokens[task_id] = token
+        result = {}
+
+        def target():
             try:
-                task_id = self.tasks_queue.get(timeout=2)
-            except queue.Empty:
-                continue
+                run_task(task_id, func, args, token=token)
             except Exception as e:
-                dtable_io_logger.error(e)
-                continue
-
-            task = self.tasks_map.get(task_id)
-            if type(task) != tuple or len(task) < 1:
-                continue
-            if type(task[0]).__name__ != 'function':
-                continue
-            task_info = task_id + ' ' + str(task[0])
-            try:
-                self.current_task_info[task_id] = task_info
-                dtable_io_logger.info('Run task: %s' % task_info)
-                start_time = time.time()
-
-                # run
-                task[0](*task[1])
-                self.task_results_map[task_id] = 'success'
+                result['error'] = e
+
+        t = threading.Thread(target=target, name='Task-' + task_id)
+        t.setDaemon(True)
+        t.start()
+        while t.is_alive() and not token.is_cancelled:
+            t.join(timeout=1)
+        if t.is_alive():
+            # give the task a chance to stop at its next check
+            t.join(timeout=5)
+        if t.is_alive():
+            # report it stopped now, but keep the worker, tmp paths and dataset sync lock
+            # until the thread really exits, so stuck threads can not pile up
+            error = TaskCancelledError(token.reason)
+            if on_abandoned:
+                on_abandoned(error)
+            while t.is_alive():
+                dtable_io_logger.warning('Task %s %s, still waiting for it to exit' % (task_id, token.reason))
+                t.join(timeout=60)
+            token.clear_tmp_paths()
+            raise error
+        if 'error' in result:
+            raise result['error']
+
+    def handle_task(self, task_id):
+        from dtable_events.dtable_io import dtable_io_logger
 
-                finish_time = time.time()
-                dtable_io_logger.info('Run task success: %s cost %ds \n' % (task_info, int(finish_time - start_time)))
-                self.current_task_info.pop(task_id, None)
-            except Exception as e:
+        task = self.tasks_map.get(task_id)
+        if type(task) != tuple or len(task) < 1:
+            return
+        if type(task[0]).__name__ != 'function':
+            return
+        task_info = task_id + ' ' + str(task[0])
+        stopped_errors = []
+
+        def report_stopped(e):
+            stopped_errors.append(e)
+            self.task_results_map[task_id] = 'error_' + str(e.args[0])
+            self.notify_status()
+
+        try:
+            self.current_task_info[task_id] = task_info
+            dtable_io_logger.info('Run task: %s' % task_info)
+            start_time = time.time()
+
+            # run, CPU-bound tasks in process pool if enabled
+            if task_process_pool.is_process_task(task[0]):
+                token = CancellationToken()
+                self.task_tokens[task_id] = token
+                task_process_pool.run_task(task_id, task[0], task[1], timeout=self.conf['io_task_timeout'], token=token)
+            else:
+                self.run_task_with_deadline(task_id, task[0], task[1], on_abandoned=report_stopped)
+            self.task_results_map[task_id] = 'success'
+
+            finish_time = time.time()
+            dtable_io_logger.info('Run task success: %s cost %ds \n' % (task_info, int(finish_time - start_time)))
+            self.current_task_info.pop(task_id, None)
+        except Exception as e:
+            # the result of an abandoned task has been reported already, and may have been queried
+            if not stopped_errors:
                 self.task_results_map[task_id] = 'error_' + str(e.args[0])
-                if str(e.args[0]) in ('the number of cells accessing the table exceeds the limit',
-                                      'Excel format error', 'Duplicated column names are not supported',
-                                      'Number of cells returned exceeds the limit of 1 million'):
-                    dtable_io_logger.warning('Failed to handle task %s, error: %s \n' % (task_info, e))
-                elif str(e.args[0]).startswith('import_sync_common_dataset:'):
-                    # Errors in import/sync common dataset, those have been record in real task code, so no duplicated error logs here
-                    # Including source/destination table not found...
-                    dtable_io_logger.warning('Failed to handle task %s error: %s \n' % (task_info, e))
-                elif str(e.args[0]).startswith('import_table_from_base:'):
-                    # Errors in import-table-from-base, those have been record in real task code, so no duplicated error logs here
-                    dtable_io_logger.warning('Failed to handle task %s error: %s \n' % (task_info, e))
-                else:
-                    dtable_io_logger.exception(e)
-                    dtable_io_logger.error('Failed to handle task %s, error: %s \n' % (task_info, e))
-                self.current_task_info.pop(task_id, None)
-            finally:
-                self.tasks_map.pop(task_id, None)
-                if getattr(task[0], '__name__', None) == 'sync_common_dataset':
-                    context = task[1][0]
-                    self.finish_dataset_sync(context.get('dataset_sync_id'))
-                if getattr(task[0], '__name__', None) == 'force_sync_common_dataset':
-                    context = task[1][0]
-                    self.finish_dataset_force_sync(context.get('dataset_id'))
+            if isinstance(e, TaskCancelledError):
+                dtable_io_logger.warning('Task %s stopped: %s \n' % (task_info, e))
+            elif str(e.args[0]) in ('the number of cells accessing the table exceeds the limit',
+                                  'Excel format error', 'Duplicated column names are not supported',
+                                  'Number of cells returned exceeds the limit of 1 million'):
+                dtable_io_logger.warning('Failed to handle task %s, error: %s \n' % (task_info, e))
+            elif str(e.args[0]).startswith('import_sync_common_dataset:'):
+                # Errors in import/sync common dataset, those have been record in real task code, so no duplicated error logs here
+                # Including source/destination table not found...
+                dtable_io_logger.warning('Failed to handle task %s error: %s \n' % (task_info, e))
+            elif str(e.args[0]).startswith('import_table_from_base:'):
+                # Errors in import-table-from-base, those have been record in real task code, so no duplicated error logs here
+                dtable_io_logger.warning('Failed to handle task %s error: %s \n' % (task_info, e))
+            else:
+                dtable_io_logger.exception(e)
+                dtable_io_logger.error('Failed to handle task %s, error: %s \n' % (task_info, e))
+            self.current_task_info.pop(task_id, None)
+        finally:
+            self.tasks_map.pop(task_id, None)
+            self.task_progress_map.pop(task_id, None)
+            self.task_tokens.pop(task_id, None)
+            self.notify_status()
+            if getattr(task[0], '__name__', None) == 'sync_common_dataset':
+                context = task[1][0]
+                self.finish_dataset_sync(context.get('dataset_sync_id'), context.get('lock_token'))
+            if getattr(task[0], '__name__', None) == 'force_sync_common_dataset':
+                context = task[1][0]
+                self.finish_dataset_force_sync(context.get('dataset_id'), context.get('lock_token'))
 
     def run(self):
-        thread_num = self.conf['workers']
-        for i in range(thread_num):
-            t_name = 'TaskManager Thread-' + str(i)
-            t = threading.Thread(target=self.handle_task, name=t_name)
-            self.threads.append(t)
-            t.setDaemon(True)
-            t.start()
+        local_args = {'config': self.config}
+        task_scheduler.register('io', self.handle_task, self.conf['workers'], tasks_map=self.tasks_map,
+                                local_args=local_args, cancel_handler=self.stop_task)
+        task_scheduler.register('io_long', self.handle_task, self.conf['workers'], tasks_map=self.tasks_map,
+                                local_args=local_args, cancel_handler=self.stop_task)
+        task_process_pool.run()
+
+    def stop_task(self, task_id):
+        self.tasks_map.pop(task_id, None)
+        token = self.task_tokens.get(task_id)
+        if token:
+            token.cancel()
 
     def cancel_task(self, task_id):
-        self.tasks_map.pop(task_id, None)
+        self.stop_task(task_id)
+        if task_broker.enabled:
+            task_broker.cancel(task_id)
 
     def is_syncing(self, db_sync_id):
         return db_sync_id in self.dataset_sync_ids
 
-    def finish_dataset_sync(self, db_sync_id):
+    def acquire_dataset_sync(self, db_sync_id):
+        """ return False if the dataset sync is running, on any node with task broker,
+        otherwise the token to finish it
+        """
+        with self.dataset_sync_ids_lock:
+            if self.is_syncing(db_sync_id):
+                return False
+            if task_broker.enabled:
+                return task_broker.acquire_lock('dataset_sync:%s' % db_sync_id, self.conf['io_task_timeout']) or False
+            self.add_dataset_sync(db_sync_id)
+            return True
+
+    def finish_dataset_sync(self, db_sync_id, lock_token=None):
         with self.dataset_sync_ids_lock:
             self.dataset_sync_ids -= {db_sync_id}
+        if task_broker.enabled and isinstance(lock_token, str):
+            task_broker.release_lock('dataset_sync:%s' % db_sync_id, lock_token)
 
     def add_dataset_sync(self, db_sync_id):
         self.dataset_sync_ids.add(db_sync_id)
@@ -458,9 +599,20 @@ class TaskManager(object):
     def is_dataset_force_syncing(self, dataset_id):
         return dataset_id in self.force_sync_dataset_ids
 
-    def finish_dataset_force_sync(self, dataset_id):
+    def acquire_dataset_force_sync(self, dataset_id):
+        with self.force_sync_dataset_ids_lock:
+            if self.is_dataset_force_syncing(dataset_id):
+                return False
+            if task_broker.enabled:
+                return task_broker.acquire_lock('dataset_force_sync:%s' % dataset_id, self.conf['io_task_timeout']) or False
+            self.force_sync_dataset_ids.add(dataset_id)
+            return True
+
+    def finish_dataset_force_sync(self, dataset_id, lock_token=None):
         with self.force_sync_dataset_ids_lock:
             self.force_sync_dataset_ids -= {dataset_id}
+        if task_broker.enabled and isinstance(lock_token, str):
+            task_broker.release_lock('dataset_force_sync:%s' % dataset_id, lock_token)
 
 
 task_manager = TaskManager()
@@ -0,0 +1,203 @@
+import logging
+import multiprocessing
+import queue
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from dtable_events.utils.task_context import CancellationToken, TaskCancelledError, run_task, \
+    set_progress_handler, set_progress_queue
+
+logger = logging.getLogger(__name__)
+
+# seconds between checks for cancellation of a task running in a worker
+CANCEL_CHECK_INTERVAL = 1
+
+# CPU-bound task functions run in worker processes if the process pool is enabled
+DEFAULT_PROCESS_POOL_TASKS = (
+    'get_dtable_export_content',
+    'parse_excel_csv',
+    'convert_view_to_execl',
+    'convert_table_to_execl',
+    'import_common_dataset',
+    'sync_common_dataset',
+)
+
+
+_cancelled_tasks = None  # task_id -> reason, shared with the dtable-events process
+_current_token = None
+
+
+def _init_worker(progress_queue, task_conf, cancelled_tasks):
+    # worker processes are spawned, task manager conf like file_server_port has to be passed
+    global _cancelled_tasks
+    from dtable_events.dtable_io.task_manager import task_manager
+    task_manager.conf.update(task_conf)
+    set_progress_queue(progress_queue)
+    _cancelled_tasks = cancelled_tasks
+
+
+def _raise_timeout(signum, frame):
+    reason = _current_token.reason if _current_token is not None else None
+    raise TaskCancelledError(reason or 'Task timeout')
+
+
+def _watch_cancel(task_id, token, stopped):
+    # cancel the task in the main thread by firing SIGALRM right away
+    while not stopped.wait(timeout=CANCEL_CHECK_INTERVAL):
+        try:
+            reason = _cancelled_tasks.get(task_id)
+        except Exception as e:
+            logger.warning('check task %s cancelled error: %s', task_id, e)
+            continue
+        if reason:
+            token.cancel(reason)
+            signal.setitimer(signal.ITIMER_REAL, 0.001)
+            return
+
+
+def _run_task_in_worker(task_id, func, args, timeout):
+    # tasks run in the main thread of worker processes, so the deadline and cancellation
+    # can be enforced by SIGALRM
+    global _current_token
+    token = CancellationToken(timeout=timeout)
+    _current_token = token
+    signal.signal(signal.SIGALRM, _raise_timeout)
+    if timeout:
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    stopped = threading.Event()
+    watcher = None
+    if _cancelled_tasks is not None:
+        watcher = threading.Thread(target=_watch_cancel, args=(task_id, token, stopped), daemon=True)
+        watcher.start()
+    try:
+        return run_task(task_id, func, args, token=token)
+    finally:
+        stopped.set()
+        if watcher:
+            watcher.join()
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        # drop an alarm fired right before the reset, the worker is about to run other tasks
+        signal.signal(signal.SIGALRM, signal.SIG_IGN)
+        _current_token = None
+
+
+class TaskProcessPool(object):
+    """ Run CPU-bound dtable io tasks in worker processes
+
+    Workers are started with `spawn` and import the main module as `__mp_main__`,
+    dtable_events/main.py skips gevent monkey patching then, so tasks and their
+    SIGALRM deadline run without gevent. Workers are replaced after
+    `max_tasks_per_child` tasks to cap memory growth. Tasks cancelled in the
+    dtable-events process are stopped in the worker through a shared dict of
+    cancelled task ids.
+    """
+
+    def __init__(self):
+        self.workers = 0
+        self.max_tasks_per_child = 20
+        self.task_names = set(DEFAULT_PROCESS_POOL_TASKS)
+        self.executor = None
+        self.submitted_count = 0
+        self.progress_queue = None
+        self.manager = None
+        self.cancelled_tasks = None
+        self.progress_handler = None
+        self.task_conf = {}
+        self.lock = threading.Lock()
+
+    def init(self, config, progress_handler=None, task_conf=None):
+        section = 'DTABLE-IO'
+        if config.has_option(section, 'process_pool_workers'):
+            self.workers = config.getint(section, 'process_pool_workers')
+        if config.has_option(section, 'process_pool_max_tasks_per_child'):
+            self.max_tasks_per_child = max(config.getint(section, 'process_pool_max_tasks_per_child'), 1)
+        if config.has_option(section, 'process_pool_tasks'):
+            self.task_names = {name.strip() for name in config.get(section, 'process_pool_tasks').split(',') if name.strip()}
+        self.progress_handler = progress_handler
+        self.task_conf = task_conf or {}
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def is_process_task(self, func):
+        return self.enabled and getattr(func, '__name__', None) in self.task_names
+
+    def _create_executor(self):
+        mp_context = multiprocessing.get_context('spawn')
+        kwargs = dict(max_workers=self.workers, mp_context=mp_context,
+                      initializer=_init_worker, initargs=(self.progress_queue, self.task_conf, self.cancelled_tasks))
+        if sys.version_info >= (3, 11):
+            kwargs['max_tasks_per_child'] = self.max_tasks_per_child
+        return ProcessPoolExecutor(**kwargs)
+
+    def _get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = self._create_executor()
+            elif sys.version_info < (3, 11) and self.submitted_count >= self.workers * self.max_tasks_per_child:
+                # no max_tasks_per_child before python 3.11, recycle the whole pool instead
+                self.executor.shutdown(wait=False)
+                self.executor = self._create_executor()
+                self.submitted_count = 0
+            self.submitted_count += 1
+            return self.executor
+
+    def handle_progress(self):
+        while True:
+            try:
+                task_id, progress = self.progress_queue.get(timeout=2)
+            except queue.Empty:
+                continue
+            except Exception as e:
+                logger.error('get task progress error: %s', e)
+                continue
+            if self.progress_handler:
+                self.progress_handler(task_id, progress)
+
+    def run(self):
+        set_progress_handler(self.progress_handler)
+        if not self.enabled:
+            return
+        mp_context = multiprocessing.get_context('spawn')
+        self.progress_queue = mp_context.Queue()
+        self.manager = mp_context.Manager()
+        self.cancelled_tasks = self.manager.dict()
+        t = threading.Thread(target=self.handle_progress, name='TaskProcessPool Progress Thread')
+        t.setDaemon(True)
+        t.start()
+
+    def run_task(self, task_id, func, args, timeout=None, token=None):
+        """ run task in a worker process, wait for and return its result or raise its error
+
+        :param token: CancellationToken, cancelling it stops the task in the worker
+        """
+        future = self._get_executor().submit(_run_task_in_worker, task_id, func, args, timeout)
+        # the worker stops the task itself at the deadline, wait a little longer for it
+        deadline = time.time() + timeout + 30 if timeout else None
+        cancel_sent = False
+        try:
+            while True:
+                try:
+                    return future.result(timeout=CANCEL_CHECK_INTERVAL)
+                except TimeoutError:
+                    pass
+                if token is not None and token.is_cancelled and not cancel_sent:
+                    # not started yet, or stopped by the worker at its next cancel check
+                    if not future.cancel():
+                        self.cancelled_tasks[task_id] = token.reason
+                    cancel_sent = True
+                if future.cancelled():
+                    raise TaskCancelledError(token.reason)
+                if deadline and time.time() > deadline:
+                    future.cancel()
+                    raise TaskCancelledError('Task timeout')
+        finally:
+            if cancel_sent and self.cancelled_tasks is not None:
+                self.cancelled_tasks.pop(task_id, None)
+
+
+task_process_pool = TaskProcessPool()
@@ -0,0 +1,124 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class TaskResultStore(object):
+    """ Dict like store of dtable io task results, evicted by TTL and size
+
+    Results nobody polls are dropped after `task_result_ttl` seconds, and the oldest
+    results are dropped once more than `task_result_max_size` are kept. With
+    `task_result_backend = redis` results are also written to redis, so that any
+    dtable-events node can answer status queries.
+
+    Values changed in place (like big data task status) are only written to redis
+    again by `save()`.
+    """
+
+    def __init__(self, name, ttl=24 * 3600, max_size=10000):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.items = OrderedDict()  # task_id -> (value, expire_at)
+        self.lock = Lock()
+        self.redis_client = None
+
+    def init(self, config):
+        section = 'DTABLE-IO'
+        if config.has_option(section, 'task_result_ttl'):
+            self.ttl = config.getint(section, 'task_result_ttl')
+        if config.has_option(section, 'task_result_max_size'):
+            self.max_size = config.getint(section, 'task_result_max_size')
+        # tasks may run on other nodes with a redis task queue
+        backends = [config.get(section, key).strip().lower() for key in ('task_result_backend', 'task_queue_backend')
+                    if config.has_option(section, key)]
+        if 'redis' in backends:
+            from dtable_events.app.event_redis import RedisClient
+            self.redis_client = RedisClient(config, socket_timeout=10)
+
+    def _redis_key(self, task_id):
+        return 'dtable_io_task_result:%s:%s' % (self.name, task_id)
+
+    def _evict(self, now):
+        while self.items:
+            task_id, (_, expire_at) = next(iter(self.items.items()))
+            if expire_at > now and len(self.items) <= self.max_size:
+                break
+            self.items.popitem(last=False)
+
+    def _set_redis(self, task_id, value):
+        if not self.redis_client:
+            return
+        try:
+            self.redis_client.set(self._redis_key(task_id), json.dumps(value, default=str), timeout=self.ttl)
+        except Exception as e:
+            logger.error('save task %s result to redis error: %s', task_id, e)
+
+    def _get_redis(self, task_id):
+        if not self.redis_client:
+            return False, None
+        try:
+            value = self.redis_client.get(self._redis_key(task_id))
+        except Exception as e:
+            logger.error('get task %s result from redis error: %s', task_id, e)
+            return False, None
+        if value is None:
+            return False, None
+        return True, json.loads(value)
+
+    def __setitem__(self, task_id, value):
+        now = time.time()
+        with self.lock:
+            self.items.pop(task_id, None)
+            self.items[task_id] = (value, now + self.ttl)
+            self._evict(now)
+        self._set_redis(task_id, value)
+
+    def _get_local(self, task_id):
+        with self.lock:
+            item = self.items.get(task_id)
+            if not item:
+                return False, None
+            if item[1] <= time.time():
+                self.items.pop(task_id, None)
+                return False, None
+            return True, item[0]
+
+    def _get(self, task_id):
+        found, value = self._get_local(task_id)
+        if found:
+            return found, value
+        return self._get_redis(task_id)
+
+    def __getitem__(self, task_id):
+        found, value = self._get(task_id)
+        if not found:
+            raise KeyError(task_id)
+        return value
+
+    def __contains__(self, task_id):
+        return self._get(task_id)[0]
+
+    def get(self, task_id, default=None):
+        found, value = self._get(task_id)
+        return value if found else default
+
+    def save(self, task_id):
+        found, value = self._get_local(task_id)
+        if found:
+            self._set_redis(task_id, value)
+
+    def pop(self, task_id, default=None):
+        found, value = self._get(task_id)
+        with self.lock:
+            self.items.pop(task_id, None)
+        if self.redis_client:
+            try:
+                self.redis_client.delete(self._redis_key(task_id))
+            except Exception as e:
+                logger.error('delete task %s result from redis error: %s', task_id, e)
+        return value if found else default
@@ -0,0 +1,300 @@
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+
+from dtable_events.dtable_io.task_broker import task_broker
+
+logger = logging.getLogger(__name__)
+
+# name -> (priority, queue_size), smaller priority runs first
+DEFAULT_TASK_CLASSES = {
+    'message': (0, 10),
+    'plugin_email': (0, 10),
+    'io': (1, 10),
+    'data_sync': (1, 10),
+    'io_long': (2, 10),
+    'big_data': (3, 10),
+}
+
+
+class TaskClass(object):
+
+    def __init__(self, name, handler, workers, priority, queue_size, tasks_map=None, local_args=None):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.priority = priority
+        self.queue_size = queue_size
+        # tasks are queued in redis if task broker is enabled
+        self.tasks_map = tasks_map
+        self.local_args = local_args
+        self.distributed = task_broker.enabled and tasks_map is not None
+
+        self.pending_count = 0
+        self.running_count = 0
+        self.submitted_count = 0
+        self.finished_count = 0
+        self.wait_times = deque(maxlen=1000)
+
+
+class TaskQueue(object):
+    """ queue.Queue like view of one task class, kept for the `tasks_queue` users
+    """
+
+    def __init__(self, scheduler, class_name):
+        self.scheduler = scheduler
+        self.class_name = class_name
+
+    def put(self, task_id, owner=None):
+        self.scheduler.submit(self.class_name, task_id, owner=owner)
+
+    def full(self):
+        return self.scheduler.is_full(self.class_name)
+
+    def qsize(self):
+        return self.scheduler.qsize(self.class_name)
+
+
+class TaskScheduler(object):
+    """ Run tasks of all dtable io task managers with one pool of worker threads
+
+    Every task class has its own concurrency limit and queue size, so long exports
+    can not take all workers or fill the queue of short tasks. Pending tasks are
+    picked by class priority, then by submission order, skipping owners (base or
+    user) which already run `max_running_per_owner` tasks as long as other owners
+    are waiting.
+    """
+
+    def __init__(self):
+        self.task_classes = {}
+        self.pending = []  # [(priority, seq, class_name, task_id, owner, submit_time)]
+        self.seq = 0
+        self.running_owners = defaultdict(int)
+        self.cond = threading.Condition()
+        self.threads = []
+        self.conf = {
+            'workers': 3,
+            'max_running_per_owner': 2,
+        }
+        self.config = None
+
+    def init(self, workers, config):
+        self.config = config
+        task_broker.init(config)
+        self.conf['workers'] = self._get_int_option('scheduler_workers', workers * 4 + 1)
+        self.conf['max_running_per_owner'] = self._get_int_option('max_running_tasks_per_owner', 2)
+
+    def _get_int_option(self, key, default):
+        if self.config is not None and self.config.has_option('DTABLE-IO', key):
+            return self.config.getint('DTABLE-IO', key)
+        return default
+
+    def get_queue(self, class_name):
+        return TaskQueue(self, class_name)
+
+    def register(self, class_name, handler, workers, tasks_map=None, local_args=None, cancel_handler=None):
+        """ register a task class, `<class_name>_workers`, `<class_name>_priority` and
+        `<class_name>_queue_size` in [DTABLE-IO] overwrite the defaults
+
+        With `tasks_map` given, tasks of the class are shared with other nodes by task broker.
+        """
+        priority, queue_size = DEFAULT_TASK_CLASSES.get(class_name, (1, 10))
+        task_class = TaskClass(
+            class_name, handler,
+            workers=self._get_int_option('%s_workers' % class_name, workers),
+            priority=self._get_int_option('%s_priority' % class_name, priority),
+            queue_size=self._get_int_option('%s_queue_size' % class_name, queue_size),
+            tasks_map=tasks_map, local_args=local_args)
+        with self.cond:
+            self.task_classes[class_name] = task_class
+        if cancel_handler:
+            task_broker.cancel_handlers[class_name] = cancel_handler
+
+    def _get_class(self, class_name):
+        task_class = self.task_classes.get(class_name)
+        if not task_class:
+            raise ValueError('task class %s not registered' % class_name)
+        return task_class
+
+    def is_full(self, class_name):
+        task_class = self.task_classes.get(class_name)
+        if not task_class:
+            return False
+        return self.qsize(class_name) >= task_class.queue_size
+
+    def qsize(self, class_name):
+        task_class = self.task_classes.get(class_name)
+        if not task_class:
+            return 0
+        if task_class.distributed:
+            return task_broker.qsize(class_name)
+        return task_class.pending_count
+
+    def submit(self, class_name, task_id, owner=None):
+        """ submit a task put in tasks_map of the class, the task is removed from
+        tasks_map if it can not be submitted, like queue.Full
+        """
+        task_class = self._get_class(class_name)
+        try:
+            if task_class.distributed:
+                task = task_class.tasks_map.pop(task_id)
+                task_broker.submit(class_name, task_id, task, owner=owner, local_args=task_class.local_args)
+                return
+            self.submit_local(class_name, task_id, owner=owner)
+        except Exception:
+            if task_class.tasks_map is not None:
+                task_class.tasks_map.pop(task_id, None)
+            raise
+
+    def submit_local(self, class_name, task_id, owner=None, check_full=True):
+        with self.cond:
+            task_class = self._get_class(class_name)
+            if check_full and task_class.pending_count >= task_class.queue_size:
+                raise queue.Full('task queue %s is full' % class_name)
+            self.seq += 1
+            self.pending.append((task_class.priority, self.seq, class_name, task_id, owner, time.time()))
+            self.pending.sort()
+            task_class.pending_count += 1
+            task_class.submitted_count += 1
+            self.cond.notify()
+
+    def _pick(self):
+        max_running = self.conf['max_running_per_owner']
+        runnable = None
+        for index, entry in enumerate(self.pending):
+            task_class = self.task_classes[entry[2]]
+            if task_class.running_count >= task_class.workers:
+                continue
+            owner = entry[4]
+            if owner is None or self.running_owners[owner] < max_running:
+                runnable = index
+                break
+            if runnable is None:
+                runnable = index
+        if runnable is None:
+            return None
+        return self.pending.pop(runnable)
+
+    def _start(self, entry):
+        task_class = self.task_classes[entry[2]]
+        task_class.pending_count -= 1
+        task_class.running_count += 1
+        task_class.wait_times.append(time.time() - entry[5])
+        if entry[4] is not None:
+            self.running_owners[entry[4]] += 1
+
+    def _finish(self, entry):
+        task_class = self.task_classes[entry[2]]
+        task_class.running_count -= 1
+        task_class.finished_count += 1
+        owner = entry[4]
+        if owner is not None:
+            self.running_owners[owner] -= 1
+            if self.running_owners[owner] <= 0:
+                self.running_owners.pop(owner, None)
+
+    def handle_task(self):
+        while True:
+            with self.cond:
+                entry = self._pick()
+                while entry is None:
+                    self.cond.wait(timeout=2)
+                    entry = self._pick()
+                self._start(entry)
+
+            task_class = self.task_classes[entry[2]]
+            try:
+                task_class.handler(entry[3])
+            except Exception as e:
+                logger.exception('Failed to handle %s task %s: %s', entry[2], entry[3], e)
+            finally:
+                if task_class.distributed:
+                    try:
+                        task_broker.finish(entry[3])
+                    except Exception as e:
+                        logger.error('finish task %s in task broker error: %s', entry[3], e)
+                with self.cond:
+                    self._finish(entry)
+                    self.cond.notify_all()
+
+    def handle_remote_tasks(self, class_name):
+        """ take tasks of the class from task broker whenever a local worker is free
+        """
+        task_class = self.task_classes[class_name]
+        while True:
+            with self.cond:
+                while task_class.pending_count + task_class.running_count >= task_class.workers:
+                    self.cond.wait(timeout=2)
+            try:
+                fetched = task_broker.fetch(class_name)
+            except Exception as e:
+                logger.error('fetch %s task from task broker error: %s', class_name, e)
+                time.sleep(2)
+                continue
+            if not fetched:
+                continue
+            task_id, payload = fetched
+            try:
+                task_class.tasks_map[task_id] = task_broker.decode_task(payload, task_class.local_args)
+            except Exception as e:
+                logger.error('decode task %s error: %s', task_id, e)
+                task_broker.finish(task_id)
+                continue
+            # fetched only with a free worker, never rejected
+            self.submit_local(class_name, task_id, owner=payload.get('owner'), check_full=False)
+
+    def run(self):
+        for i in range(self.conf['workers']):
+            t_name = 'TaskScheduler Thread-' + str(i)
+            t = threading.Thread(target=self.handle_task, name=t_name)
+            self.threads.append(t)
+            t.setDaemon(True)
+            t.start()
+        for name, task_class in self.task_classes.items():
+            if not task_class.distributed:
+                continue
+            t = threading.Thread(target=self.handle_remote_tasks, args=(name,), name='TaskScheduler Remote-' + name)
+            self.threads.append(t)
+            t.setDaemon(True)
+            t.start()
+        task_broker.run()
+
+    def threads_is_alive(self):
+        info = {}
+        for t in self.threads:
+            info[t.name] = t.is_alive()
+        return info
+
+    def get_metrics(self):
+        now = time.time()
+        with self.cond:
+            oldest_submit_times = {}
+            for entry in self.pending:
+                oldest_submit_times.setdefault(entry[2], entry[5])
+            metrics = {}
+            for name, task_class in self.task_classes.items():
+                wait_times = list(task_class.wait_times)
+                oldest = oldest_submit_times.get(name)
+                metrics[name] = {
+                    'priority': task_class.priority,
+                    'workers': task_class.workers,
+                    'queue_size': task_class.queue_size,
+                    'pending': task_class.pending_count,
+                    'running': task_class.running_count,
+                    'submitted': task_class.submitted_count,
+                    'finished': task_class.finished_count,
+                    'avg_wait_time': round(sum(wait_times) / len(wait_times), 3) if wait_times else 0,
+                    'max_wait_time': round(max(wait_times), 3) if wait_times else 0,
+                    'oldest_pending_wait_time': round(now - oldest, 3) if oldest else 0,
+                }
+            return {
+                'workers': self.conf['workers'],
+                'busy_workers': sum(c.running_count for c in self.task_classes.values()),
+                'running_owners': len(self.running_owners),
+                'task_classes': metrics,
+            }
+
+
+task_scheduler = TaskScheduler()
@@ -5,17 +5,17 @@ import os
 import time
 import logging
 from logging import handlers
-import io
 import uuid
 import datetime
 import random
 import string
 import jwt
-import sys
 import re
 import hashlib
 import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from io import BytesIO
+from itertools import islice
 from zipfile import ZipFile, is_zipfile
 from uuid import UUID, uuid4
 from urllib.parse import quote as urlquote
@@ -28,6 +28,11 @@ from dtable_events.dtable_io.external_app import APP_USERS_COUMNS_TYPE_MAP, matc
     get_row_ids_for_delete, get_app_users
 from dtable_events.dtable_io.task_manager import task_manager
 from dtable_events.utils import get_inner_dtable_server_url, uuid_str_to_36_chars
+from dtable_events.utils.bulk_writer import AdaptiveBatchWriter
+from dtable_events.utils.http_compression import compress_json_body
+from dtable_events.utils.task_context import TaskCancelledError, check_task_cancelled, get_task_token, \
+    report_task_progress
+from dtable_events.utils.token_cache import get_dtable_access_token
 
 # this two prefix used in exported zip file
 from dtable_events.utils.constants import ColumnTypes
@@ -72,19 +77,7 @@ def gen_inner_file_upload_url(token, op, replace=False):
 
 
 def get_dtable_server_token(username, dtable_uuid, timeout=300, is_internal=False):
-    payload = {
-        'exp': int(time.time()) + timeout,
-        'dtable_uuid': dtable_uuid,
-        'username': username,
-        'permission': 'rw',
-    }
-    if is_internal:
-        payload['is_internal'] = True
-    access_token = jwt.encode(
-        payload, DTABLE_PRIVATE_KEY, algorithm='HS256'
-    )
-
-    return access_token
+    return get_dtable_access_token(dtable_uuid, username, timeout=timeout, is_internal=is_internal)
 
 def get_app_access_token(username, app_uuid):
     payload = {
@@ -150,13 +143,14 @@ def convert_dtable_export_file_and_image_url(workspace_id, dtable_uuid, dtable_c
     return dtable_content
 
 
-def prepare_dtable_json_from_memory(workspace_id, dtable_uuid, username):
+def prepare_dtable_json_from_memory(workspace_id, dtable_uuid, username, zip_file):
     """
     Used in dtable file export in real-time from memory by request the api of dtable-server
     It is more effective than exporting dtable files from seafile-server which will take about 5 minutes
     for synchronizing the data from memory to seafile-server.
     :param dtable_uuid:
     :param username:
+    :param zip_file: export ZipFile, content.json is written into it
     :return:
     """
     dtable_server_access_token = get_dtable_server_token(username, dtable_uuid)
@@ -173,25 +167,20 @@ def prepare_dtable_json_from_memory(workspace_id, dtable_uuid, username):
     else:
         dtable_content = ''
     content_json = json.dumps(dtable_content).encode('utf-8')
-    path = os.path.join('/tmp/dtable-io', dtable_uuid, 'dtable_asset', 'content.json')
-
-    with open(path, 'wb') as f:
-        f.write(content_json)
+    zip_file.writestr('content.json', content_json)
 
 
-def prepare_asset_file_folder(username, repo_id, dtable_uuid, asset_dir_id):
+def download_asset_zip(username, repo_id, asset_dir_id, zip_path):
     """
     used in export dtable
-    create asset folder at /tmp/dtable-io/<dtable_uuid>/dtable_asset
-    notice that create_dtable_json and this function create file at same directory
-
-    1. get asset zip from file_server
-    2. unzip it at /tmp/dtable-io/<dtable_uuid>/dtable_asset/
+    stream the asset zip of file_server to `zip_path`, entries of the zip are under `asset/`,
+    so other export files can be appended to it without extracting any asset
 
     :param username:
     :param repo_id:
     :param asset_dir_id:
-    :return:
+    :param zip_path:
+    :return: whether a valid zip is downloaded
     """
 
     # get file server access token
@@ -200,33 +189,28 @@ def prepare_asset_file_folder(username, repo_id, dtable_uuid, asset_dir_id):
         'dir_name': 'asset',        # after download and zip, folder root name is asset
         'is_windows': 0
     }
-    try:
-        token = seafile_api.get_fileserver_access_token(
-            repo_id, json.dumps(fake_obj_id), 'download-dir', username, use_onetime=False
+    token = seafile_api.get_fileserver_access_token(
+        repo_id, json.dumps(fake_obj_id), 'download-dir', username, use_onetime=False
     )
-    except Exception as e:
-        raise e
 
     progress = {'zipped': 0, 'total': 1}
     while progress['zipped'] != progress['total']:
+        check_task_cancelled()
         time.sleep(0.5)   # sleep 0.5 second
-        try:
-            progress = json.loads(seafile_api.query_zip_progress(token))
-        except Exception as e:
-            raise e
+        progress = json.loads(seafile_api.query_zip_progress(token))
 
     asset_url = gen_dir_zip_download_url(token)
-    try:
-        resp = requests.get(asset_url)
-    except Exception as e:
-        raise e
-    file_obj = io.BytesIO(resp.content)
-    if is_zipfile(file_obj):
-        with ZipFile(file_obj) as zp:
-            zp.extractall(os.path.join('/tmp/dtable-io', dtable_uuid, 'dtable_asset'))
+    with requests.get(asset_url, stream=True, timeout=180) as resp:
+        if resp.status_code != 200:
+            raise Exception('download asset zip error: %s' % resp.status_code)
+        with open(zip_path, 'wb') as f:
+            for chunk in resp.iter_content(chunk_size=1024 * 1024):
+                check_task_cancelled()
+                f.write(chunk)
+    return is_zipfile(zip_path)
 
 
-def copy_src_forms_to_json(dtable_uuid, tmp_file_path, db_session):
+def copy_src_forms_to_json(dtable_uuid, zip_file, db_session):
     if not db_session:
         return
     sql = "SELECT `username`, `form_config`, `share_type` FROM dtable_forms WHERE dtable_uuid=:dtable_uuid"
@@ -240,12 +224,10 @@ def copy_src_forms_to_json(dtable_uuid, tmp_file_path, db_session):
         }
         src_forms_json.append(form)
     if src_forms_json:
-        # os.makedirs(os.path.join(tmp_file_path, 'forms.json'))
-        with open(os.path.join(tmp_file_path, 'forms.json'), 'w+') as fp:
-            fp.write(json.dumps(src_forms_json))
+        zip_file.writestr('forms.json', json.dumps(src_forms_json))
 
 
-def copy_src_auto_rules_to_json(dtable_uuid, tmp_file_path, db_session):
+def copy_src_auto_rules_to_json(dtable_uuid, zip_file, db_session):
     if not db_session:
         return
     sql = """SELECT `run_condition`, `trigger`, `actions` FROM dtable_automation_rules WHERE dtable_uuid=:dtable_uuid"""
@@ -259,11 +241,10 @@ def copy_src_auto_rules_to_json(dtable_uuid, tmp_file_path, db_session):
         }
         src_auto_rules_json.append(auto_rule)
     if src_auto_rules_json:
-        with open(os.path.join(tmp_file_path, 'auto_rules.json'), 'w+') as fp:
-            fp.write(json.dumps(src_auto_rules_json))
+        zip_file.writestr('auto_rules.json', json.dumps(src_auto_rules_json))
 
 
-def copy_src_workflows_to_json(dtable_uuid, tmp_file_path, db_session):
+def copy_src_workflows_to_json(dtable_uuid, zip_file, db_session):
     if not db_session:
         return
     sql = """SELECT `token`, `workflow_config` FROM dtable_workflows WHERE dtable_uuid=:dtable_uuid"""
@@ -276,11 +257,10 @@ def copy_src_workflows_to_json(dtable_uuid, tmp_file_path, db_session):
         }
         src_workflows_json.append(workflow)
     if src_workflows_json:
-        with open(os.path.join(tmp_file_path, 'workflows.json'), 'w+') as fp:
-            fp.write(json.dumps(src_workflows_json))
+        zip_file.writestr('workflows.json', json.dumps(src_workflows_json))
 
 
-def copy_src_external_app_to_json(dtable_uuid, tmp_file_path, db_session):
+def copy_src_external_app_to_json(dtable_uuid, zip_file, db_session):
     if not db_session:
         return
     sql = """SELECT `id`, `app_config` FROM dtable_external_apps WHERE dtable_uuid=:dtable_uuid"""
@@ -293,8 +273,7 @@ def copy_src_external_app_to_json(dtable_uuid, tmp_file_path, db_session):
         }
         src_external_apps_json.append(external_app)
     if src_external_apps_json:
-        with open(os.path.join(tmp_file_path, 'external_apps.json'), 'w+') as fp:
-            fp.write(json.dumps(src_external_apps_json))
+        zip_file.writestr('external_apps.json', json.dumps(src_external_apps_json))
 
 
 def convert_dtable_import_file_url(dtable_content, workspace_id, dtable_uuid):
@@ -502,6 +481,8 @@ def post_asset_files(repo_id, dtable_uuid, username):
     asset_root_path = os.path.join('/asset', dtable_uuid)
 
     tmp_extracted_path = os.path.join('/tmp/dtable-io', dtable_uuid, 'dtable_zip_extracted/')
+    upload_items = []
+    checked_dirs = set()
     for root, dirs, files in os.walk(tmp_extracted_path):
         for file_name in files:
             if file_name in ['content.json', 'forms.json']:
@@ -509,12 +490,32 @@ def post_asset_files(repo_id, dtable_uuid, username):
             inner_path = root[len(tmp_extracted_path)+6:]  # path inside zip
             tmp_file_path = os.path.join(root, file_name)
             cur_file_parent_path = os.path.join(asset_root_path, inner_path)
-            # check current file's parent path before post file
-            path_id = seafile_api.get_dir_id_by_path(repo_id, cur_file_parent_path)
-            if not path_id:
-                seafile_api.mkdir_with_parents(repo_id, '/', cur_file_parent_path[1:], username)
-
-            seafile_api.post_file(repo_id, tmp_file_path, cur_file_parent_path, file_name, username)
+            # check every parent path once before post files
+            if cur_file_parent_path not in checked_dirs:
+                path_id = seafile_api.get_dir_id_by_path(repo_id, cur_file_parent_path)
+                if not path_id:
+                    seafile_api.mkdir_with_parents(repo_id, '/', cur_file_parent_path[1:], username)
+                checked_dirs.add(cur_file_parent_path)
+            upload_items.append((tmp_file_path, cur_file_parent_path, file_name))
+
+    total = len(upload_items)
+    if not total:
+        return
+    uploaded = 0
+    workers = min(task_manager.conf.get('asset_upload_workers', 8), total)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(seafile_api.post_file, repo_id, tmp_file_path, parent_path, file_name, username)
+                   for tmp_file_path, parent_path, file_name in upload_items]
+        try:
+            for future in as_completed(futures):
+                future.result()
+                uploaded += 1
+                check_task_cancelled()
+                report_task_progress({'step': 'upload', 'uploaded': uploaded, 'total': total})
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
 
 # execute after post asset
 def update_page_content(workspace_id, dtable_uuid, page_id, page_content, need_check_static=True):
@@ -1001,38 +1002,73 @@ def download_files_to_path(username, repo_id, dtable_uuid, files, path, db_sessi
         except Exception as e:
             dtable_io_logger.error('query dtable: %s custom uuids error: %s', dtable_uuid, e)
 
-    tmp_file_list = []
+    # files of the same name are downloaded to the same path, only download the last one of
+    # them as it overwrote the others, so that no two workers write to one file
+    file_name_to_obj_id = {}
     for file, obj_id in valid_file_obj_ids:
-        token = seafile_api.get_fileserver_access_token(
-            repo_id, obj_id, 'download', username,
-            use_onetime=False
-        )
         file_name = os.path.basename(file)
         if files_map and files_map.get(file, None):
             file_name = files_map.get(file)
-        file_url = gen_inner_file_get_url(token, file_name)
-        content = requests.get(file_url).content
-        filename_by_path = os.path.join(path, file_name)
-        with open(filename_by_path, 'wb') as f:
-            f.write(content)
-        tmp_file_list.append(filename_by_path)
-
+        file_name_to_obj_id.pop(file_name, None)
+        file_name_to_obj_id[file_name] = obj_id
     for custom_uuid, obj_id, file_name in valid_custom_file_obj_ids:
-        token = seafile_api.get_fileserver_access_token(
-            repo_id, obj_id, 'download', username,
-            use_onetime=False
-        )
         if files_map and files_map.get(custom_uuid):
             file_name = files_map.get(custom_uuid)
-        file_url = gen_inner_file_get_url(token, file_name)
-        content = requests.get(file_url).content
-        filename_by_path = os.path.join(path, file_name)
-        with open(filename_by_path, 'wb') as f:
-            f.write(content)
-        tmp_file_list.append(filename_by_path)
+        file_name_to_obj_id.pop(file_name, None)
+        file_name_to_obj_id[file_name] = obj_id
+    download_items = [(obj_id, file_name) for file_name, obj_id in file_name_to_obj_id.items()]
+
+    # download files concurrently, worker threads have no task context, so pass the token to them
+    token = get_task_token()
+    total = len(download_items)
+    tmp_file_list = []
+    workers = max(min(task_manager.conf.get('asset_download_workers', 8), total), 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(download_asset_file, username, repo_id, obj_id, file_name, path, token)
+                   for obj_id, file_name in download_items]
+        try:
+            for future in as_completed(futures):
+                tmp_file_list.append(future.result())
+                report_task_progress({'step': 'download', 'downloaded': len(tmp_file_list), 'total': total})
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
     return tmp_file_list
 
 
+def download_asset_file(username, repo_id, obj_id, file_name, path, token=None):
+    """
+    stream an asset file to path/file_name chunk by chunk, retry on errors
+    """
+    from dtable_events.dtable_io import dtable_io_logger
+
+    filename_by_path = os.path.join(path, file_name)
+    retries = task_manager.conf.get('asset_download_retries', 3)
+    for attempt in range(retries + 1):
+        try:
+            access_token = seafile_api.get_fileserver_access_token(
+                repo_id, obj_id, 'download', username,
+                use_onetime=False
+            )
+            file_url = gen_inner_file_get_url(access_token, file_name)
+            with requests.get(file_url, stream=True, timeout=180) as resp:
+                resp.raise_for_status()
+                with open(filename_by_path, 'wb') as f:
+                    for chunk in resp.iter_content(chunk_size=1024 * 1024):
+                        if token:
+                            token.check()
+                        f.write(chunk)
+            return filename_by_path
+        except TaskCancelledError:
+            raise
+        except Exception as e:
+            if attempt >= retries:
+                raise
+            dtable_io_logger.warning('download asset file %s error: %s, retry %s', file_name, e, attempt + 1)
+            time.sleep(attempt + 1)
+
+
 def upload_excel_json_to_dtable_server(username, dtable_uuid, json_file, lang='en'):
     api_url = get_inner_dtable_server_url()
     url = api_url.rstrip('/') + '/api/v1/dtables/' + dtable_uuid + '/import-excel/?from=dtable_events&lang=' + lang
@@ -1074,28 +1110,8 @@ def upload_excel_json_add_table_to_dtable_server(username, dtable_uuid, json_fil
 
 
 def append_rows_by_dtable_server(dtable_server_api, rows_data, table_name):
-    offset = 0
-    while True:
-        rows = rows_data[offset: offset + 1000]
-        offset = offset + 1000
-        if not rows:
-            break
-        dtable_server_api.batch_append_rows(table_name, rows)
-        time.sleep(0.5)
-
-
-def get_csv_file(file_path):
-    from dtable_events.dtable_io import dtable_io_logger
-
-    # The specified character set is utf-8-sig to automatically process BOM characters
-    # and eliminate the occurrence of \ ufeff
-    with open(file_path, 'r', encoding='utf-8-sig') as f:
-        content = f.read()
-
-    file_size = sys.getsizeof(content)
-    dtable_io_logger.info('csv file size: %d KB' % (file_size >> 10))
-
-    return content
+    writer = AdaptiveBatchWriter(lambda rows: dtable_server_api.batch_append_rows(table_name, rows))
+    writer.write(rows_data)
 
 
 def get_rows_from_dtable_server(username, dtable_uuid, table_name):
@@ -1116,20 +1132,19 @@ def update_rows_by_dtable_server(username, dtable_uuid, update_rows, table_name)
     url = api_url.rstrip('/') + '/api/v1/dtables/' + dtable_uuid + '/batch-update-rows/?from=dtable_events'
     dtable_server_access_token = get_dtable_server_token(username, dtable_uuid)
     headers = {'Authorization': 'Token ' + dtable_server_access_token}
-    offset = 0
-    while True:
-        rows = update_rows[offset: offset + 1000]
-        offset = offset + 1000
-        if not rows:
-            break
+
+    def batch_update_rows(rows):
         json_data = {
             'table_name': table_name,
             'updates': rows,
         }
-        res = requests.put(url, headers=headers, json=json_data, timeout=180)
+        data, request_headers = compress_json_body(json_data, headers)
+        res = requests.put(url, headers=request_headers, data=data, timeout=180)
         if res.status_code != 200:
-            raise ConnectionError('failed to update excel json %s %s' % (dtable_uuid, res.text))
-        time.sleep(0.5)
+            raise ConnectionError(res.status_code, 'failed to update excel json %s %s' % (dtable_uuid, res.text))
+
+    writer = AdaptiveBatchWriter(batch_update_rows, idempotent=True)
+    writer.write(update_rows)
 
 
 def get_metadata_from_dtable_server(dtable_uuid, username):
@@ -1139,13 +1154,7 @@ def get_metadata_from_dtable_server(dtable_uuid, username):
     api_url = get_inner_dtable_server_url()
     url = api_url.rstrip('/') + '/api/v1/dtables/' + dtable_uuid + '/metadata/?from=dtable_events'
 
-    payload = {
-        'exp': int(time.time()) + 60,
-        'dtable_uuid': dtable_uuid,
-        'username': username,
-        'permission': 'r',
-    }
-    access_token = jwt.encode(payload, DTABLE_PRIVATE_KEY, algorithm='HS256')
+    access_token = get_dtable_access_token(dtable_uuid, username, permission='r', timeout=60)
 
     # 1. get cols from dtable-server
     headers = {'Authorization': 'Token ' + access_token}
@@ -1196,13 +1205,7 @@ def get_view_rows_from_dtable_server(dtable_uuid, table_id, view_id, username, i
 def get_related_nicknames_from_dtable(dtable_uuid, username, permission):
     url = DTABLE_WEB_SERVICE_URL.strip('/') + '/api/v2.1/dtables/%s/related-users/' % dtable_uuid
 
-    payload = {
-        'exp': int(time.time()) + 60,
-        'dtable_uuid': dtable_uuid,
-        'username': username,
-        'permission': permission,
-    }
-    access_token = jwt.encode(payload, DTABLE_PRIVATE_KEY, algorithm='HS256')
+    access_token = get_dtable_access_token(dtable_uuid, username, permission=permission, timeout=60)
     headers = {'Authorization': 'Token ' + access_token}
 
     res = requests.get(url, headers=headers)
@@ -1351,6 +1354,7 @@ def get_rows_from_dtable_db(dtable_db_api, table_name, limit=50000):
     start = 0
     dtable_rows = []
     while True:
+        check_task_cancelled()
         # exported row number should less than limit
         if (start + offset) > limit:
             offset = limit - start
@@ -1368,15 +1372,70 @@ def get_rows_from_dtable_db(dtable_db_api, table_name, limit=50000):
     return dtable_rows
 
 
-def update_rows_by_dtable_db(dtable_db_api, update_rows, table_name):
-    offset = 0
+def to_sql_literal(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'%s'" % str(value).replace('\\', '\\\\').replace("'", "\\'")
+
+
+def iter_rows_by_keys_from_dtable_db(dtable_db_api, table_name, key_columns, keys, select_columns=None,
+                                     batch_size=1000, convert=False, server_only=True):
+    """ Query the rows which may match keys in batched `IN` queries
+
+    Every batch of keys is queried with one `IN` list of the values of each key column,
+    so rows are only candidates and the caller should match their keys exactly.
+
+    :param key_columns: list of column names
+    :param keys: iterable of tuples of values of key_columns, None for empty value
+    :param select_columns: list of column names to query besides `_id`, all if None
+    :param convert: bool, query with keys converted by dtable-db
+    :return: generator of converted rows
+    """
+    from dtable_events.utils.dtable_db_api import convert_db_rows
+    offset = 10000
+    if select_columns is None:
+        fields = '*'
+    else:
+        fields = ', '.join(['`_id`'] + ['`%s`' % col for col in select_columns if col != '_id'])
+    keys = iter(keys)
     while True:
-        rows = update_rows[offset: offset + 1000]
-        offset = offset + 1000
-        if not rows:
-            break
-        dtable_db_api.batch_update_rows(table_name, rows)
-        time.sleep(0.5)
+        batch = list(islice(keys, batch_size))
+        if not batch:
+            return
+        where_clauses = []
+        for index, col in enumerate(key_columns):
+            values = {}
+            has_empty = False
+            for key in batch:
+                if key[index] is None:
+                    has_empty = True
+                else:
+                    values.setdefault(key[index])
+            conditions = []
+            if values:
+                conditions.append('`%s` in (%s)' % (col, ', '.join(to_sql_literal(value) for value in values)))
+            if has_empty:
+                conditions.append('`%s` is null' % col)
+            where_clauses.append('(%s)' % ' or '.join(conditions))
+
+        start = 0
+        while True:
+            check_task_cancelled()
+            sql = "SELECT %s FROM `%s` WHERE %s LIMIT %s, %s" % (
+                fields, table_name, ' AND '.join(where_clauses), start, offset)
+            response_rows, metadata = dtable_db_api.query(sql, convert=convert, server_only=server_only)
+            for row in convert_db_rows(metadata, response_rows):
+                yield row
+            start += offset
+            if len(response_rows) < offset:
+                break
+
+
+def update_rows_by_dtable_db(dtable_db_api, update_rows, table_name):
+    writer = AdaptiveBatchWriter(lambda rows: dtable_db_api.batch_update_rows(table_name, rows), idempotent=True)
+    writer.write(update_rows)
 
 
 def extract_select_options(rows, column_name_to_column):
@@ -1594,6 +1653,7 @@ def export_page_design_dir_to_path(repo_id, dtable_uuid, page_id, tmp_file_path,
     )
     progress = {'zipped': 0, 'total': 1}
     while progress['zipped'] != progress['total']:
+        check_task_cancelled()
         time.sleep(0.5)   # sleep 0.5 second
         progress = json.loads(seafile_api.query_zip_progress(token))
 
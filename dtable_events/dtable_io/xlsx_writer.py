@@ -0,0 +1,315 @@
+import datetime
+import os
+from math import isinf, isnan
+from xml.sax.saxutils import escape, quoteattr
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.styles.numbers import BUILTIN_FORMATS_REVERSE, FORMAT_DATE_DATETIME, FORMAT_DATE_TIME6, \
+    FORMAT_DATE_TIMEDELTA, FORMAT_DATE_YYYYMMDD2
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.utils.datetime import to_excel
+
+# same limit and default formats as openpyxl cells
+MAX_STRING_LENGTH = 32767
+TIME_FORMATS = (
+    (datetime.datetime, FORMAT_DATE_DATETIME),
+    (datetime.date, FORMAT_DATE_YYYYMMDD2),
+    (datetime.time, FORMAT_DATE_TIME6),
+    (datetime.timedelta, FORMAT_DATE_TIMEDELTA),
+)
+FIRST_CUSTOM_FORMAT_ID = 164
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PKG_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+CONTENT_TYPE_PREFIX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.'
+
+
+class XlsxCell(object):
+    """ cell of stream sheets, with the `value` and `number_format` of openpyxl cells
+    """
+    __slots__ = ('value', 'number_format')
+
+    def __init__(self, value=None):
+        self.value = value
+        self.number_format = 'General'
+
+
+class _Dimension(object):
+
+    def __init__(self):
+        self.height = None
+        self.width = None
+
+
+class _SheetFormat(object):
+
+    def __init__(self):
+        self.defaultRowHeight = 15
+        self.customHeight = False
+
+
+class _Dimensions(dict):
+
+    def __missing__(self, key):
+        self[key] = dimension = _Dimension()
+        return dimension
+
+
+class StreamSheet(object):
+    """ sheet of the stream writers of exported files, its cells are XlsxCell
+
+    Like an openpyxl write only worksheet, rows can only be appended, and `sheet_format`,
+    `column_dimensions` and the height in `row_dimensions` must be set before the first
+    row they affect is appended. Writers of files without them just ignore them.
+    """
+
+    def __init__(self, title):
+        self.title = title
+        self.row_dimensions = _Dimensions()
+        self.column_dimensions = _Dimensions()
+        self.sheet_format = _SheetFormat()
+        self.max_row = 0
+
+    def append(self, row):
+        """ append a row of XlsxCell, plain values or None
+        """
+        raise NotImplementedError
+
+
+class XlsxStreamSheet(StreamSheet):
+    """ worksheet of XlsxStreamWorkbook, every row is written as xml into the zip file at once
+    """
+
+    def __init__(self, workbook, title, path):
+        super(XlsxStreamSheet, self).__init__(title)
+        self.workbook = workbook
+        self.path = path
+        self.column_letters = []
+        self.file = None
+        self.buffer = []
+        self.buffer_size = 0
+
+    def _write(self, text):
+        self.buffer.append(text)
+        self.buffer_size += len(text)
+        if self.buffer_size >= WRITE_BUFFER_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            self.file.write(''.join(self.buffer).encode('utf-8'))
+            self.buffer = []
+            self.buffer_size = 0
+
+    def _open(self):
+        self.file = self.workbook.open_part(self.path)
+        sheet_format = '<sheetFormatPr baseColWidth="8" defaultRowHeight="%s"%s/>' % (
+            self.sheet_format.defaultRowHeight, ' customHeight="1"' if self.sheet_format.customHeight else '')
+        cols = []
+        widths = sorted((column_index_from_string(letter), dimension.width)
+                        for letter, dimension in self.column_dimensions.items() if dimension.width is not None)
+        for index, width in widths:
+            cols.append('<col min="%d" max="%d" width="%s" customWidth="1"/>' % (index, index, width))
+        self._write('%s<worksheet xmlns="%s" xmlns:r="%s"><sheetPr><outlinePr summaryBelow="1" summaryRight="1"/>'
+                    '</sheetPr>%s%s<sheetData>' % (XML_HEADER, MAIN_NS, REL_NS, sheet_format,
+                                                   '<cols>%s</cols>' % ''.join(cols) if cols else ''))
+
+    def _column_letter(self, index):
+        while len(self.column_letters) <= index:
+            self.column_letters.append(get_column_letter(len(self.column_letters) + 1))
+        return self.column_letters[index]
+
+    def append(self, row):
+        if self.file is None:
+            self._open()
+        self.max_row += 1
+        row_num = str(self.max_row)
+        dimension = self.row_dimensions.get(self.max_row)
+        if dimension is not None and dimension.height is not None:
+            parts = ['<row r="%s" ht="%s" customHeight="1">' % (row_num, dimension.height)]
+        else:
+            parts = ['<row r="%s">' % row_num]
+        get_style_id = self.workbook.get_style_id
+        get_string_index = self.workbook.get_string_index
+        for index, cell in enumerate(row):
+            if cell is None:
+                continue
+            if isinstance(cell, XlsxCell):
+                value, number_format = cell.value, cell.number_format
+            else:
+                value, number_format = cell, 'General'
+            if value is None or value == '':
+                continue
+            value_type = type(value)
+            if value_type is str:
+                data_type = 's'
+                value = get_string_index(ILLEGAL_CHARACTERS_RE.sub('', value[:MAX_STRING_LENGTH]))
+            elif value_type is bool:
+                data_type = 'b'
+                value = int(value)
+            elif value_type is int or value_type is float:
+                if isnan(value) or isinf(value):
+                    continue
+                data_type = 'n'
+                value = '%.16g' % value
+            else:
+                for time_type, time_format in TIME_FORMATS:
+                    if isinstance(value, time_type):
+                        if number_format == 'General':
+                            number_format = time_format
+                        data_type = 'n'
+                        value = '%.16g' % to_excel(value)
+                        break
+                else:
+                    data_type = 's'
+                    value = get_string_index(ILLEGAL_CHARACTERS_RE.sub('', str(value)[:MAX_STRING_LENGTH]))
+            style_id = get_style_id(number_format)
+            if style_id:
+                parts.append('<c r="%s" t="%s" s="%d"><v>%s</v></c>' % (
+                    self._column_letter(index) + row_num, data_type, style_id, value))
+            else:
+                parts.append('<c r="%s" t="%s"><v>%s</v></c>' % (self._column_letter(index) + row_num, data_type, value))
+        parts.append('</row>')
+        self._write(''.join(parts))
+
+    def close(self):
+        if self.file is None:
+            self._open()
+        self._write('</sheetData><pageMargins left="0.75" right="0.75" top="1" bottom="1" header="0.5" footer="0.5"/>'
+                    '</worksheet>')
+        self._flush()
+        self.file.close()
+        self.file = None
+
+
+class XlsxStreamWorkbook(object):
+    """ xlsx writer which streams rows into the zip file of the workbook
+
+    Sheet xml is compressed into the file while rows are appended, instead of building
+    openpyxl cells of the whole sheet. Strings are shared by a table which is built
+    while writing, and the number formats of cells by a table of cell styles. Only one
+    sheet is written at a time, `create_sheet` finishes the previous one. `close` writes
+    the tables and the other parts of the workbook.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.zip_file = ZipFile(filename, 'w', ZIP_DEFLATED, allowZip64=True)
+        self.sheets = []
+        self.strings = {}  # string -> index in shared strings
+        self.string_count = 0
+        self.style_ids = {'General': 0}  # number format -> index of cell style
+        self.number_formats = []  # [(number format id, number format)] of cell styles except the default
+        self.custom_formats = []
+
+    def open_part(self, path):
+        return self.zip_file.open(path, 'w', force_zip64=True)
+
+    def create_sheet(self, title):
+        if self.sheets:
+            self.sheets[-1].close()
+        sheet = XlsxStreamSheet(self, title, 'xl/worksheets/sheet%d.xml' % (len(self.sheets) + 1))
+        self.sheets.append(sheet)
+        return sheet
+
+    def get_string_index(self, value):
+        self.string_count += 1
+        index = self.strings.get(value)
+        if index is None:
+            index = self.strings[value] = len(self.strings)
+        return index
+
+    def get_style_id(self, number_format):
+        style_id = self.style_ids.get(number_format)
+        if style_id is None:
+            format_id = BUILTIN_FORMATS_REVERSE.get(number_format)
+            if format_id is None:
+                format_id = FIRST_CUSTOM_FORMAT_ID + len(self.custom_formats)
+                self.custom_formats.append((format_id, number_format))
+            self.number_formats.append(format_id)
+            style_id = self.style_ids[number_format] = len(self.number_formats)
+        return style_id
+
+    def _write_part(self, path, xml):
+        self.zip_file.writestr(path, XML_HEADER + xml)
+
+    def _shared_strings_xml(self):
+        parts = ['<sst xmlns="%s" count="%d" uniqueCount="%d">' % (MAIN_NS, self.string_count, len(self.strings))]
+        for value in self.strings:
+            if value != value.strip():
+                parts.append('<si><t xml:space="preserve">%s</t></si>' % escape(value))
+            else:
+                parts.append('<si><t>%s</t></si>' % escape(value))
+        parts.append('</sst>')
+        return ''.join(parts)
+
+    def _styles_xml(self):
+        num_fmts = ''
+        if self.custom_formats:
+            num_fmts = '<numFmts count="%d">%s</numFmts>' % (len(self.custom_formats), ''.join(
+                '<numFmt numFmtId="%d" formatCode=%s/>' % (format_id, quoteattr(number_format))
+                for format_id, number_format in self.custom_formats))
+        xfs = ['<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>']
+        for format_id in self.number_formats:
+            xfs.append('<xf numFmtId="%d" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>' % format_id)
+        return (
+            '<styleSheet xmlns="%s">%s'
+            '<fonts count="1"><font><sz val="11"/><color theme="1"/><name val="Calibri"/><family val="2"/>'
+            '<scheme val="minor"/></font></fonts>'
+            '<fills count="2"><fill><patternFill/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+            '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+            '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+            '<cellXfs count="%d">%s</cellXfs>'
+            '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+            '</styleSheet>' % (MAIN_NS, num_fmts, len(xfs), ''.join(xfs)))
+
+    def discard(self):
+        """ close the unfinished workbook and remove its file
+        """
+        for sheet in self.sheets:
+            if sheet.file is not None:
+                sheet.file.close()
+                sheet.file = None
+        self.zip_file.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def close(self):
+        if self.sheets:
+            self.sheets[-1].close()
+        else:
+            self.create_sheet('Sheet').close()
+
+        sheet_count = len(self.sheets)
+        overrides = [
+            ('/xl/workbook.xml', CONTENT_TYPE_PREFIX + 'sheet.main+xml'),
+            ('/xl/styles.xml', CONTENT_TYPE_PREFIX + 'styles+xml'),
+            ('/xl/sharedStrings.xml', CONTENT_TYPE_PREFIX + 'sharedStrings+xml'),
+        ] + [('/' + sheet.path, CONTENT_TYPE_PREFIX + 'worksheet+xml') for sheet in self.sheets]
+        self._write_part('[Content_Types].xml', (
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>%s</Types>' % ''.join(
+                '<Override PartName="%s" ContentType="%s"/>' % item for item in overrides)))
+        self._write_part('_rels/.rels', (
+            '<Relationships xmlns="%s"><Relationship Id="rId1" Type="%s/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>' % (PKG_REL_NS, REL_NS)))
+        self._write_part('xl/workbook.xml', (
+            '<workbook xmlns="%s" xmlns:r="%s"><bookViews><workbookView/></bookViews><sheets>%s</sheets></workbook>' % (
+                MAIN_NS, REL_NS, ''.join('<sheet name=%s sheetId="%d" r:id="rId%d"/>' % (
+                    quoteattr(sheet.title), index, index) for index, sheet in enumerate(self.sheets, 1)))))
+        relationships = ['<Relationship Id="rId%d" Type="%s/worksheet" Target="%s"/>' % (
+            index, REL_NS, os.path.relpath(sheet.path, 'xl')) for index, sheet in enumerate(self.sheets, 1)]
+        relationships.append('<Relationship Id="rId%d" Type="%s/styles" Target="styles.xml"/>' % (
+            sheet_count + 1, REL_NS))
+        relationships.append('<Relationship Id="rId%d" Type="%s/sharedStrings" Target="sharedStrings.xml"/>' % (
+            sheet_count + 2, REL_NS))
+        self._write_part('xl/_rels/workbook.xml.rels', '<Relationships xmlns="%s">%s</Relationships>' % (
+            PKG_REL_NS, ''.join(relationships)))
+        self._write_part('xl/styles.xml', self._styles_xml())
+        self._write_part('xl/sharedStrings.xml', self._shared_strings_xml())
+        self.zip_file.close()
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 from gevent import monkey
-monkey.patch_all()
+# process pool workers are spawned and import this module as __mp_main__, they run
+# CPU-bound tasks and use SIGALRM deadlines in plain threads, so they are not patched
+if __name__ != '__mp_main__':
+    monkey.patch_all()
 
 import argparse
 import logging
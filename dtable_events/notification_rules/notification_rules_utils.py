@@ -2,15 +2,13 @@
 import json
 import logging
 import re
-import time
 from datetime import datetime
 
 from sqlalchemy import text
-import jwt
 import requests
 
 from dtable_events import filter2sql
-from dtable_events.app.config import DTABLE_PRIVATE_KEY, DTABLE_WEB_SERVICE_URL, INNER_DTABLE_DB_URL
+from dtable_events.app.config import DTABLE_WEB_SERVICE_URL, INNER_DTABLE_DB_URL
 from dtable_events.app.metadata_cache_managers import RuleIntentMetadataCacheManger, RuleIntervalMetadataCacheManager
 from dtable_events.notification_rules.utils import get_nickname_by_usernames
 from dtable_events.utils import is_valid_email, uuid_str_to_36_chars, get_inner_dtable_server_url
@@ -18,6 +16,7 @@ from dtable_events.utils.constants import ColumnTypes, FormulaResultType
 from dtable_events.utils.dtable_server_api import DTableServerAPI
 from dtable_events.utils.dtable_web_api import DTableWebAPI
 from dtable_events.utils.dtable_db_api import DTableDBAPI
+from dtable_events.utils.token_cache import get_dtable_access_token
 from dtable_events.notification_rules.message_formatters import create_formatter_params, formatter_map
 
 logger = logging.getLogger(__name__)
@@ -44,16 +43,8 @@ def update_rule_last_trigger_time(rule_id, db_session):
 
 
 def get_dtable_server_token(dtable_uuid):
-    payload = {
-        'exp': int(time.time()) + 60,
-        'dtable_uuid': dtable_uuid,
-        'username': 'dtable-web',
-        'permission': 'rw',
-    }
     try:
-        access_token = jwt.encode(
-            payload, DTABLE_PRIVATE_KEY, algorithm='HS256'
-        )
+        access_token = get_dtable_access_token(dtable_uuid, 'dtable-web', timeout=60)
     except Exception as e:
         logger.error(e)
         return
@@ -0,0 +1,153 @@
+import os
+import random
+import sys
+import time
+import unittest
+from datetime import datetime, time as dt_time
+
+d = os.path.dirname
+sys.path.append(d(d(d(d(os.path.abspath(__file__))))))
+from dtable_events.dtable_io.column_type_guesser import CHECKBOX_STRING_LIST, guess_column_types
+
+
+def guess_column_type_per_column(value_list):
+    """ the former per column type guessing, kept as reference of results and speed
+    """
+    try:
+        type_list = []
+        for cell_value in value_list:
+            if cell_value is None or cell_value == '':
+                continue
+            elif isinstance(cell_value, int) or isinstance(cell_value, float):
+                column_type = 'number'
+            elif isinstance(cell_value, datetime):
+                column_type = 'date'
+            elif isinstance(cell_value, dt_time):
+                column_type = 'text'
+            elif '\n' in cell_value:
+                column_type = 'long-text'
+            elif cell_value in CHECKBOX_STRING_LIST:
+                column_type = 'checkbox'
+            elif (',' in cell_value or '，' in cell_value) \
+                    and ('{' not in cell_value):
+                column_type = 'multiple-select'
+                multiple_value = cell_value.split('，') if '，' in cell_value else cell_value.split(',')
+                for value in multiple_value:
+                    if len(value.strip(' ')) > 20:
+                        column_type = 'text'
+            else:
+                column_type = 'text'
+            type_list.append(column_type)
+
+        max_column_type = max(type_list, key=type_list.count) if type_list else None
+
+        if max_column_type == 'number' and len(set(type_list)) != 1:
+            max_column_type = 'text'
+
+        column_data = None
+        if max_column_type == 'multiple-select':
+            multiple_list = []
+            for cell_value in value_list:
+                if cell_value is None:
+                    continue
+                cell_value = str(cell_value)
+                multiple_value = cell_value.split('，') if '，' in cell_value else cell_value.split(',')
+                for value in multiple_value:
+                    value = value.strip(' ')
+                    if value not in multiple_list:
+                        multiple_list.append(value)
+            column_data = {'options': [{'name': value} for value in multiple_list]}
+
+        return max_column_type, column_data
+    except Exception:
+        return 'text', None
+
+
+def gen_wide_sheet(row_count, column_count, seed=0):
+    rnd = random.Random(seed)
+    options = ['option-%s' % i for i in range(50)]
+    generators = [
+        lambda: rnd.randint(0, 1000),
+        lambda: rnd.random() * 100,
+        lambda: 'text %s' % rnd.randint(0, 1000),
+        lambda: ','.join(rnd.sample(options, 3)),
+        lambda: '，'.join(rnd.sample(options, 2)),
+        lambda: rnd.choice(['yes', 'no']),
+        lambda: 'line 1\nline %s' % rnd.randint(0, 10),
+        lambda: datetime(2023, 1, rnd.randint(1, 28)),
+        lambda: rnd.choice([None, '', 'x']),
+    ]
+    column_generators = [rnd.choice(generators) for _ in range(column_count)]
+    rows = []
+    for _ in range(row_count):
+        row = [generator() for generator in column_generators]
+        # some mixed cells
+        row[rnd.randrange(column_count)] = 'mixed'
+        rows.append(tuple(row))
+    return rows
+
+
+class ColumnTypeGuesserTest(unittest.TestCase):
+
+    def assert_same_as_per_column(self, rows, column_count):
+        expected = [guess_column_type_per_column([row[index] if index < len(row) else None for row in rows])
+                    for index in range(column_count)]
+        self.assertEqual(guess_column_types(rows, column_count), expected)
+
+    def test_types(self):
+        rows = [
+            (1, 'a', 'y', 'a,b', 'x\ny', datetime(2023, 1, 1), dt_time(8, 0), None, 1),
+            (2.5, 'b', 'n', 'b，c', 'z', datetime(2023, 1, 2), None, '', 'a'),
+        ]
+        self.assertEqual(guess_column_types(rows, 9), [
+            ('number', None),
+            ('text', None),
+            ('checkbox', None),
+            ('multiple-select', {'options': [{'name': 'a'}, {'name': 'b'}, {'name': 'c'}]}),
+            ('long-text', None),
+            ('date', None),
+            ('text', None),
+            (None, None),
+            ('text', None),
+        ])
+        self.assert_same_as_per_column(rows, 9)
+
+    def test_ties_and_long_options(self):
+        rows = [('a,b',), ('text',), ('text',), ('c,d',), ('x' * 21 + ',y',)]
+        self.assert_same_as_per_column(rows, 1)
+        self.assertEqual(guess_column_types(rows, 1), [('text', None)])
+        rows = [('a,b',), ('text',)]
+        self.assertEqual(guess_column_types(rows, 1)[0][0], 'multiple-select')
+        self.assert_same_as_per_column(rows, 1)
+
+    def test_short_rows_and_unsupported_values(self):
+        rows = [(1,), (2, 'a'), (3, b'bytes', 'xyz')]
+        self.assertEqual(guess_column_types(rows, 3), [('number', None), ('text', None), ('text', None)])
+        self.assert_same_as_per_column(rows, 3)
+
+    def test_wide_sheet(self):
+        rows = gen_wide_sheet(200, 500)
+        self.assert_same_as_per_column(rows, 500)
+
+
+def benchmark(row_count=200, column_count=500, repeat=3):
+    rows = gen_wide_sheet(row_count, column_count)
+    start = time.time()
+    for _ in range(repeat):
+        for index in range(column_count):
+            guess_column_type_per_column([row[index] for row in rows])
+    per_column_cost = (time.time() - start) / repeat
+    start = time.time()
+    for _ in range(repeat):
+        guess_column_types(rows, column_count)
+    one_pass_cost = (time.time() - start) / repeat
+    print('%d rows x %d columns: per column %.3fs, one pass %.3fs' % (
+        row_count, column_count, per_column_cost, one_pass_cost))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['benchmark']:
+        benchmark(200, 500)
+        benchmark(1000, 500)
+    else:
+        unittest.main()
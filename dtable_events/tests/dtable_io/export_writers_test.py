@@ -0,0 +1,82 @@
+import csv
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from datetime import datetime
+
+d = os.path.dirname
+sys.path.append(d(d(d(d(os.path.abspath(__file__))))))
+from dtable_events.dtable_io import export_writers
+from dtable_events.dtable_io.export_writers import open_export_workbook
+from dtable_events.dtable_io.xlsx_writer import XlsxCell
+
+COLUMNS = [
+    {'name': 'Number', 'type': 'number'},
+    {'name': 'Date', 'type': 'date'},
+    {'name': 'Name', 'type': 'text'},
+    {'name': 'Formula', 'type': 'formula', 'data': {'result_type': 'number'}},
+]
+
+
+def write_rows(wb, rows):
+    ws = wb.create_sheet('sheet')
+    ws.row_dimensions[1].height = 20
+    ws.append([XlsxCell(column['name']) for column in COLUMNS])
+    for row in rows:
+        ws.append([XlsxCell(value) if value is not None else None for value in row])
+    wb.close()
+
+
+class ExportWritersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.rows = [
+            [1, datetime(2023, 1, 2, 3, 4, 5), 'a, "b"\nc', 0.5],
+            [2.5, None, '', 'not a number'],
+        ]
+
+    def tearDown(self):
+        for name in os.listdir(self.tmp_dir):
+            os.remove(os.path.join(self.tmp_dir, name))
+        os.rmdir(self.tmp_dir)
+
+    def test_csv(self):
+        path = os.path.join(self.tmp_dir, 'export.csv')
+        write_rows(open_export_workbook('csv', path, COLUMNS), self.rows)
+        with open(path, newline='', encoding='utf-8') as f:
+            self.assertEqual(list(csv.reader(f)), [
+                ['Number', 'Date', 'Name', 'Formula'],
+                ['1', '2023-01-02 03:04:05', 'a, "b"\nc', '0.5'],
+                ['2.5', '', '', 'not a number'],
+            ])
+
+    @unittest.skipIf(export_writers.pyarrow is None, 'pyarrow is not installed')
+    def test_parquet(self):
+        import pyarrow.parquet
+
+        path = os.path.join(self.tmp_dir, 'export.parquet')
+        with mock.patch.object(export_writers, 'PARQUET_ROW_GROUP_SIZE', 1):
+            write_rows(open_export_workbook('parquet', path, COLUMNS), self.rows)
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        self.assertEqual(parquet_file.metadata.num_row_groups, 2)
+        table = parquet_file.read()
+        self.assertEqual([str(field.type) for field in table.schema], ['double', 'timestamp[us]', 'string', 'double'])
+        self.assertEqual(table.to_pylist(), [
+            {'Number': 1.0, 'Date': datetime(2023, 1, 2, 3, 4, 5), 'Name': 'a, "b"\nc', 'Formula': 0.5},
+            {'Number': 2.5, 'Date': None, 'Name': None, 'Formula': None},
+        ])
+
+    def test_discard(self):
+        for file_type in ('csv', 'xlsx'):
+            path = os.path.join(self.tmp_dir, 'discard.' + file_type)
+            wb = open_export_workbook(file_type, path, COLUMNS, excel_writer='stream')
+            wb.create_sheet('sheet').append([1, 2])
+            wb.discard()
+            self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
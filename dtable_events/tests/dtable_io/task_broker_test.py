@@ -0,0 +1,218 @@
+import configparser
+import os
+import queue
+import sys
+import threading
+import time
+import unittest
+
+import fakeredis
+
+d = os.path.dirname
+sys.path.append(d(d(d(d(os.path.abspath(__file__))))))
+from dtable_events.dtable_io import task_scheduler as task_scheduler_module
+from dtable_events.dtable_io.task_broker import TaskBroker, LEASES_KEY, NODES_KEY
+from dtable_events.dtable_io.task_scheduler import TaskScheduler
+from dtable_events.utils.task_context import check_task_cancelled
+
+
+def get_config(**options):
+    config = configparser.ConfigParser()
+    config.add_section('DTABLE-IO')
+    for key, value in options.items():
+        config.set('DTABLE-IO', key, str(value))
+    return config
+
+
+class TaskBrokerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.config = get_config(task_queue_backend='redis', task_lease_ttl=60, task_max_retries=1)
+        self.node1 = self._create_broker()
+        self.node2 = self._create_broker()
+
+    def _create_broker(self):
+        broker = TaskBroker()
+        broker.init(self.config, connection=fakeredis.FakeRedis(server=self.server, decode_responses=True))
+        return broker
+
+    def test_disabled_by_default(self):
+        broker = TaskBroker()
+        broker.init(get_config())
+        self.assertFalse(broker.enabled)
+        self.assertFalse(broker.has_task('task-1'))
+
+    def test_submit_and_fetch_on_other_node(self):
+        local_config = object()
+        task = (check_task_cancelled, ({'dtable_uuid': 'uuid'}, local_config))
+        self.node1.submit('io', 'task-1', task, owner='uuid', local_args={'config': local_config})
+        self.assertEqual(self.node2.qsize('io'), 1)
+        self.assertTrue(self.node2.has_task('task-1'))
+
+        other_config = object()
+        task_id, payload = self.node2.fetch('io', timeout=1)
+        self.assertEqual(task_id, 'task-1')
+        self.assertEqual(payload['owner'], 'uuid')
+        func, args = self.node2.decode_task(payload, local_args={'config': other_config})
+        self.assertIs(func, check_task_cancelled)
+        self.assertEqual(args, ({'dtable_uuid': 'uuid'}, other_config))
+        self.assertEqual(self.node2.qsize('io'), 0)
+        self.assertIsNotNone(self.node1.connection.zscore(LEASES_KEY, 'task-1'))
+
+        self.node2.finish('task-1')
+        self.assertFalse(self.node1.has_task('task-1'))
+        self.assertIsNone(self.node1.connection.zscore(LEASES_KEY, 'task-1'))
+
+    def test_reject_unknown_task_function(self):
+        with self.assertRaises(ValueError):
+            self.node1.decode_task({'func': 'os:system', 'args': ['ls']})
+
+    def test_cancel_queued_task(self):
+        self.node1.submit('io', 'task-1', (check_task_cancelled, ()))
+        self.node1.cancel('task-1')
+        self.assertEqual(self.node2.qsize('io'), 0)
+        self.assertFalse(self.node2.has_task('task-1'))
+        self.assertIsNone(self.node2.fetch('io', timeout=1))
+
+    def test_cancel_running_task(self):
+        cancelled = []
+        self.node2.cancel_handlers['io'] = cancelled.append
+        self.node1.submit('io', 'task-1', (check_task_cancelled, ()))
+        self.node2.fetch('io', timeout=1)
+        self.node1.cancel('task-1')
+        self.node2.heartbeat()
+        self.assertEqual(cancelled, ['task-1'])
+
+    def test_heartbeat_extends_lease(self):
+        self.node1.submit('io', 'task-1', (check_task_cancelled, ()))
+        self.node2.fetch('io', timeout=1)
+        self.node2.connection.zadd(LEASES_KEY, {'task-1': time.time() - 1})
+        self.node2.heartbeat()
+        self.node1.requeue_expired()
+        self.assertEqual(self.node1.qsize('io'), 0)
+
+    def test_requeue_expired_lease(self):
+        self.node1.submit('io', 'task-1', (check_task_cancelled, ()))
+        self.node2.fetch('io', timeout=1)
+        # node2 dies without heartbeat
+        self.node1.connection.zadd(LEASES_KEY, {'task-1': time.time() - 1})
+        self.node1.requeue_expired()
+        task_id, payload = self.node1.fetch('io', timeout=1)
+        self.assertEqual(task_id, 'task-1')
+        self.assertEqual(payload['retries'], 1)
+
+        # dropped after task_max_retries
+        self.node1.connection.zadd(LEASES_KEY, {'task-1': time.time() - 1})
+        self.node1.requeue_expired()
+        self.assertEqual(self.node1.qsize('io'), 0)
+        self.assertFalse(self.node1.has_task('task-1'))
+
+    def test_requeue_task_of_dead_node(self):
+        self.node1.class_names.add('io')
+        self.node1.submit('io', 'task-1', (check_task_cancelled, ()))
+        # node2 dies after taking the task and before leasing it
+        self.node2.connection.brpoplpush(self.node2._queue_key('io'), self.node2._processing_key('io'), timeout=1)
+        self.node2.connection.zadd(NODES_KEY, {self.node2.node_id: time.time() - 1})
+        self.assertEqual(self.node1.qsize('io'), 0)
+        self.node1.requeue_dead_nodes()
+        self.assertIsNone(self.node1.connection.zscore(NODES_KEY, self.node2.node_id))
+        task_id, _ = self.node1.fetch('io', timeout=1)
+        self.assertEqual(task_id, 'task-1')
+
+    def test_skip_task_queued_again_by_other_node(self):
+        self.node1.class_names.add('io')
+        self.node1.submit('io', 'task-1', (check_task_cancelled, ()))
+        processing_key = self.node2._processing_key('io')
+        self.node2.connection.brpoplpush(self.node2._queue_key('io'), processing_key, timeout=1)
+        # node2 is taken as dead while it is slow
+        self.node2.connection.zadd(NODES_KEY, {self.node2.node_id: time.time() - 1})
+        self.node1.requeue_dead_nodes()
+        self.assertEqual(self.node2.claim_task_script(keys=[processing_key, LEASES_KEY], args=['task-1', time.time()]), 0)
+        self.assertIsNone(self.node1.connection.zscore(LEASES_KEY, 'task-1'))
+        self.assertEqual(self.node1.qsize('io'), 1)
+
+    def test_tasks_fetched_in_submit_order(self):
+        for i in range(3):
+            self.node1.submit('io', 'task-%s' % i, (check_task_cancelled, ()))
+        self.assertEqual([self.node2.fetch('io', timeout=1)[0] for _ in range(3)], ['task-0', 'task-1', 'task-2'])
+
+    def test_dataset_sync_lock(self):
+        token = self.node1.acquire_lock('dataset_sync:1', 60)
+        self.assertTrue(token)
+        self.assertIsNone(self.node2.acquire_lock('dataset_sync:1', 60))
+        self.assertTrue(self.node2.is_locked('dataset_sync:1'))
+        # released by the node running the task with the token
+        self.node2.release_lock('dataset_sync:1', token)
+        self.assertFalse(self.node2.is_locked('dataset_sync:1'))
+
+    def test_release_expired_lock(self):
+        token = self.node1.acquire_lock('dataset_sync:1', 60)
+        # expired and acquired by another task
+        self.node1.connection.delete(self.node1._lock_key('dataset_sync:1'))
+        other_token = self.node2.acquire_lock('dataset_sync:1', 60)
+        self.node1.release_lock('dataset_sync:1', token)
+        self.assertTrue(self.node2.is_locked('dataset_sync:1'))
+        self.node2.release_lock('dataset_sync:1', other_token)
+        self.assertFalse(self.node2.is_locked('dataset_sync:1'))
+
+
+class TaskSchedulerTest(unittest.TestCase):
+
+    def test_remove_task_rejected_by_full_queue(self):
+        tasks_map = {}
+        scheduler = TaskScheduler()
+        scheduler.register('io', tasks_map.pop, workers=1, tasks_map=tasks_map)
+        scheduler.task_classes['io'].queue_size = 1
+        tasks_map['task-1'] = (check_task_cancelled, ())
+        scheduler.get_queue('io').put('task-1')
+        tasks_map['task-2'] = (check_task_cancelled, ())
+        with self.assertRaises(queue.Full):
+            scheduler.get_queue('io').put('task-2')
+        self.assertEqual(list(tasks_map), ['task-1'])
+
+
+class TaskSchedulerWithBrokerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        config = get_config(task_queue_backend='redis', task_lease_ttl=60)
+        self.broker = task_scheduler_module.task_broker
+        self.broker.init(config, connection=fakeredis.FakeRedis(server=self.server, decode_responses=True))
+
+    def tearDown(self):
+        self.broker.enabled = False
+        self.broker.connection = None
+
+    def test_run_remote_tasks(self):
+        tasks_map = {}
+        handled = []
+        done = threading.Event()
+
+        def handle_task(task_id):
+            handled.append((task_id, tasks_map.pop(task_id)))
+            done.set()
+
+        scheduler = TaskScheduler()
+        scheduler.register('io', handle_task, workers=1, tasks_map=tasks_map)
+        scheduler.run()
+
+        tasks_map['task-1'] = (check_task_cancelled, ({'dtable_uuid': 'uuid'},))
+        scheduler.get_queue('io').put('task-1', owner='uuid')
+        # queued in redis instead of locally
+        self.assertNotIn('task-1', tasks_map)
+        self.assertTrue(done.wait(10))
+        self.assertEqual(handled, [('task-1', (check_task_cancelled, ({'dtable_uuid': 'uuid'},)))])
+
+        # finished in task broker
+        for _ in range(50):
+            if not self.broker.has_task('task-1'):
+                break
+            time.sleep(0.1)
+        self.assertFalse(self.broker.has_task('task-1'))
+        self.assertIsNone(self.broker.connection.zscore(LEASES_KEY, 'task-1'))
+        self.assertEqual(self.broker.connection.llen(self.broker._processing_key('io')), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+
+d = os.path.dirname
+sys.path.append(d(d(d(d(os.path.abspath(__file__))))))
+from dtable_events.dtable_io.xlsx_writer import XlsxCell, XlsxStreamWorkbook
+
+NUMBER_FORMATS = ['0', '0.00', '"$"#,##0.00_-', '0.0%', 'YYYY-MM-DD', '"kr"#,##0_-']
+
+
+def gen_rows(row_count):
+    rows = []
+    for i in range(row_count):
+        rows.append([
+            (i, NUMBER_FORMATS[i % len(NUMBER_FORMATS)]),
+            (i / 7, '0.00'),
+            ('text %s' % (i % 100), None),
+            ('  spaces & <xml> "quotes"  ', None),
+            (datetime(2023, 1, 1 + i % 28, 8, 30), 'YYYY-MM-DD HH:mm' if i % 2 else None),
+            (None, None),
+            (i % 2 == 0, None),
+            ('', None),
+            ('long\ntext\x01', None),
+        ])
+    return rows
+
+
+def write_rows(ws, rows, new_cell):
+    ws.sheet_format.defaultRowHeight = 38.4
+    ws.sheet_format.customHeight = True
+    ws.row_dimensions[1].height = 57.6
+    ws.column_dimensions['A'].width = 23.28
+    ws.append([new_cell('head %s' % i) for i in range(len(rows[0]))])
+    for row in rows:
+        cells = []
+        for value, number_format in row:
+            c = new_cell(value)
+            if number_format:
+                c.number_format = number_format
+            cells.append(c)
+        ws.append(cells)
+
+
+def write_openpyxl(path, rows):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('sheet & <1>')
+    write_rows(ws, rows, lambda value: WriteOnlyCell(ws, value=value))
+    wb.save(path)
+
+
+def write_stream(path, rows):
+    wb = XlsxStreamWorkbook(path)
+    ws = wb.create_sheet('sheet & <1>')
+    write_rows(ws, rows, XlsxCell)
+    wb.close()
+
+
+def clean_rows(rows):
+    # openpyxl would refuse the illegal character
+    return [[(value.replace('\x01', '') if isinstance(value, str) else value, number_format)
+             for value, number_format in row] for row in rows]
+
+
+class XlsxWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for name in os.listdir(self.tmp_dir):
+            os.remove(os.path.join(self.tmp_dir, name))
+        os.rmdir(self.tmp_dir)
+
+    def test_same_as_openpyxl(self):
+        rows = gen_rows(200)
+        openpyxl_path = os.path.join(self.tmp_dir, 'openpyxl.xlsx')
+        stream_path = os.path.join(self.tmp_dir, 'stream.xlsx')
+        write_openpyxl(openpyxl_path, clean_rows(rows))
+        write_stream(stream_path, rows)
+
+        expected = load_workbook(openpyxl_path)
+        result = load_workbook(stream_path)
+        self.assertEqual(result.sheetnames, expected.sheetnames)
+        expected_ws, result_ws = expected.worksheets[0], result.worksheets[0]
+        self.assertEqual(result_ws.max_row, expected_ws.max_row)
+        self.assertEqual(result_ws.row_dimensions[1].height, 57.6)
+        self.assertEqual(result_ws.sheet_format.defaultRowHeight, 38.4)
+        self.assertEqual(result_ws.column_dimensions['A'].width, 23.28)
+        for expected_row, result_row in zip(expected_ws.iter_rows(), result_ws.iter_rows()):
+            for expected_cell, result_cell in zip(expected_row, result_row):
+                self.assertEqual(result_cell.value, expected_cell.value)
+                if expected_cell.value is not None:
+                    self.assertEqual(result_cell.number_format, expected_cell.number_format)
+
+    def test_discard(self):
+        path = os.path.join(self.tmp_dir, 'discard.xlsx')
+        wb = XlsxStreamWorkbook(path)
+        ws = wb.create_sheet('sheet')
+        ws.append([1, 'a'])
+        wb.discard()
+        self.assertFalse(os.path.exists(path))
+
+
+def benchmark(row_count=250000):
+    rows = gen_rows(row_count)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, write in (('openpyxl', write_openpyxl), ('stream', write_stream)):
+            start = time.time()
+            write(os.path.join(tmp_dir, name + '.xlsx'), clean_rows(rows))
+            cost = time.time() - start
+            print('%s: %d rows in %.2fs, %d rows/s' % (name, row_count, cost, row_count / cost))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
+    else:
+        unittest.main()
@@ -67,6 +67,16 @@ function run_tests() {
     set -e
     # test sql
     python ${EVENTS_TESTDIR}/sql/sql_test.py
+    # test dtable io task broker
+    python ${EVENTS_TESTDIR}/dtable_io/task_broker_test.py
+    # test column type guessing of excel/csv import
+    python ${EVENTS_TESTDIR}/dtable_io/column_type_guesser_test.py
+    # test streaming xlsx writer of big data export
+    python ${EVENTS_TESTDIR}/dtable_io/xlsx_writer_test.py
+    # test csv and parquet export writers
+    python ${EVENTS_TESTDIR}/dtable_io/export_writers_test.py
+    # test geolocation parsing
+    python ${EVENTS_TESTDIR}/utils/geo_location_parser_test.py
 }
 
 case $1 in
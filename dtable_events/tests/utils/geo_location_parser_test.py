@@ -0,0 +1,113 @@
+import os
+import random
+import sys
+import time
+import unittest
+
+d = os.path.dirname
+sys.path.append(d(d(d(d(os.path.abspath(__file__))))))
+from dtable_events.utils.geo_location_parser import parse_geolocation_from_tree
+
+
+def node(name, children=None):
+    return {'name': name, 'children': children or []}
+
+
+LOCATION_TREE = node('中国', [
+    node('北京市', [node('北京市', [node('东城区'), node('朝阳区'), node('海淀区')])]),
+    node('广东省', [
+        node('广州市', [node('天河区'), node('越秀区')]),
+        node('深圳市', [node('南山区'), node('福田区')]),
+    ]),
+    node('江苏省', [
+        node('南京市', [node('玄武区'), node('鼓楼区')]),
+        node('苏州市', [node('姑苏区'), node('吴中区')]),
+    ]),
+    node('福建省', [node('福州市', [node('鼓楼区'), node('台江区')])]),
+])
+
+
+def gen_location_tree(province_count=34, city_count=12, district_count=10, seed=0):
+    """ a tree about the size of cn-location.json with random names
+    """
+    rnd = random.Random(seed)
+    chars = [chr(code) for code in range(0x4e00, 0x4e00 + 500)]
+
+    def gen_name(suffix):
+        return ''.join(rnd.sample(chars, rnd.randint(1, 3))) + suffix
+
+    return node('中国', [
+        node(gen_name('省'), [
+            node(gen_name('市'), [node(gen_name('区')) for _ in range(district_count)])
+            for _ in range(city_count)
+        ])
+        for _ in range(province_count)
+    ])
+
+
+def gen_addresses(location_tree, count, seed=0):
+    rnd = random.Random(seed)
+    names = []
+    for province in location_tree['children']:
+        for city in province['children']:
+            for district in city['children']:
+                names.append((province['name'], city['name'], district['name']))
+    addresses = []
+    for _ in range(count):
+        province, city, district = rnd.choice(names)
+        # drop province or city sometimes, like addresses users type
+        parts = [part for part in (province, city) if rnd.random() > 0.2] + [district]
+        addresses.append(''.join(parts) + '%s号' % rnd.randint(1, 999))
+    return addresses
+
+
+class GeoLocationParserTest(unittest.TestCase):
+
+    def parse(self, addr_str):
+        return parse_geolocation_from_tree(LOCATION_TREE, addr_str)
+
+    def test_full_address(self):
+        self.assertEqual(self.parse('广东省深圳市南山区科技园1号'), {
+            'province': '广东省', 'city': '深圳市', 'district': '南山区', 'detail': '科技园1号'})
+
+    def test_municipality(self):
+        self.assertEqual(self.parse('北京市海淀区中关村'), {
+            'province': '北京市', 'city': '北京市', 'district': '海淀区', 'detail': '中关村'})
+
+    def test_without_province(self):
+        self.assertEqual(self.parse('深圳南山区'), {
+            'province': '广东省', 'city': '深圳市', 'district': '南山区', 'detail': ''})
+
+    def test_without_city(self):
+        # the first city having the district wins
+        self.assertEqual(self.parse('江苏鼓楼区1号'), {
+            'province': '江苏省', 'city': '南京市', 'district': '鼓楼区', 'detail': '1号'})
+        self.assertEqual(self.parse('鼓楼区1号'), {
+            'province': '江苏省', 'city': '南京市', 'district': '鼓楼区', 'detail': '1号'})
+
+    def test_no_match(self):
+        self.assertEqual(self.parse('火星'), {
+            'province': None, 'city': None, 'district': None, 'detail': '火星'})
+        self.assertEqual(self.parse('广'), {
+            'province': None, 'city': None, 'district': None, 'detail': '广'})
+
+    def test_addresses(self):
+        for addr_str in gen_addresses(LOCATION_TREE, 1000):
+            result = self.parse(addr_str)
+            self.assertTrue(result['district'] and addr_str.endswith(result['detail']), addr_str)
+
+
+def benchmark(count=100000):
+    location_tree = gen_location_tree()
+    addresses = gen_addresses(location_tree, count)
+    start = time.time()
+    for addr_str in addresses:
+        parse_geolocation_from_tree(location_tree, addr_str)
+    print('parse %d addresses: %.3fs' % (count, time.time() - start))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
+    else:
+        unittest.main()
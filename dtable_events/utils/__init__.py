@@ -5,6 +5,7 @@ import logging
 import configparser
 import subprocess
 import uuid
+from functools import lru_cache
 
 import pytz
 import re
@@ -197,7 +198,11 @@ def get_inner_dtable_server_url():
         return DTABLE_SERVER_URL
 
 
+@lru_cache(maxsize=1)
 def get_location_tree_json():
+    """
+    cn-location tree, loaded once per process and shared, never change it
+    """
     import json
     from dtable_events.app.config import dtable_web_dir
     json_path = os.path.join(dtable_web_dir, 'media/geo-data/cn-location.json')
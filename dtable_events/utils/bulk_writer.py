@@ -0,0 +1,125 @@
+import json
+import logging
+import time
+
+from dtable_events.utils.dtable_db_api import Request429Error
+
+logger = logging.getLogger(__name__)
+
+# status codes telling the batch was rejected as a whole and can be sent again in smaller chunks
+RETRY_STATUS_CODES = (413, 429)
+# gateway errors may come after the server committed the batch, only retried for idempotent writes like updates
+IDEMPOTENT_RETRY_STATUS_CODES = RETRY_STATUS_CODES + (502, 503, 504)
+
+
+def get_error_status_code(error):
+    if isinstance(error, Request429Error):
+        return 429
+    if error.args and isinstance(error.args[0], int):
+        return error.args[0]
+    return None
+
+
+class AdaptiveBatchWriter(object):
+    """ Write rows to dtable-server/dtable-db in batches sized by server feedback
+
+    Batch size grows additively while the server answers within `target_latency`
+    and is halved when it is slow or rejects a batch (AIMD). Batches are also
+    capped by estimated payload size. Rejected batches are retried in smaller
+    chunks, and the writer only pauses when the server asks it to slow down.
+
+    :param write_func: callable, write_func(rows), raise error with status code as
+        the first argument (like `ConnectionError(status_code, text)`) to allow retry
+    :param idempotent: bool, whether writing a batch twice is harmless, like updating
+        rows, then batches failed with gateway errors are retried too
+    """
+
+    def __init__(self, write_func, batch_size=1000, min_batch_size=10, max_batch_size=1000,
+                 max_payload_bytes=5 * 1024 * 1024, target_latency=2, max_retries=3, max_pause=5,
+                 idempotent=False):
+        self.write_func = write_func
+        self.retry_status_codes = IDEMPOTENT_RETRY_STATUS_CODES if idempotent else RETRY_STATUS_CODES
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max(max_batch_size, min_batch_size)
+        self.batch_size = min(max(batch_size, self.min_batch_size), self.max_batch_size)
+        self.increase_step = max(self.max_batch_size // 10, 1)
+        self.max_payload_bytes = max_payload_bytes
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.max_pause = max_pause
+
+        self.row_bytes = None
+        self.written_count = 0
+        self.pending_rows = []
+
+    def _estimate_row_bytes(self, rows):
+        sample = rows[:5]
+        return max(len(json.dumps(sample, default=str)) // len(sample), 1)
+
+    def _next_batch_size(self, rows):
+        if self.row_bytes is None:
+            self.row_bytes = self._estimate_row_bytes(rows)
+        payload_limit = max(self.max_payload_bytes // self.row_bytes, self.min_batch_size)
+        return min(self.batch_size, payload_limit)
+
+    def _decrease(self):
+        self.batch_size = max(self.batch_size // 2, self.min_batch_size)
+
+    def _increase(self):
+        self.batch_size = min(self.batch_size + self.increase_step, self.max_batch_size)
+
+    def _write_batch(self, batch):
+        retries = 0
+        while True:
+            start = time.time()
+            try:
+                self.write_func(batch)
+            except Exception as e:
+                status_code = get_error_status_code(e)
+                if status_code not in self.retry_status_codes or retries >= self.max_retries:
+                    raise
+                retries += 1
+                self._decrease()
+                if status_code == 413:
+                    # never grow back to a size the server refused
+                    self.max_batch_size = max(min(self.max_batch_size, len(batch) // 2), self.min_batch_size)
+                    self.batch_size = min(self.batch_size, self.max_batch_size)
+                logger.warning('batch of %s rows rejected with status %s, retry with batch size %s',
+                               len(batch), status_code, self.batch_size)
+                if status_code != 413:
+                    time.sleep(min(2 ** retries, self.max_pause))
+                chunk_size = self.batch_size
+                if len(batch) > chunk_size:
+                    # send the rejected batch again in smaller chunks
+                    for i in range(0, len(batch), chunk_size):
+                        self._write_batch(batch[i: i + chunk_size])
+                    return
+                continue
+
+            latency = time.time() - start
+            self.written_count += len(batch)
+            if latency > self.target_latency:
+                self._decrease()
+                # give the server as much time as the slow batch took
+                time.sleep(min(latency, self.max_pause))
+            else:
+                self._increase()
+            return
+
+    def write(self, rows):
+        offset = 0
+        while offset < len(rows):
+            rest_rows = rows[offset:]
+            batch_size = self._next_batch_size(rest_rows)
+            batch = rest_rows[:batch_size]
+            self._write_batch(batch)
+            offset += len(batch)
+
+    def add(self, row):
+        self.pending_rows.append(row)
+        if len(self.pending_rows) >= self._next_batch_size(self.pending_rows):
+            self.flush()
+
+    def flush(self):
+        rows, self.pending_rows = self.pending_rows, []
+        self.write(rows)
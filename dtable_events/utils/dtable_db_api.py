@@ -1,11 +1,13 @@
 import json
 import logging
 import requests
-import jwt
-import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from dtable_events.app.config import DTABLE_PRIVATE_KEY
+from dtable_events.app.config import DTABLE_DB_QUERY_PREFETCH_DEPTH
 from dtable_events.utils import uuid_str_to_36_chars
+from dtable_events.utils.task_context import check_task_cancelled
+from dtable_events.utils.token_cache import get_dtable_access_token
 
 logger = logging.getLogger(__name__)
 
@@ -129,6 +131,43 @@ def convert_db_rows(metadata, results):
     return converted_results
 
 
+def prefetch_pages(fetch_page, starts, depth=None):
+    """ Fetch pages in background threads and yield them in order
+
+    Keep at most `depth` pages in flight, so that fetching the next pages over
+    HTTP overlaps with processing the current one in the caller.
+
+    :param fetch_page: callable, fetch_page(start) -> page
+    :param starts: iterable of page starts, may be infinite
+    :param depth: int, number of pages fetched ahead
+    :return: generator of (start, page)
+    """
+    depth = max(int(depth or DTABLE_DB_QUERY_PREFETCH_DEPTH), 1)
+    starts = iter(starts)
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=depth)
+
+    def submit_next():
+        for start in starts:
+            pending.append((start, executor.submit(fetch_page, start)))
+            return
+
+    try:
+        for _ in range(depth):
+            submit_next()
+        while pending:
+            start, future = pending.popleft()
+            page = future.result()
+            check_task_cancelled()
+            submit_next()
+            yield start, page
+    finally:
+        # caller may stop early, drop pages not fetched yet
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
 class DTableDBAPI(object):
 
     def __init__(self, username, dtable_uuid, dtable_db_url):
@@ -143,18 +182,7 @@ class DTableDBAPI(object):
         self.headers = {'Authorization': 'Token ' + access_token}
 
     def get_dtable_db_token(self):
-        token = jwt.encode(
-            payload={
-                'exp': int(time.time()) + 3600 * 12 * 24,
-                'dtable_uuid': self.dtable_uuid,
-                'username': self.username,
-                'permission': 'rw',
-            },
-            key=DTABLE_PRIVATE_KEY
-        )
-        if isinstance(token, bytes):
-            token = token.decode()
-        return token
+        return get_dtable_access_token(self.dtable_uuid, self.username, timeout=3600 * 12 * 24)
 
     def query(self, sql, convert=True, server_only=True):
         """
@@ -190,7 +218,7 @@ class DTableDBAPI(object):
         resp = requests.post(api_url, json=params, headers=self.headers, timeout=TIMEOUT)
         if not resp.status_code == 200:
             logger.error('error insert rows resp: %s', resp.text)
-            raise RowInsertedError
+            raise RowInsertedError(resp.status_code)
         return resp.json()
 
     def batch_update_rows(self, table_name, rows_data):
@@ -205,7 +233,7 @@ class DTableDBAPI(object):
         }
         resp = requests.put(url, json=json_data, headers=self.headers, timeout=TIMEOUT)
         if not resp.status_code == 200:
-            raise RowUpdatedError
+            raise RowUpdatedError(resp.status_code)
         return resp.json()
 
     def batch_delete_rows(self, table_name, row_ids):
@@ -3,13 +3,16 @@ import logging
 import requests
 import io
 import os
+import time
+from threading import Event, Lock
 from urllib import parse
 from uuid import UUID
 from datetime import datetime
 from seaserv import seafile_api
 from dtable_events.dtable_io.utils import get_dtable_server_token
-from dtable_events.app.config import INNER_FILE_SERVER_ROOT
+from dtable_events.app.config import INNER_FILE_SERVER_ROOT, METADATA_REQUEST_FRESH_SECONDS
 from dtable_events.utils import uuid_str_to_36_chars
+from dtable_events.utils.http_compression import compress_json_body
 
 logger = logging.getLogger(__name__)
 
@@ -80,6 +83,70 @@ def gen_inner_file_upload_url(token, op, replace=False):
     return url
 
 
+class _SingleFlightCall(object):
+
+    def __init__(self):
+        self.event = Event()
+        self.result = None
+        self.error = None
+        self.finished_at = None
+
+
+class SingleFlight(object):
+    """ Coalesce concurrent calls with the same key into one call
+
+    Callers arriving while a call is in flight wait for it and share its
+    result. With `fresh_seconds`, a finished result is also shared with
+    callers arriving within that window, if `is_fresh_result` accepts it.
+    """
+
+    def __init__(self, fresh_seconds=0):
+        self.fresh_seconds = fresh_seconds
+        self.calls = {}
+        self.lock = Lock()
+
+    def _is_fresh(self, call, now):
+        return call.finished_at is None or now - call.finished_at < self.fresh_seconds
+
+    def do(self, key, func, is_fresh_result=None):
+        now = time.time()
+        with self.lock:
+            call = self.calls.get(key)
+            is_leader = call is None or not self._is_fresh(call, now)
+            if is_leader:
+                if self.fresh_seconds > 0:
+                    self.calls = {k: c for k, c in self.calls.items() if self._is_fresh(c, now)}
+                call = _SingleFlightCall()
+                self.calls[key] = call
+
+        if not is_leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        keep = self.fresh_seconds > 0
+        try:
+            call.result = func()
+            if is_fresh_result is not None and not is_fresh_result(call.result):
+                keep = False
+        except BaseException as e:
+            # like gevent Timeout, waiters must not take the missing result as None
+            call.error = e
+            keep = False
+            raise
+        finally:
+            call.finished_at = time.time()
+            with self.lock:
+                if not keep and self.calls.get(key) is call:
+                    self.calls.pop(key)
+            call.event.set()
+        return call.result
+
+
+metadata_single_flight = SingleFlight(fresh_seconds=METADATA_REQUEST_FRESH_SECONDS)
+
+
 class DTableServerAPI(object):
     # simple version of python sdk without authorization for base or table manipulation
 
@@ -106,7 +173,13 @@ class DTableServerAPI(object):
 
     def get_metadata(self):
         url = self.dtable_server_url + '/api/v1/dtables/' + self.dtable_uuid + '/metadata/?from=dtable_events'
-        response = requests.get(url, headers=self.headers, timeout=self.timeout)
+        # concurrent callers of the same base and user share one request, each parses its own copy,
+        # failed responses are not shared with later callers
+        response = metadata_single_flight.do(
+            (self.dtable_server_url, self.dtable_uuid, self.username),
+            lambda: requests.get(url, headers=self.headers, timeout=self.timeout),
+            is_fresh_result=lambda response: response.ok
+        )
         data = parse_response(response)
         return data.get('metadata')
 
@@ -228,7 +301,8 @@ class DTableServerAPI(object):
         }
         if need_convert_back is not None:
             json_data['need_convert_back'] = need_convert_back
-        response = requests.post(url, json=json_data, headers=self.headers, timeout=self.timeout)
+        data, headers = compress_json_body(json_data, self.headers)
+        response = requests.post(url, data=data, headers=headers, timeout=self.timeout)
         return parse_response(response)
 
     def append_row(self, table_name, row_data, apply_default=None):
@@ -263,7 +337,8 @@ class DTableServerAPI(object):
         }
         if need_convert_back is not None:
             json_data['need_convert_back'] = need_convert_back
-        response = requests.put(url, json=json_data, headers=self.headers, timeout=self.timeout)
+        data, headers = compress_json_body(json_data, self.headers)
+        response = requests.put(url, data=data, headers=headers, timeout=self.timeout)
         return parse_response(response)
 
     def add_column_options(self, table_name, column_name, options):
@@ -1,6 +1,8 @@
 import uuid
 import requests
 
+from dtable_events.utils.http_compression import compress_body
+
 try:
     from seahub.settings import DTABLE_STORAGE_SERVER_URL
 except ImportError as err:
@@ -65,7 +67,8 @@ class DTableStorageServerAPI(object):
     def save_dtable(self, dtable_uuid, json_string):
         dtable_uuid = uuid_str_to_36_chars(dtable_uuid)
         url = self.server_url + '/dtables/' + dtable_uuid
-        response = requests.put(url, data=json_string, timeout=TIMEOUT)
+        data, headers = compress_body(json_string)
+        response = requests.put(url, data=data, headers=headers, timeout=TIMEOUT)
         data = parse_response(response)
         return data
 
@@ -1,259 +1,220 @@
-MUNICIPALITY = ['北京市', '天津市', '上海市', '重庆市', '香港', '澳门']
-
-init_province = None
-init_city = None
+import threading
 
+MUNICIPALITY = ['北京市', '天津市', '上海市', '重庆市', '香港', '澳门']
 
-def get_province(addr_str, location_tree):
-    if len(addr_str) < 2:
-        return {
-            'province': '',
-            'city': '',
-            'district': '',
-            'detail': '',
-        }
 
-    start, end = 0, 2
-    sub_province = addr_str[start: end]
-    province = {}
-    while len(sub_province) == 2:
-        children = location_tree.get('children')
-        for province_item in children:
-            province_item_name = province_item.get('name')
-            if province_item_name.find(sub_province) == 0:
-                province = province_item
-                break
+def _index_by_prefix(items):
+    """ first item of every two characters name prefix """
+    index = {}
+    for item in items:
+        index.setdefault(item.get('name')[:2], item)
+    return index
+
+
+def _match_window(addr_str, prefix_index):
+    """ first two characters window of addr_str which is a name prefix in prefix_index
+    """
+    for start in range(len(addr_str) - 1):
+        item = prefix_index.get(addr_str[start: start + 2])
+        if item:
+            return start, item
+    return None, None
+
+
+def _match_end(addr_str, start, name):
+    end = start + 2
+    while addr_str[start: end] in name and end <= len(addr_str):
+        end += 1
+    return end
+
+
+class LocationIndex(object):
+    """ Indexes of a cn-location tree to parse geolocation strings
+
+    Provinces, cities and districts are matched by their first two characters against
+    the two characters windows of an address. Every window is looked up in a dict of
+    name prefixes instead of scanning the children of the tree, so parsing costs about
+    O(len(address)). Indexes of cities and districts are built on first use.
+    """
+
+    def __init__(self, location_tree):
+        self.provinces = location_tree.get('children')
+        self.province_prefixes = _index_by_prefix(self.provinces)
+        self.city_prefixes = {}  # id(province) -> prefix -> first city
+        self.district_prefixes = {}  # id(city) -> prefix -> first district
+        # prefix -> [(city index, city, first district of the city)]
+        self.province_district_prefixes = {}  # id(province) -> prefix index
+        # prefix -> [((province index, city index), province, city, first district of the city)]
+        self.tree_district_prefixes = None
+        # city name of at most two characters -> {province index: (city index, city)}
+        self.short_city_names = None
+
+    def _get_city_prefixes(self, province):
+        prefixes = self.city_prefixes.get(id(province))
+        if prefixes is None:
+            prefixes = _index_by_prefix(province.get('children'))
+            self.city_prefixes[id(province)] = prefixes
+        return prefixes
+
+    def _get_district_prefixes(self, city):
+        prefixes = self.district_prefixes.get(id(city))
+        if prefixes is None:
+            prefixes = _index_by_prefix(city.get('children'))
+            self.district_prefixes[id(city)] = prefixes
+        return prefixes
+
+    def _get_province_district_prefixes(self, province):
+        prefixes = self.province_district_prefixes.get(id(province))
+        if prefixes is None:
+            prefixes = {}
+            for city_index, city in enumerate(province.get('children')):
+                for prefix, district in self._get_district_prefixes(city).items():
+                    prefixes.setdefault(prefix, []).append((city_index, city, district))
+            self.province_district_prefixes[id(province)] = prefixes
+        return prefixes
+
+    def _get_tree_district_prefixes(self):
+        if self.tree_district_prefixes is None:
+            prefixes = {}
+            for province_index, province in enumerate(self.provinces):
+                for city_index, city in enumerate(province.get('children')):
+                    for prefix, district in self._get_district_prefixes(city).items():
+                        prefixes.setdefault(prefix, []).append(((province_index, city_index), province, city, district))
+            self.tree_district_prefixes = prefixes
+        return self.tree_district_prefixes
+
+    def _get_short_city_names(self):
+        if self.short_city_names is None:
+            names = {}
+            for province_index, province in enumerate(self.provinces):
+                for city_index, city in enumerate(province.get('children')):
+                    name = city.get('name')
+                    if len(name) <= 2:
+                        names.setdefault(name, {}).setdefault(province_index, (city_index, city))
+            self.short_city_names = names
+        return self.short_city_names
+
+    def get_province(self, addr_str):
+        start, province = _match_window(addr_str, self.province_prefixes)
         if province:
-            break
-        start+=1
-        end+=1
-        sub_province = addr_str[start: end]
-
-    if province:
-        province_name = province.get('name')
-
-        while addr_str[start: end] in province_name and end <= len(addr_str):
-            end += 1
-        return {
-            'province': province,
-            'string': addr_str[end-1:],
-        }
-    return {
-        'province': province,
-        'string': addr_str[0:]
-    }
-
-def get_city(province, addr_str, location_tree):
-    city, start, end = {}, 0, 2
-    if len(addr_str) == 0:
-        return {
-            'province': province,
-            'city': '',
-            'district': '',
-            'detail': ''
-        }
-    sub_city = addr_str[start: end]
-    if province:
-        if province.get('name') in MUNICIPALITY:
-            city = province.get('children')[0]
-            name = city.get('name')
-            if sub_city not in name:
-                return {
-                    'province': province,
-                    'city': city,
-                    'string': addr_str[start:]
-                }
-            while addr_str[start:end] in name and end <= len(addr_str):
-                end += 1
-            return {
-                'province': province,
-                'city': city,
-                'string': addr_str[end-1:]
-            }
-
-        while len(sub_city) == 2:
-            children = province.get('children')
-            for item in children:
-                item_name = item.get('name')
-                if item_name.find(sub_city) == 0:
-                    city = item
-                    break
-
-            if city:
-                break
-            start += 1
-            end += 1
-            sub_city = addr_str[start: end]
-
-        if city:
-            city_name = city.get('name')
-            while addr_str[start:end] in city_name and end <= len(addr_str):
-                end += 1
-            return {
-                'province': province,
-                'city': city,
-                'string': addr_str[end-1:]
-            }
-        return {
-            'province': province,
-            'city': city,
-            'string': addr_str,
-        }
-    else:
-        city, new_province = {}, {}
-        while len(sub_city) == 2:
-            location_children = location_tree.get('children')
-            for province_item in location_children:
-                province_children = province_item.get('children')
-                for city_item in province_children:
-                    city_name = city_item.get('name')
-                    if sub_city.find(city_name) == 0:
-                        city = city_item
-                        new_province = province_item
-                        break
-
+            end = _match_end(addr_str, start, province.get('name'))
+            return province, addr_str[end-1:]
+        return {}, addr_str
+
+    def get_city(self, province, addr_str):
+        """
+        :return: (province, city, rest of addr_str)
+        """
+        if len(addr_str) == 0:
+            return province, '', ''
+        if province:
+            if province.get('name') in MUNICIPALITY:
+                city = province.get('children')[0]
+                name = city.get('name')
+                if addr_str[0: 2] not in name:
+                    return province, city, addr_str
+                end = _match_end(addr_str, 0, name)
+                return province, city, addr_str[end-1:]
+
+            start, city = _match_window(addr_str, self._get_city_prefixes(province))
             if city:
-                break
-
-            start += 1
-            end += 1
-            sub_city = addr_str[start: end]
-
-        if city:
-            city_name = city.get('name')
-            while addr_str[start:end] in city_name and end <= len(addr_str):
-                end += 1
-            return {
-                'province': new_province,
-                'city': city,
-                'string': addr_str[end-1:]
-
-            }
+                end = _match_end(addr_str, start, city.get('name'))
+                return province, city, addr_str[end-1:]
+            return province, {}, addr_str
+
+        # without province, a city matches if its name is a prefix of a window, the
+        # first such city of the last such province wins
+        short_city_names = self._get_short_city_names()
+        for start in range(len(addr_str) - 1):
+            sub_city = addr_str[start: start + 2]
+            matched = {}
+            for name in ('', sub_city[:1], sub_city):
+                for province_index, (city_index, city) in short_city_names.get(name, {}).items():
+                    if province_index not in matched or city_index < matched[province_index][0]:
+                        matched[province_index] = (city_index, city)
+            if matched:
+                province_index = max(matched)
+                city = matched[province_index][1]
+                end = _match_end(addr_str, start, city.get('name'))
+                return self.provinces[province_index], city, addr_str[end-1:]
+        return province, {}, addr_str
+
+    def _match_first_city_district(self, addr_str, prefix_entries):
+        """ district of the first city (in tree order) having a district matching any window,
+        matched by the first window of that city
+        """
+        matched = {}
+        for start in range(len(addr_str) - 1):
+            for entry in prefix_entries.get(addr_str[start: start + 2], []):
+                matched.setdefault(entry[0], (start, entry))
+        if not matched:
+            return None, None
+        return matched[min(matched)]
+
+    def get_district(self, province, city, addr_str):
+        """
+        :return: (province, city, district, rest of addr_str), province and city are the
+        given ones if no district matches
+        """
+        if not addr_str:
+            return province, city, '', ''
+
+        if province and city:
+            start, district = _match_window(addr_str, self._get_district_prefixes(city))
+        elif province:
+            if not province.get('children'):
+                return province, city, '', ''
+            start, entry = self._match_first_city_district(addr_str, self._get_province_district_prefixes(province))
+            if entry:
+                _, city, district = entry
         else:
+            if not any(item.get('children') for item in self.provinces):
+                return None, city, None, ''
+            start, entry = self._match_first_city_district(addr_str, self._get_tree_district_prefixes())
+            if entry:
+                _, province, city, district = entry
+        if start is None:
+            return province, city, {}, addr_str
+
+        end = _match_end(addr_str, start, district.get('name'))
+        return province, city, district, addr_str[end-1:]
+
+    def parse(self, addr_str):
+        if len(addr_str) < 2:
             return {
-                'province': province,
-                'city': city,
-                'string': addr_str
-
-            }
-
-def get_district(province, city, addr_str, location_tree):
-    if not addr_str:
-        return {
-            'province': province,
-            'city': city,
-            'district': '',
-            'detail': ''
-        }
-
-    start, end, district = 0, 2, {}
-    sub_district = addr_str[start:end]
-
-    if province:
-        if city:
-            while len(sub_district) == 2:
-                city_children = city.get('children')
-                for district_item  in city_children:
-                    district_name = district_item.get('name')
-                    if district_name.find(sub_district) == 0:
-                        district = district_item
-                        break
-
-                if district:
-                    break
-
-                start+=1
-                end+=1
-                sub_district = addr_str[start:end]
-
-            if district:
-                district_name = district.get('name')
-                while addr_str[start:end] in district_name and end <= len(addr_str):
-                    end += 1
-                return {
-                    'province': province,
-                    'city': city,
-                    'district': district,
-                    'string': addr_str[end-1:]
-                }
-            else:
-                return {
-                    'province': init_province,
-                    'city': init_city,
-                    'district': district,
-                    'string': addr_str
-                }
-        else:
-            result = {
-                'province': province,
-                'city': city,
-                'district': ''
+                'province': None,
+                'city': None,
+                'district': None,
+                'detail': addr_str
             }
 
-            province_children = province.get('children')
-
-            for index in range(len(province_children)):
-                city = province_children[index]
-                result = get_district(province, city, addr_str, location_tree)
-                if result.get('district'):
-                    break
-
-            return result
-
-    else:
-        result = {
-            'provice': province,
-            'city': city,
-        }
-        provinces = location_tree.get('children')
-        for province_index in range(len(provinces)):
-            target_province = provinces[province_index]
-            cities = target_province.get('children')
-            for city_index in range(len(cities)):
-                result = get_district(target_province, cities[city_index], addr_str, location_tree)
-                if result.get('district'):
-                    break
-
-            if result.get('district'):
-                break
+        province, string = self.get_province(addr_str)
+        province, city, string = self.get_city(province, string)
+        province, city, district, string = self.get_district(province, city, string)
 
-        return result
-
-def parse_geolocation_from_tree(location_tree, addr_str):
-
-    global  init_province, init_city
-    if len(addr_str) < 2:
         return {
-            'province': None,
-            'city': None,
-            'district': None,
-            'detail': addr_str
+            'province': province and province.get('name') or None,
+            'city': city and city.get('name') or None,
+            'district': district and district.get('name') or None,
+            'detail': string or ''
         }
 
-    string = addr_str
-    province_result = get_province(string, location_tree)
-    province = province_result.get('province')
-    string = province_result.get('string')
 
-    city_result = get_city(province, string, location_tree)
-    province = city_result.get('province')
-    city = city_result.get('city')
-    string = city_result.get('string')
+_location_index = None
+_location_index_lock = threading.Lock()
 
-    init_province = province
-    init_city = city
 
-    district_result = get_district(province, city, string, location_tree)
-    district = district_result.get('district')
-    province = district_result.get('province')
-    city = district_result.get('city')
-    string = district_result.get('string')
+def get_location_index(location_tree):
+    global _location_index
+    location_index = _location_index
+    if location_index is None or location_index[0] is not location_tree:
+        with _location_index_lock:
+            location_index = _location_index
+            if location_index is None or location_index[0] is not location_tree:
+                location_index = (location_tree, LocationIndex(location_tree))
+                _location_index = location_index
+    return location_index[1]
 
 
-    return {
-        'province': province and province.get('name') or None,
-        'city': city and city.get('name') or None,
-        'district': district and district.get('name') or None,
-        'detail': string or ''
-    }
-
+def parse_geolocation_from_tree(location_tree, addr_str):
+    return get_location_index(location_tree).parse(addr_str)
@@ -0,0 +1,60 @@
+import gzip
+import json
+import logging
+
+from urllib3.util.request import ACCEPT_ENCODING
+
+from dtable_events.app.config import REQUEST_BODY_COMPRESSION, REQUEST_BODY_COMPRESSION_MIN_SIZE
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+def get_body_encoding():
+    encoding = (REQUEST_BODY_COMPRESSION or '').lower()
+    if encoding == 'zstd' and zstandard is None:
+        logger.warning('zstandard is not installed, compress request body with gzip')
+        return 'gzip'
+    if encoding in ('gzip', 'zstd'):
+        return encoding
+    return None
+
+
+def compress_body(body, headers=None):
+    """ Compress request body if compression is enabled and body is big enough
+
+    :param body: bytes or str
+    :param headers: dict, request headers, not modified
+    :return: (body, headers)
+    """
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    headers = dict(headers or {})
+    # let servers answer with any encoding the http client can decode
+    headers['Accept-Encoding'] = ACCEPT_ENCODING
+
+    encoding = get_body_encoding()
+    if not encoding or len(body) < REQUEST_BODY_COMPRESSION_MIN_SIZE:
+        return body, headers
+
+    if encoding == 'zstd':
+        body = zstandard.ZstdCompressor().compress(body)
+    else:
+        body = gzip.compress(body, compresslevel=6)
+    headers['Content-Encoding'] = encoding
+    return body, headers
+
+
+def compress_json_body(json_data, headers=None):
+    """ Serialize json data like `requests` does, then compress it
+
+    :return: (body, headers), send with `data=body, headers=headers`
+    """
+    body = json.dumps(json_data, allow_nan=False)
+    headers = dict(headers or {})
+    headers['Content-Type'] = 'application/json'
+    return compress_body(body, headers)
@@ -1,5 +1,3 @@
-import jwt
-import time
 import logging
 import requests
 import re
@@ -7,11 +5,12 @@ from datetime import datetime, timedelta
 
 from dateutil.relativedelta import relativedelta
 
-from dtable_events.app.config import DTABLE_PRIVATE_KEY, INNER_DTABLE_DB_URL
+from dtable_events.app.config import INNER_DTABLE_DB_URL
 from dtable_events.utils import uuid_str_to_36_chars
 from dtable_events.utils.constants import FilterPredicateTypes, FormulaResultType, FilterTermModifier, ColumnTypes, \
     DurationFormatsType, StatisticType, MapLevel, GeolocationGranularity, MUNICIPALITIES
 from dtable_events.utils.dtable_column_utils import is_numeric_column, is_date_column
+from dtable_events.utils.token_cache import get_dtable_access_token
 
 logger = logging.getLogger(__name__)
 
@@ -2351,17 +2350,7 @@ def filter2sql(table_name, columns, filter_conditions, by_group=False):
 
 def db_query(dtable_uuid, sql):
     dtable_uuid = uuid_str_to_36_chars(dtable_uuid)
-    token = jwt.encode(
-        payload={
-            'exp': int(time.time()) + 300,
-            'dtable_uuid': dtable_uuid,
-            'username': 'Automation Rule',
-            'permission': 'rw',
-        },
-        key=DTABLE_PRIVATE_KEY
-    )
-    if isinstance(token, bytes):
-        token = token.decode()
+    token = get_dtable_access_token(dtable_uuid, 'Automation Rule', timeout=300)
 
     headers = {'Authorization': 'Token ' + token}
     api_url = INNER_DTABLE_DB_URL.rstrip('/') + '/api/v1/query/' + dtable_uuid + '/?from=dtable_events'
@@ -0,0 +1,114 @@
+import logging
+import os
+import shutil
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_progress_queue = None  # set in process pool workers
+_progress_handler = None  # set in dtable-events process
+
+
+class TaskCancelledError(Exception):
+    pass
+
+
+class CancellationToken(object):
+    """ Cooperative cancellation of a running dtable io task
+
+    Tasks call `check_task_cancelled()` in their paging/waiting loops, which raises
+    TaskCancelledError once the token is cancelled or its deadline has passed.
+    """
+
+    def __init__(self, timeout=None):
+        self.deadline = time.time() + timeout if timeout else None
+        self.reason = None
+        self.tmp_paths = []
+
+    def cancel(self, reason='Task cancelled'):
+        if not self.reason:
+            self.reason = reason
+
+    @property
+    def is_cancelled(self):
+        if not self.reason and self.deadline and time.time() > self.deadline:
+            self.reason = 'Task timeout'
+        return bool(self.reason)
+
+    def check(self):
+        if self.is_cancelled:
+            raise TaskCancelledError(self.reason)
+
+    def add_tmp_path(self, path):
+        self.tmp_paths.append(path)
+
+    def clear_tmp_paths(self):
+        tmp_paths, self.tmp_paths = self.tmp_paths, []
+        for path in tmp_paths:
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.exists(path):
+                    os.remove(path)
+            except Exception as e:
+                logger.warning('remove tmp path %s error: %s', path, e)
+
+
+def set_progress_queue(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+def set_progress_handler(progress_handler):
+    global _progress_handler
+    _progress_handler = progress_handler
+
+
+def run_task(task_id, func, args, token=None):
+    """ run task function with task_id and cancellation token bound to current thread
+    """
+    _local.task_id = task_id
+    _local.token = token
+    try:
+        return func(*args)
+    except TaskCancelledError:
+        if token:
+            token.clear_tmp_paths()
+        raise
+    finally:
+        _local.task_id = None
+        _local.token = None
+
+
+def get_task_token():
+    return getattr(_local, 'token', None)
+
+
+def check_task_cancelled():
+    token = get_task_token()
+    if token:
+        token.check()
+
+
+def register_task_tmp_path(path):
+    """ remove `path` if the current task is cancelled or times out
+    """
+    token = get_task_token()
+    if token:
+        token.add_tmp_path(path)
+
+
+def report_task_progress(progress):
+    """ Report progress of the current dtable io task, e.g. {'step': 'zip'}
+
+    Works both in task threads and in process pool workers.
+    """
+    task_id = getattr(_local, 'task_id', None)
+    if not task_id:
+        return
+    if _progress_queue is not None:
+        _progress_queue.put((task_id, progress))
+    elif _progress_handler:
+        _progress_handler(task_id, progress)
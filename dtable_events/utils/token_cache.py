@@ -0,0 +1,97 @@
+import time
+from threading import Lock
+
+import jwt
+
+from dtable_events.app.config import DTABLE_PRIVATE_KEY
+
+
+class TokenCache(object):
+    """ Cache signed dtable-server/dtable-db access tokens
+
+    A token is issued valid for the requested timeout plus a reuse window of at
+    most `max_reuse_seconds`, and handed out only while it is still valid for
+    the requested timeout (minus `skew_seconds`), so long tasks keep the token
+    lifetime they asked for.
+    """
+
+    def __init__(self, max_size=10000, max_reuse_seconds=600, skew_seconds=5):
+        self.tokens = {}  # key -> (token, exp)
+        self.max_size = max_size
+        self.max_reuse_seconds = max_reuse_seconds
+        self.skew_seconds = skew_seconds
+        self.lock = Lock()
+
+    def _is_usable(self, exp, timeout, now):
+        return exp - now >= timeout - self.skew_seconds
+
+    def get_token(self, dtable_uuid, username, permission='rw', timeout=300, is_internal=False):
+        key = (dtable_uuid, username, permission, timeout, is_internal)
+        now = time.time()
+        with self.lock:
+            cached = self.tokens.get(key)
+            if cached and self._is_usable(cached[1], timeout, now):
+                return cached[0]
+
+        exp = int(now) + timeout + min(timeout, self.max_reuse_seconds)
+        payload = {
+            'exp': exp,
+            'dtable_uuid': dtable_uuid,
+            'username': username,
+            'permission': permission,
+        }
+        if is_internal:
+            payload['is_internal'] = True
+        token = jwt.encode(payload, DTABLE_PRIVATE_KEY, algorithm='HS256')
+        if isinstance(token, bytes):
+            token = token.decode()
+
+        with self.lock:
+            if len(self.tokens) >= self.max_size:
+                self.tokens = {k: v for k, v in self.tokens.items() if self._is_usable(v[1], k[3], now)}
+                if len(self.tokens) >= self.max_size:
+                    self.tokens.clear()
+            self.tokens[key] = (token, exp)
+        return token
+
+
+class VerifiedTokenCache(object):
+    """ Cache payloads of verified tokens until they expire
+
+    Status endpoints are polled with the same token many times, only the first
+    request of a token pays for the signature check.
+    """
+
+    def __init__(self, max_size=10000, max_age=300):
+        self.payloads = {}  # token -> (payload, expire_at)
+        self.max_size = max_size
+        self.max_age = max_age
+        self.lock = Lock()
+
+    def verify(self, token, key, algorithms=('HS256',)):
+        now = time.time()
+        with self.lock:
+            cached = self.payloads.get(token)
+            if cached and cached[1] > now:
+                return cached[0]
+
+        payload = jwt.decode(token, key, algorithms=list(algorithms))
+        expire_at = now + self.max_age
+        if isinstance(payload.get('exp'), (int, float)):
+            expire_at = min(payload['exp'], expire_at)
+
+        with self.lock:
+            if len(self.payloads) >= self.max_size:
+                self.payloads = {k: v for k, v in self.payloads.items() if v[1] > now}
+                if len(self.payloads) >= self.max_size:
+                    self.payloads.clear()
+            self.payloads[token] = (payload, expire_at)
+        return payload
+
+
+token_cache = TokenCache()
+verified_token_cache = VerifiedTokenCache()
+
+
+def get_dtable_access_token(dtable_uuid, username, permission='rw', timeout=300, is_internal=False):
+    return token_cache.get_token(dtable_uuid, username, permission=permission, timeout=timeout, is_internal=is_internal)